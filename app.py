@@ -1,19 +1,85 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
-from video_downloader import VideoDownloader
-import tempfile
-import threading
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from video_downloader import VideoDownloader, parse_clip
+from info_cache import info_cache, cache_key
+from job_queue import scheduler, QueueFullError, RetryLater
+from file_store import file_store, request_key
+from progress_store import progress_store, ThrottledProgressWriter, PROGRESS_WRITE_INTERVAL
+from file_delivery import send_download
+from pipe_through import relay_stream
+from storage import storage
+from batch import BatchJob, BATCH_MAX_ITEMS, stream_batch_zip
+from extraction_service import extraction_service
+from ydl_pool import ydl_pool
+from rate_limiter import rate_limiter, HOST_MAX_WAIT
+from metrics import registry
+from progress_model import ProgressModel
+from job_journal import job_journal, JOB_RESUME
+from bandwidth import ingress, egress, pace
+from functools import partial
+from thumbnails import thumbnail_cache, THUMBNAIL_MAX_AGE
+from werkzeug.http import quote_etag
+from werkzeug.wsgi import ClosingIterator
+import json
 import time
+import uuid
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (DEBUG also enables yt-dlp's console progress output)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
-# Global dictionary to store download progress
-download_progress = {}
+# Server-Sent Events settings for /download_progress/<id>/stream
+SSE_MAX_EVENTS_PER_SEC = float(os.environ.get('SSE_MAX_EVENTS_PER_SEC', 4))
+SSE_KEEPALIVE = 15
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 600))
+
+# Relay single-file formats straight to the client instead of downloading them first
+ENABLE_PIPE_THROUGH = os.environ.get('ENABLE_PIPE_THROUGH', '0') == '1'
+
+# Seconds a relay waits for a free network slot before the client is told to retry
+RELAY_SLOT_WAIT = 10
+
+# Identify clients by the first X-Forwarded-For address (only behind a trusted reverse proxy)
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', '0') == '1'
+
+def _client_id():
+    """Key for per-client bandwidth shares and fair queueing"""
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+def _egress_pace():
+    return partial(pace, egress, _client_id()) if egress.enabled else None
+
+def _relay_pace():
+    # A relay downloads from the media host and sends to the browser at once, so both caps apply
+    stages = [partial(pace, manager, _client_id()) for manager in (ingress, egress) if manager.enabled]
+    if not stages:
+        return None
+    
+    def paced(chunks):
+        for stage in stages:
+            chunks = stage(chunks)
+        return chunks
+    return paced
+
+def _relay_progress(download_id):
+    """report() for relay_stream that keeps the relay's progress entry current"""
+    writer = ThrottledProgressWriter(progress_store, download_id, PROGRESS_WRITE_INTERVAL)
+    
+    def report(sent, length, done):
+        fields = {'downloaded_bytes': sent, 'total_bytes': length}
+        if done is None:
+            writer.update(status='streaming', progress=round(sent * 100 / length, 1) if length else 0, **fields)
+        elif done:
+            writer.update(force=True, status='finished', progress=100, **fields)
+        else:
+            # The browser went away or the upstream failed; the link can be fetched again
+            writer.update(force=True, status='ready', **fields)
+    return report
 
 @app.route('/')
 def index():
@@ -34,6 +100,10 @@ def get_video_info():
         downloader = VideoDownloader()
         video_info = downloader.get_video_info(url)
         
+        if 'retry_after' in video_info:
+            # The site is throttling us; tell the client when to come back
+            return jsonify(video_info), 429, {'Retry-After': str(video_info['retry_after'])}
+        
         if 'error' in video_info:
             logging.error(f"Video info error: {video_info['error']}")
             return jsonify(video_info), 400
@@ -57,66 +127,326 @@ def download_video():
         if not url:
             return jsonify({'error': 'Please provide a valid URL'}), 400
         
-        downloader = VideoDownloader()
+        # Optional time range: only that part of the video is downloaded
+        try:
+            clip = parse_clip(data.get('start'), data.get('end'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        key = cache_key(url)
+        job_key = request_key(key, format_id, audio_only, file_format, clip)
+        
+        # Serve an identical earlier download straight from the finished-file store
+        stored = file_store.lookup(job_key)
+        if stored:
+            download_id = uuid.uuid4().hex
+            progress_store.set(download_id, dict(stored, status='finished', progress=100, cached=True))
+            return jsonify({'download_id': download_id, 'cached': True})
         
         # Generate unique download ID
-        download_id = str(int(time.time() * 1000))
-        download_progress[download_id] = {'progress': 0, 'status': 'starting'}
-        
-        def progress_hook(d):
-            if d['status'] == 'downloading':
-                try:
-                    percent = d.get('_percent_str', '0%').replace('%', '')
-                    if percent:
-                        download_progress[download_id]['progress'] = float(percent)
-                    download_progress[download_id]['status'] = 'downloading'
-                except (ValueError, TypeError):
-                    pass
-            elif d['status'] == 'finished':
-                download_progress[download_id]['progress'] = 90  # Still need conversion
-                download_progress[download_id]['status'] = 'converting'
-                download_progress[download_id]['filename'] = d['filename']
-            elif d['status'] == 'error':
-                download_progress[download_id]['status'] = 'error'
-                download_progress[download_id]['error'] = d.get('error', 'Unknown error')
-        
-        # Start download in background thread
-        def download_thread():
-            try:
-                result = downloader.download_video(url, format_id, audio_only, file_format, progress_hook)
-                if 'error' in result:
-                    download_progress[download_id]['status'] = 'error'
-                    download_progress[download_id]['error'] = result['error']
-                else:
-                    download_progress[download_id].update(result)
-                    if 'filename' in result:
-                        download_progress[download_id]['status'] = 'finished'
-                        download_progress[download_id]['progress'] = 100
-            except Exception as e:
-                logging.error(f"Download thread error: {str(e)}")
-                download_progress[download_id]['error'] = str(e)
-                download_progress[download_id]['status'] = 'error'
-        
-        thread = threading.Thread(target=download_thread)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'download_id': download_id})
+        download_id = uuid.uuid4().hex
+        progress_store.set(download_id, {'progress': 0, 'status': 'queued', 'queue_position': scheduler.stats()['queued'] + 1})
+        
+        # Attach to an identical job that is already queued or running
+        existing_id = progress_store.claim(job_key, download_id)
+        if existing_id:
+            progress_store.delete(download_id)
+            return jsonify({'download_id': existing_id, 'shared': True})
+        
+        # Formats that need no merge or conversion are relayed while they download. Only when the
+        # info is cached (no extraction in this request) and nothing is waiting for a network slot
+        if (ENABLE_PIPE_THROUGH and data.get('stream', True) and not clip
+                and info_cache.contains(key) and scheduler.stats()['queued'] == 0):
+            plan = VideoDownloader().plan_stream(url, format_id, audio_only, file_format)
+            if 'error' not in plan:
+                progress_store.set(download_id, {
+                    'status': 'ready',
+                    'progress': 0,
+                    'stream': True,
+                    'title': plan['title'],
+                    'filesize': plan['filesize'],
+                    '_stream': plan,
+                })
+                # A relay leaves no file behind for identical requests to share
+                progress_store.release(job_key)
+                return jsonify({'download_id': download_id, 'stream': True})
+            logging.info(f"Pipe-through not possible: {plan['error']}")
+        
+        # Queued fairly across clients, with small jobs weighing less than large ones
+        size = VideoDownloader().estimate_bytes(url, format_id, audio_only, file_format, clip)
+        try:
+            position = _submit_download(download_id, job_key, url, format_id, audio_only, file_format,
+                                        client=_client_id(), cost=size / 2 ** 20 if size else None, clip=clip)
+        except QueueFullError as e:
+            return jsonify({'error': f'Server is busy: {str(e)}. Please try again shortly.'}), 429
+        
+        return jsonify({'download_id': download_id, 'queue_position': position})
     
     except Exception as e:
         logging.error(f"Error starting download: {str(e)}")
         return jsonify({'error': f'Failed to start download: {str(e)}'}), 500
 
+def _submit_download(download_id, job_key, url, format_id, audio_only, file_format, client=None, cost=None,
+                     resumed=False, clip=None):
+    """Queue a download job and journal it; a resumed job reuses the directory of its id"""
+    job_dir = storage.create_job_dir(download_id)
+    downloader = VideoDownloader(job_dir)
+    writer = ThrottledProgressWriter(progress_store, download_id, PROGRESS_WRITE_INTERVAL)
+    # Seconds this job has spent put back while its site had no request slot
+    waited = [0]
+    
+    # Runs on a scheduler worker once the job reaches the front of the queue
+    def download_job(slots):
+        retrying = False
+        writer.update(force=True, status='starting', queue_position=None)
+        job_journal.record(download_id, 'started')
+        transfer = ingress.open(client)
+        # Bytes, speed, ETA and stage-weighted percent plus the client's bandwidth; already
+        # throttled, so every snapshot is written
+        progress = ProgressModel(lambda fields, force: writer.update(force=True, **fields, **transfer.stats()),
+                                 PROGRESS_WRITE_INTERVAL)
+        try:
+            result = downloader.download_video(url, format_id, audio_only, file_format, None, slots.postprocessor_hook,
+                                               plan_hook=lambda plan: writer.update(force=True, plan=plan),
+                                               progress_model=progress, transfer=transfer, clip=clip)
+            progress.close()
+            if 'retry_after' in result and waited[0] + result['retry_after'] <= HOST_MAX_WAIT:
+                # The site has no request slot for us yet: free the worker and run again once it has
+                waited[0] += result['retry_after']
+                retrying = True
+                writer.update(force=True, status='queued', queue_position=None)
+                raise RetryLater(result['retry_after'], result['error'])
+            if 'error' in result:
+                writer.update(force=True, status='error', error=result['error'])
+                job_journal.record(download_id, 'failed', error=result['error'])
+            else:
+                if 'filename' in result:
+                    result.update(file_store.add(job_key, result['filename'], result.get('title')))
+                    result.update(status='finished', progress=100)
+                    storage.enforce_quota()
+                writer.update(force=True, **result)
+                job_journal.record(download_id, 'finished', filename=result.get('filename'),
+                                   title=result.get('title'), filesize=result.get('filesize'))
+        except RetryLater:
+            raise
+        except Exception as e:
+            logging.error(f"Download job error: {str(e)}")
+            writer.update(force=True, status='error', error=str(e))
+            job_journal.record(download_id, 'failed', error=str(e))
+        finally:
+            progress.close()
+            transfer.close()
+            if not retrying:
+                progress_store.release(job_key)
+                storage.remove_job_dir(job_dir)
+    
+    # Journaled before it can start, so a restart at any point finds the parameters
+    if not resumed:
+        job_journal.record(download_id, 'submitted', url=url, format_id=format_id, audio_only=audio_only,
+                           file_format=file_format, job_key=job_key, job_dir=job_dir, client=client, cost=cost,
+                           clip=clip)
+    try:
+        return scheduler.submit(download_id, download_job, client, cost)
+    except QueueFullError:
+        progress_store.release(job_key)
+        progress_store.delete(download_id)
+        storage.remove_job_dir(job_dir)
+        job_journal.record(download_id, 'failed', error='queue full')
+        raise
+
+def _resume_download(job):
+    """Restart an interrupted job in its old directory; yt-dlp continues any .part files"""
+    download_id = job['id']
+    progress_store.set(download_id, {'progress': 0, 'status': 'queued', 'resumed': True,
+                                     'queue_position': scheduler.stats()['queued'] + 1})
+    existing_id = progress_store.claim(job['job_key'], download_id)
+    if existing_id and existing_id != download_id:
+        logging.info(f"Resuming download {download_id} alongside identical job {existing_id}")
+    logging.info(f"Resuming interrupted download {download_id} for {job['url']}")
+    _submit_download(download_id, job['job_key'], job['url'], job.get('format_id'), job.get('audio_only', False),
+                     job.get('file_format', 'mp4'), job.get('client'), job.get('cost'), resumed=True,
+                     clip=job.get('clip'))
+
+def _restore_download(job):
+    """Make a finished but never fetched file available under its old download id again"""
+    if progress_store.get(job['id']) is None:
+        progress_store.set(job['id'], {'status': 'finished', 'progress': 100, 'filename': job['filename'],
+                                       'title': job.get('title'), 'filesize': job.get('filesize')})
+
+@app.before_request
+def recover_jobs():
+    # On the first request rather than at import, so reloader parents and preloading masters never run jobs
+    job_journal.recover(_resume_download, _restore_download, resume_open=JOB_RESUME)
+
+@app.route('/batch_download', methods=['POST'])
+def batch_download():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        # Either one playlist/channel URL or an explicit list of video URLs
+        urls = data.get('urls') or []
+        url = data.get('url') or ''
+        if not isinstance(url, str) or not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            return jsonify({'error': 'url must be a string and urls a list of strings'}), 400
+        urls = [u.strip() for u in urls if u.strip()]
+        url = url.strip()
+        
+        # Limits must be positive integers when given (bool is an int subclass, so rule it out)
+        for name in ('concurrency', 'concurrent_fragments'):
+            value = data.get(name)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+                return jsonify({'error': f'{name} must be a positive integer'}), 400
+        if not urls and not url:
+            return jsonify({'error': 'Please provide a playlist URL or a list of URLs'}), 400
+        if len(urls) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'A batch can contain at most {BATCH_MAX_ITEMS} videos'}), 400
+        
+        batch_id = uuid.uuid4().hex
+        job = BatchJob(
+            batch_id,
+            urls or url,
+            format_id=data.get('format_id'),
+            audio_only=data.get('audio_only', False),
+            file_format=data.get('file_format', 'mp4'),
+            concurrency=data.get('concurrency'),
+            concurrent_fragments=data.get('concurrent_fragments'),
+            client=_client_id(),
+        )
+        progress_store.set(batch_id, {'progress': 0, 'status': 'queued', 'batch': True, 'items': [],
+                                      'queue_position': scheduler.stats()['queued'] + 1})
+        
+        try:
+            position = scheduler.submit(batch_id, lambda slots: job.run(scheduler, slots), job.client)
+        except QueueFullError as e:
+            progress_store.delete(batch_id)
+            return jsonify({'error': f'Server is busy: {str(e)}. Please try again shortly.'}), 429
+        
+        return jsonify({'download_id': batch_id, 'batch': True, 'queue_position': position})
+    
+    except Exception as e:
+        logging.error(f"Error starting batch download: {str(e)}")
+        return jsonify({'error': f'Failed to start batch download: {str(e)}'}), 500
+
+@app.route('/download_batch_zip/<batch_id>')
+def download_batch_zip(batch_id):
+    progress = progress_store.get(batch_id)
+    if not progress or not progress.get('batch'):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    # Streamed as items complete, so the archive can start before the batch ends
+    return Response(
+        stream_with_context(stream_batch_zip(batch_id)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="batch-{batch_id[:8]}.zip"'},
+    )
+
+def publish_queue_positions(positions):
+    """Record queue positions in the shared store so any worker can report them"""
+    for job_id, position in positions:
+        progress_store.update(job_id, {'queue_position': position})
+
+scheduler.on_queue_change = publish_queue_positions
+
+def _with_queue_position(download_id, progress):
+    if progress is None:
+        return None
+    
+    # Underscore keys (such as stream plans with media URLs) stay server-side
+    progress = {k: v for k, v in progress.items() if not k.startswith('_')}
+    if progress.get('status') == 'queued':
+        # Prefer the live position when this process owns the job
+        position = scheduler.position(download_id)
+        if position is not None:
+            progress['queue_position'] = position
+    return progress
+
 @app.route('/download_progress/<download_id>')
 def get_download_progress(download_id):
-    progress = download_progress.get(download_id, {'error': 'Download not found'})
+    progress = _with_queue_position(download_id, progress_store.get(download_id))
+    if progress is None:
+        return jsonify({'error': 'Download not found'})
     return jsonify(progress)
 
+@app.route('/download_progress/<download_id>/stream')
+def stream_download_progress(download_id):
+    """Push progress updates as Server-Sent Events, at most SSE_MAX_EVENTS_PER_SEC per client"""
+    # A sync worker serves one request at a time, so a held-open stream would block every
+    # other request; 204 tells EventSource not to reconnect and the page polls instead
+    if not request.environ.get('wsgi.multithread'):
+        return Response(status=204)
+
+    min_interval = 1.0 / SSE_MAX_EVENTS_PER_SEC if SSE_MAX_EVENTS_PER_SEC > 0 else 0
+    
+    def generate():
+        started = time.monotonic()
+        last_sent = 0.0
+        version = object()  # never equal to a real version, so the first state is sent at once
+        
+        # Reconnect quickly if the stream drops
+        yield 'retry: 1000\n\n'
+        
+        while time.monotonic() - started < SSE_MAX_DURATION:
+            progress, new_version = progress_store.wait_for_change(download_id, version, SSE_KEEPALIVE)
+            if new_version == version:
+                yield ': keepalive\n\n'
+                continue
+            
+            # Coalesce bursts: wait out the rate limit, then send only the latest state
+            wait = last_sent + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                # A zero timeout just reads the current state
+                progress, new_version = progress_store.wait_for_change(download_id, None, 0)
+            version = new_version
+            last_sent = time.monotonic()
+            
+            progress = _with_queue_position(download_id, progress)
+            if progress is None:
+                yield f"data: {json.dumps({'error': 'Download not found'})}\n\n"
+                return
+            
+            yield f"data: {json.dumps(progress)}\n\n"
+            if progress.get('status') in ('finished', 'error'):
+                return
+        # Past SSE_MAX_DURATION the stream closes and the browser reconnects,
+        # so a long download does not hold the same worker thread indefinitely
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 @app.route('/download_file/<download_id>')
 def download_file(download_id):
     try:
-        progress = download_progress.get(download_id)
-        if not progress or 'filename' not in progress:
+        progress = progress_store.get(download_id)
+        
+        # Single item of a batch: /download_file/<batch_id>?item=<index>
+        item_index = request.args.get('item', type=int)
+        if progress and progress.get('batch') and item_index is not None:
+            items = progress.get('items') or []
+            progress = items[item_index] if 0 <= item_index < len(items) else None
+        
+        if progress and '_stream' in progress:
+            # Relays count against the same network slots as queued downloads
+            slots = scheduler.reserve_download(RELAY_SLOT_WAIT)
+            if slots is None:
+                return jsonify({'error': 'Server is busy. Please try again shortly.'}), 429, {'Retry-After': '5'}
+            plan = progress['_stream']
+            response = relay_stream(plan, f"{plan['title']}.{plan['ext']}", _relay_pace(),
+                                    report=_relay_progress(download_id))
+            if isinstance(response, tuple):
+                slots.release()
+            else:
+                # The body is passed straight to the server, which closes it when the relay ends
+                response.response = ClosingIterator(response.response, slots.release)
+            return response
+        
+        # Only a finished job's filename is the final file; anything earlier may still be rewritten
+        if not progress or progress.get('status') != 'finished' or 'filename' not in progress:
             return jsonify({'error': 'File not ready or not found'}), 404
         
         filename = progress['filename']
@@ -126,12 +456,78 @@ def download_file(download_id):
         # Get original filename for download
         original_name = os.path.basename(filename)
         
-        return send_file(filename, as_attachment=True, download_name=original_name)
+        storage.mark_served(filename)
+        if item_index is None:
+            job_journal.record(download_id, 'served')
+        return send_download(filename, original_name, pace=_egress_pace())
     
     except Exception as e:
         logging.error(f"Error downloading file: {str(e)}")
         return jsonify({'error': f'Failed to download file: {str(e)}'}), 500
 
+@app.route('/thumbnail/<thumb_id>')
+def thumbnail(thumb_id):
+    """Thumbnail registered by /get_video_info, resized to ?w= (snapped to the sizes the UI uses)"""
+    try:
+        result = thumbnail_cache.get(thumb_id, request.args.get('w', type=int))
+    except OSError as e:
+        logging.warning(f"Thumbnail {thumb_id} could not be fetched: {str(e)}")
+        return jsonify({'error': 'Thumbnail could not be fetched'}), 502
+    if result is None:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    
+    data, mimetype, etag = result
+    headers = {'Cache-Control': f'public, max-age={THUMBNAIL_MAX_AGE}', 'ETag': quote_etag(etag)}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype=mimetype, headers=headers)
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'info_cache': info_cache.stats(),
+        'scheduler': scheduler.stats(),
+        'storage': storage.stats(),
+        'extraction': extraction_service.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'bandwidth': {'ingress': ingress.stats(), 'egress': egress.stats()},
+        'thumbnails': thumbnail_cache.stats(),
+    })
+
+@registry.collector
+def service_metrics():
+    """Scrape-time values kept by the scheduler, caches and storage"""
+    queue = scheduler.stats()
+    cache = info_cache.stats()
+    disk = storage.disk_usage()
+    pool = ydl_pool.stats()
+    extraction = extraction_service.stats()
+    families = [
+        ('ytdown_queue_depth', 'gauge', 'Download jobs waiting for a worker', [({}, queue['queued'])]),
+        ('ytdown_active_jobs', 'gauge', 'Download jobs running on a worker', [({}, queue['active'])]),
+        ('ytdown_info_cache_requests_total', 'counter', 'Info cache lookups by result',
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+        ('ytdown_info_cache_entries', 'gauge', 'Extractions held in the info cache', [({}, cache['entries'])]),
+        ('ytdown_ydl_pool_leases_total', 'counter', 'yt-dlp instances handed out, by whether one was reused',
+         [({'result': 'reused'}, pool['reused']), ({'result': 'created'}, pool['created'])]),
+        ('ytdown_storage_bytes', 'gauge', 'Bytes on disk under the download root',
+         [({'area': 'jobs'}, disk['jobs_bytes']), ({'area': 'files'}, disk['files_bytes'])]),
+        ('ytdown_storage_quota_bytes', 'gauge', 'Storage quota for downloads', [({}, storage.quota_bytes)]),
+    ]
+    if disk['free_bytes'] is not None:
+        families.append(('ytdown_storage_free_bytes', 'gauge', 'Free space on the download volume', [({}, disk['free_bytes'])]))
+    families.append(('ytdown_bandwidth_bytes_per_second', 'gauge', 'Current shaped throughput by direction',
+                     [({'direction': 'ingress'}, ingress.stats()['throughput']),
+                      ({'direction': 'egress'}, egress.stats()['throughput'])]))
+    families.append(('ytdown_extractions_pending', 'gauge', 'Extractions queued or running in the async front end',
+                     [({}, extraction['pending'])]))
+    return families
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 # For Vercel deployment
 app.wsgi_app = app.wsgi_app
 
@@ -1,7 +1,7 @@
 import os
+import time
 import logging
 from flask import Flask, render_template, request, jsonify
-from video_downloader_vercel import VideoDownloader
 
 # Configure logging for Vercel
 logging.basicConfig(level=logging.INFO)
@@ -9,6 +9,20 @@ logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-vercel")
 
+_downloader = None
+
+def get_downloader():
+    """Downloader shared by warm invocations, imported on first use.
+
+    Keeps the downloader modules (and yt-dlp behind them) out of cold starts
+    that only serve /, /health or static files.
+    """
+    global _downloader
+    if _downloader is None:
+        from video_downloader_vercel import VideoDownloader
+        _downloader = VideoDownloader()
+    return _downloader
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -25,9 +39,12 @@ def get_video_info():
         
         logging.info(f"Analyzing URL: {url}")
         
-        downloader = VideoDownloader()
+        downloader = get_downloader()
         video_info = downloader.get_video_info(url)
         
+        if 'retry_after' in video_info:
+            return jsonify(video_info), 429, {'Retry-After': str(video_info['retry_after'])}
+        
         if 'error' in video_info:
             logging.error(f"Video info error: {video_info['error']}")
             return jsonify(video_info), 400
@@ -54,7 +71,7 @@ def download_video():
         
         logging.info(f"Starting download: {url}, Quality: {quality}, Format: {file_format}")
         
-        downloader = VideoDownloader()
+        downloader = get_downloader()
         
         # Simplified download for serverless environment
         try:
@@ -65,6 +82,8 @@ def download_video():
                     'message': 'Download completed successfully',
                     'filename': os.path.basename(result['filepath'])
                 })
+            elif result and 'retry_after' in result:
+                return jsonify(result), 429, {'Retry-After': str(result['retry_after'])}
             else:
                 return jsonify({'error': 'Download failed'}), 500
                 
@@ -81,6 +100,15 @@ def download_video():
 def health_check():
     return jsonify({'status': 'healthy', 'service': 'ytdown'})
 
+# Warm-up ping (e.g. from a cron job): pays the yt-dlp import before a user's first analyze does
+@app.route('/warmup')
+def warmup():
+    started = time.perf_counter()
+    get_downloader()
+    from video_downloader_vercel import warm_up
+    warm_up()
+    return jsonify({'status': 'warm', 'seconds': round(time.perf_counter() - started, 3)})
+
 # For Vercel deployment
 app.wsgi_app = app.wsgi_app
 
@@ -0,0 +1,224 @@
+# ASGI entry point: /get_video_info is served on asyncio, everything else by the Flask app.
+#
+#   gunicorn -k asgi --bind 0.0.0.0:5000 asgi:app     (gunicorn 24+)
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from extraction_service import extraction_service, ExtractionOverloaded
+from video_downloader import INFO_OPTS
+from ydl_pool import ydl_pool
+from rate_limiter import rate_limiter
+
+# Configure logging (DEBUG also enables yt-dlp's console progress output)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+MAX_BODY_SIZE = 64 * 1024
+
+# Threads serving the Flask routes; every open progress stream or file download holds one
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+
+_flask_asgi = None
+_wsgi_executor = None
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    """One Flask request, run on a thread of the shared WSGI pool.
+
+    asgiref runs every WSGI request on the same thread, so a single open
+    progress stream would hold up all other routes. This also closes the
+    response iterable, as WSGI servers do, and stops sending once the client
+    has disconnected.
+    """
+
+    async def __call__(self, scope, receive, send):
+        self.receive = receive
+        self.disconnected = False
+        await super().__call__(scope, receive, send)
+
+    async def run_wsgi_app(self, body):
+        watcher = asyncio.ensure_future(self._watch_disconnect())
+        try:
+            await asyncio.get_running_loop().run_in_executor(_wsgi_executor, self._run, body)
+        finally:
+            watcher.cancel()
+
+    async def _watch_disconnect(self):
+        await _wait_for_disconnect(self.receive)
+        self.disconnected = True
+
+    def _run(self, body):
+        environ = self.build_environ(self.scope, body)
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            sent = 0
+            for output in response:
+                if self.disconnected:
+                    return
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # Never send more than the Content-Length the app announced
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - sent]
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+                sent += len(output)
+                if sent == self.response_content_length:
+                    break
+            if not self.response_started:
+                self.response_started = True
+                self.sync_send(self.response_start)
+            self.sync_send({'type': 'http.response.body'})
+        finally:
+            # Slot releases and other ClosingIterator callbacks run here
+            if hasattr(response, 'close'):
+                response.close()
+
+
+class _ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+def _get_flask_asgi():
+    # Imported on first use so the extraction path never pays for the Flask app
+    global _flask_asgi, _wsgi_executor
+    if _flask_asgi is None:
+        from app import app as flask_app
+        _wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+        _flask_asgi = _ThreadedWsgiToAsgi(flask_app)
+    return _flask_asgi
+
+
+async def _send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    response_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('ascii')),
+    ]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode('ascii'), str(value).encode('latin-1')))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': response_headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_SIZE:
+            raise ValueError('Request body too large')
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def get_video_info(scope, receive, send):
+    try:
+        body = await _read_body(receive)
+    except ValueError as e:
+        await _send_json(send, 413, {'error': str(e)})
+        return
+    if body is None:
+        return
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not data:
+        await _send_json(send, 400, {'error': 'No JSON data provided'})
+        return
+
+    url = str(data.get('url') or '').strip()
+    if not url:
+        await _send_json(send, 400, {'error': 'Please provide a valid URL'})
+        return
+
+    logging.info(f"Analyzing URL: {url}")
+
+    # Fail fast while the site's circuit is open instead of occupying a thread
+    if rate_limiter.is_open(url):
+        retry_after = rate_limiter.retry_after(url)
+        await _send_json(send, 429, {'error': 'The site is limiting requests right now. Please try again later.',
+                                     'retry_after': retry_after}, {'Retry-After': retry_after})
+        return
+
+    # Race the extraction against the client hanging up
+    extraction = asyncio.ensure_future(extraction_service.get_video_info(url))
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    await asyncio.wait({extraction, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+
+    if not extraction.done():
+        extraction.cancel()
+        logging.info(f"Client disconnected while analyzing {url}")
+        return
+    disconnect.cancel()
+
+    try:
+        video_info = extraction.result()
+    except asyncio.TimeoutError:
+        logging.error(f"Timed out analyzing {url}")
+        await _send_json(send, 504, {'error': 'Timed out while getting video information. Please try again.'})
+        return
+    except ExtractionOverloaded as e:
+        await _send_json(send, 503, {'error': f'Server is busy: {str(e)}. Please try again shortly.'})
+        return
+    except Exception as e:
+        logging.error(f"Error getting video info: {str(e)}", exc_info=True)
+        await _send_json(send, 500, {'error': f'Failed to get video information: {str(e)}'})
+        return
+
+    if 'retry_after' in video_info:
+        await _send_json(send, 429, video_info, {'Retry-After': video_info['retry_after']})
+        return
+
+    if 'error' in video_info:
+        logging.error(f"Video info error: {video_info['error']}")
+        await _send_json(send, 400, video_info)
+        return
+
+    logging.info(f"Video info retrieved successfully for: {video_info.get('title', 'Unknown')}")
+    await _send_json(send, 200, video_info)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Build extraction instances in the background so the first requests skip setup
+            asyncio.get_running_loop().run_in_executor(
+                None, ydl_pool.prewarm, 'info', INFO_OPTS, min(extraction_service.max_workers, ydl_pool.max_idle))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            extraction_service.shutdown()
+            ydl_pool.clear()
+            if _wsgi_executor is not None:
+                _wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/get_video_info' and scope['method'] == 'POST':
+        await get_video_info(scope, receive, send)
+    else:
+        await _get_flask_asgi()(scope, receive, send)
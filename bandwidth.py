@@ -0,0 +1,227 @@
+import os
+import math
+import time
+import threading
+
+
+def parse_rate(value):
+    """Bytes per second from '500K', '2.5M', '1G' or a plain number; None when unset or 0"""
+    value = (value or '').strip().upper().rstrip('/S').rstrip('B')
+    if not value:
+        return None
+    multiplier = 1
+    if value[-1] in 'KMG':
+        multiplier = 1024 ** ('KMG'.index(value[-1]) + 1)
+        value = value[:-1]
+    rate = float(value) * multiplier
+    return rate if rate > 0 else None
+
+
+# Total speed of downloads from media hosts, shared by every job in this process
+BANDWIDTH_LIMIT = parse_rate(os.environ.get('BANDWIDTH_LIMIT', '0'))
+
+# Download speed allowed to all jobs of one client together
+CLIENT_BANDWIDTH_LIMIT = parse_rate(os.environ.get('CLIENT_BANDWIDTH_LIMIT', '0'))
+
+# Same limits for files sent to browsers by /download_file and pipe-through relays
+EGRESS_BANDWIDTH_LIMIT = parse_rate(os.environ.get('EGRESS_BANDWIDTH_LIMIT', '0'))
+CLIENT_EGRESS_LIMIT = parse_rate(os.environ.get('CLIENT_EGRESS_LIMIT', '0'))
+
+# Seconds of traffic a transfer may send at once after being idle
+BANDWIDTH_BURST = float(os.environ.get('BANDWIDTH_BURST', 1.0))
+
+# Half-life in seconds of the rolling throughput reported per client
+THROUGHPUT_HALFLIFE = 3.0
+
+
+class TokenBucket:
+    """Rate limiter that lets callers go into debt and tells them how long to sleep it off"""
+
+    def __init__(self, rate=None, burst=BANDWIDTH_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = (rate or 0) * burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.rate * self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if rate:
+                self._tokens = min(self._tokens, rate * self.burst)
+
+    def consume(self, amount):
+        """Take amount tokens and return the seconds the caller must wait (0 when within rate)"""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class Transfer:
+    """One job's (or one response's) traffic, paced at its fair share of the bandwidth.
+
+    Bytes are reported after they moved, from a yt-dlp progress hook or by
+    a paced response body (see pace()); the caller then sleeps until its token bucket
+    allows that much. Because the sleep happens on the thread doing the
+    transfer, this works the same for plain HTTP, fragmented DASH/HLS and
+    concurrent fragment downloads.
+    """
+
+    def __init__(self, manager, client):
+        self.manager = manager
+        self.client = client
+        self.bucket = TokenBucket()
+        self.share = None
+        self.bytes = 0
+        self.throughput = None
+        self._window_bytes = 0.0
+        self._window_time = 0.0
+        self._last_time = None
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def ceiling(self, connections=1):
+        """Per-connection speed for yt-dlp's ratelimit: no single download may exceed its client's cap"""
+        cap = self.manager.client_limit or self.manager.limit
+        if not cap:
+            return None
+        return max(1, int(cap / max(1, connections or 1)))
+
+    def throttle(self, amount):
+        if amount <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._last_time is not None and now > self._last_time:
+                # Decayed sums of bytes and time, so uneven block sizes do not skew the rate
+                dt = now - self._last_time
+                decay = math.exp(-dt * math.log(2) / THROUGHPUT_HALFLIFE)
+                self._window_bytes = self._window_bytes * decay + amount
+                self._window_time = self._window_time * decay + dt
+                self.throughput = self._window_bytes / self._window_time
+            self._last_time = now
+            self.bytes += amount
+        wait = self.bucket.consume(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    def current_throughput(self):
+        # A transfer that stopped reporting is not moving data
+        if self.throughput is None or time.monotonic() - self._last_time > 2 * THROUGHPUT_HALFLIFE:
+            return 0.0
+        return self.throughput
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook: pace the download by the bytes received since the last call"""
+        if d.get('status') not in ('downloading', 'finished'):
+            return
+        key = d.get('tmpfilename') or d.get('filename')
+        done = d.get('downloaded_bytes') or 0
+        with self._lock:
+            last = self._seen.get(key)
+            self._seen[key] = done
+        # The first report of a resumed .part file includes bytes fetched before the restart
+        if last is not None:
+            self.throttle(done - last)
+
+    def stats(self):
+        """Fields added to the job's progress entry"""
+        return {
+            'bandwidth_share': int(self.share) if self.share else None,
+            'client_throughput': int(self.manager.client_throughput(self.client)),
+        }
+
+    def close(self):
+        self.manager.release(self)
+
+
+class BandwidthManager:
+    """Splits a global and a per-client bandwidth cap across the transfers that are running.
+
+    Every client with a running transfer gets an equal share of the global
+    limit (at most the per-client limit), however many jobs it started; a
+    client's share is split evenly between its transfers. Shares are
+    recomputed whenever a transfer starts or ends.
+    """
+
+    def __init__(self, limit=None, client_limit=None):
+        self.limit = limit
+        self.client_limit = client_limit
+        self._transfers = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.limit or self.client_limit)
+
+    def open(self, client):
+        transfer = Transfer(self, client)
+        with self._lock:
+            self._transfers.append(transfer)
+            self._rebalance()
+        return transfer
+
+    def release(self, transfer):
+        with self._lock:
+            if transfer in self._transfers:
+                self._transfers.remove(transfer)
+                self._rebalance()
+
+    def _rebalance(self):
+        by_client = {}
+        for transfer in self._transfers:
+            by_client.setdefault(transfer.client, []).append(transfer)
+
+        # Every active client gets the same share of the global limit, never more than its own cap
+        share = self.client_limit
+        if self.limit and by_client:
+            fair = self.limit / len(by_client)
+            share = min(fair, self.client_limit) if self.client_limit else fair
+
+        for client, transfers in by_client.items():
+            per_transfer = share / len(transfers) if share else None
+            for transfer in transfers:
+                transfer.share = per_transfer
+                transfer.bucket.set_rate(per_transfer)
+
+    def client_throughput(self, client):
+        with self._lock:
+            transfers = [transfer for transfer in self._transfers if transfer.client == client]
+        return sum(transfer.current_throughput() for transfer in transfers)
+
+    def stats(self):
+        with self._lock:
+            transfers = list(self._transfers)
+        return {
+            'limit': self.limit,
+            'client_limit': self.client_limit,
+            'transfers': len(transfers),
+            'clients': len({transfer.client for transfer in transfers}),
+            'throughput': int(sum(transfer.current_throughput() for transfer in transfers)),
+        }
+
+
+def pace(manager, client, chunks):
+    """Yield a response body's chunks at the client's share of manager's bandwidth"""
+    # Opened on the first chunk, so a response that is never sent holds no share
+    transfer = manager.open(client)
+    try:
+        for chunk in chunks:
+            yield chunk
+            transfer.throttle(len(chunk))
+    finally:
+        transfer.close()
+
+
+# Downloads from media hosts, and files sent to clients, in this process
+ingress = BandwidthManager(BANDWIDTH_LIMIT, CLIENT_BANDWIDTH_LIMIT)
+egress = BandwidthManager(EGRESS_BANDWIDTH_LIMIT, CLIENT_EGRESS_LIMIT)
@@ -0,0 +1,281 @@
+import os
+import time
+import logging
+import threading
+import zipfile
+from video_downloader import VideoDownloader
+from info_cache import cache_key
+from file_store import file_store, request_key
+from job_queue import RetryLater, QueueFullError
+from rate_limiter import HOST_MAX_WAIT
+from progress_store import progress_store, ThrottledProgressWriter, PROGRESS_WRITE_INTERVAL
+from storage import storage
+from progress_model import ProgressModel
+from bandwidth import ingress
+
+# Largest number of videos accepted in one batch
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+
+# Items of one batch downloaded at the same time
+BATCH_ITEM_CONCURRENCY = int(os.environ.get('BATCH_ITEM_CONCURRENCY', 3))
+
+
+class BatchJob:
+    """Downloads several videos as one job and rolls their progress into one entry.
+
+    Listing runs as a scheduler job; each item then goes through the shared
+    scheduler as a job of its own, under the batch's client, so items wait
+    in the fair-share queue and take network and CPU slots like any other
+    download. At most `concurrency` items of a batch are submitted at once;
+    each finished item submits the next. Items claim their request key like
+    single downloads: one whose identical download is already running is put
+    back until that download has stored its file, then served from it.
+    """
+
+    # Seconds an item waits before checking again on an identical download that is still running
+    SHARED_RETRY = 2.0
+
+    def __init__(self, batch_id, source, format_id=None, audio_only=False, file_format='mp4',
+                 concurrency=None, concurrent_fragments=None, client=None):
+        self.batch_id = batch_id
+        self.source = source
+        self.format_id = format_id
+        self.audio_only = audio_only
+        self.file_format = file_format
+        self.concurrency = max(1, min(concurrency or BATCH_ITEM_CONCURRENCY, BATCH_ITEM_CONCURRENCY))
+        self.concurrent_fragments = concurrent_fragments
+        self.client = client
+        self.items = []
+        self._next = 0
+        self._remaining = 0
+        self._lock = threading.Lock()
+        self._writer = ThrottledProgressWriter(progress_store, batch_id, PROGRESS_WRITE_INTERVAL)
+
+    def _resolve_items(self):
+        """Flat-list the source (a playlist URL or a list of URLs) without resolving formats"""
+        urls = self.source if isinstance(self.source, list) else [self.source]
+        entries = []
+        for url in urls:
+            entries.extend(VideoDownloader().list_entries(url))
+            if len(entries) >= BATCH_MAX_ITEMS:
+                break
+        return entries[:BATCH_MAX_ITEMS]
+
+    def _publish(self, force=False):
+        with self._lock:
+            items = [dict(item) for item in self.items]
+        done = [item for item in items if item['status'] in ('finished', 'error')]
+        overall = sum(item['progress'] for item in items) / len(items) if items else 0
+        self._writer.update(
+            force=force,
+            items=items,
+            total=len(items),
+            completed=len(done),
+            progress=round(overall, 1),
+        )
+
+    def _set_item(self, index, force=False, **fields):
+        with self._lock:
+            self.items[index].update(fields)
+        self._publish(force=force)
+
+    def _item_id(self, index):
+        return f'{self.batch_id}-{index}'
+
+    def _download_item(self, scheduler, index, slots):
+        """Scheduler job for one item; raises RetryLater to be queued again"""
+        item = self.items[index]
+        item_id = self._item_id(index)
+        job_key = request_key(cache_key(item['url']), self.format_id, self.audio_only, self.file_format)
+
+        stored = file_store.lookup(job_key)
+        if stored:
+            self._set_item(index, force=True, status='finished', progress=100, cached=True,
+                           filename=stored['filename'], title=stored['title'])
+            self._item_done(scheduler)
+            return
+
+        # The item's own entry lets identical single downloads attach to it, and it to them
+        progress_store.set(item_id, {'status': 'starting', 'progress': 0})
+        if progress_store.claim(job_key, item_id):
+            progress_store.delete(item_id)
+            self._set_item(index, force=True, status='queued')
+            raise RetryLater(self.SHARED_RETRY, 'an identical download is running')
+
+        job_dir = storage.create_job_dir(item_id)
+        retrying = False
+
+        # Items share their client's bandwidth with its other jobs
+        transfer = ingress.open(self.client)
+        progress = ProgressModel(lambda fields, force: self._set_item(index, force=force, **fields, **transfer.stats()),
+                                 PROGRESS_WRITE_INTERVAL)
+
+        try:
+            self._set_item(index, force=True, status='starting')
+            result = VideoDownloader(job_dir).download_video(
+                item['url'], self.format_id, self.audio_only, self.file_format,
+                None, slots.postprocessor_hook, self.concurrent_fragments,
+                plan_hook=lambda plan: self._set_item(index, force=True, plan=plan),
+                progress_model=progress,
+                transfer=transfer,
+            )
+            progress.close()
+            if 'retry_after' in result and item.get('waited', 0) + result['retry_after'] <= HOST_MAX_WAIT:
+                # Put back like a single download while the site has no request slot
+                retrying = True
+                self._set_item(index, force=True, status='queued', waited=item.get('waited', 0) + result['retry_after'])
+                raise RetryLater(result['retry_after'], result['error'])
+            if 'error' in result:
+                self._set_item(index, force=True, status='error', error=result['error'])
+                progress_store.update(item_id, {'status': 'error', 'error': result['error']})
+                return
+            meta = file_store.add(job_key, result['filename'], result.get('title'))
+            self._set_item(index, force=True, status='finished', progress=100,
+                           filename=meta['filename'], title=meta['title'])
+            progress_store.update(item_id, dict(meta, status='finished', progress=100))
+        except RetryLater:
+            raise
+        except Exception as e:
+            logging.error(f"Batch {self.batch_id} item {index} failed: {str(e)}")
+            self._set_item(index, force=True, status='error', error=str(e))
+            progress_store.update(item_id, {'status': 'error', 'error': str(e)})
+        finally:
+            progress.close()
+            transfer.close()
+            if retrying:
+                progress_store.delete(item_id)
+            progress_store.release(job_key)
+            storage.remove_job_dir(job_dir)
+            if not retrying:
+                self._item_done(scheduler)
+
+    def _submit_next(self, scheduler):
+        """Queue the next item that has not been submitted; False when there is none"""
+        with self._lock:
+            if self._next >= len(self.items):
+                return False
+            index = self._next
+            self._next += 1
+        try:
+            scheduler.submit(self._item_id(index), lambda slots: self._download_item(scheduler, index, slots),
+                             self.client)
+        except QueueFullError as e:
+            self._set_item(index, force=True, status='error', error=f'Server is busy: {str(e)}')
+            self._item_done(scheduler)
+        return True
+
+    def _item_done(self, scheduler):
+        with self._lock:
+            self._remaining -= 1
+            remaining = self._remaining
+        if remaining == 0:
+            with self._lock:
+                failed = sum(1 for item in self.items if item['status'] == 'error')
+            status = 'error' if failed == len(self.items) else 'finished'
+            self._writer.update(force=True, status=status, failed=failed)
+            self._publish(force=True)
+            return
+        self._submit_next(scheduler)
+
+    def run(self, scheduler, slots):
+        """Scheduler entry point: list the items, then queue the first `concurrency` of them"""
+        self._writer.update(force=True, status='listing', queue_position=None)
+
+        try:
+            entries = self._resolve_items()
+        except Exception as e:
+            logging.error(f"Batch {self.batch_id} listing failed: {str(e)}")
+            self._writer.update(force=True, status='error', error=f'Failed to list videos: {str(e)}')
+            return
+
+        if not entries:
+            self._writer.update(force=True, status='error', error='No videos found')
+            return
+
+        with self._lock:
+            self.items = [
+                {'url': entry['url'], 'title': entry['title'], 'status': 'queued', 'progress': 0}
+                for entry in entries
+            ]
+            self._remaining = len(self.items)
+        self._writer.update(force=True, status='downloading')
+        self._publish(force=True)
+
+        for _ in range(self.concurrency):
+            if not self._submit_next(scheduler):
+                break
+
+
+class _ZipSink:
+    """Write-only file object that collects zip output so it can be yielded in pieces"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        parts, self.parts = self.parts, []
+        return b''.join(parts)
+
+
+def stream_batch_zip(batch_id, poll_timeout=5.0, read_size=256 * 1024):
+    """Yield a zip archive of a batch's outputs, adding each item as soon as it finishes"""
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+    added = set()
+    used_names = set()
+    version = None
+
+    while True:
+        progress, version = progress_store.wait_for_change(batch_id, version, poll_timeout)
+        if progress is None:
+            break
+
+        for index, item in enumerate(progress.get('items') or []):
+            if index in added or item.get('status') != 'finished':
+                continue
+            added.add(index)
+            filename = item.get('filename')
+            if not filename or not os.path.isfile(filename):
+                continue
+
+            # Keep names unique inside the archive
+            name = os.path.basename(filename)
+            stem, ext = os.path.splitext(name)
+            counter = 1
+            while name in used_names:
+                counter += 1
+                name = f'{stem} ({counter}){ext}'
+            used_names.add(name)
+
+            storage.mark_served(filename)
+            info = zipfile.ZipInfo(name, date_time=time.localtime(os.path.getmtime(filename))[:6])
+            with open(filename, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(read_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+
+        if progress.get('status') in ('finished', 'error'):
+            break
+
+    archive.close()
+    yield sink.drain()
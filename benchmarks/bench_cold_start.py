@@ -0,0 +1,130 @@
+"""Measure cold starts of the serverless entry point against a time budget.
+
+Each run starts a fresh interpreter (a new container, as far as Python is
+concerned) and times:
+
+    import         importing the entry module
+    first_health   the first GET /health (what the platform's health check sees)
+    first_info     the first POST /get_video_info (yt-dlp import + pool instance + extraction)
+    warm_info      a second analyze of another stub page in the same process
+    cached_info    the first page analyzed again (info cache hit)
+
+The cold path (import + first_health) is compared with --budget-ms; the
+script exits with status 1 when the median is over budget.
+
+    python benchmarks/bench_cold_start.py --runs 5 --budget-ms 400
+    python benchmarks/bench_cold_start.py --entry app     # the full Flask app, for comparison
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that should stay unimported until a request needs them
+HEAVY_MODULES = ('yt_dlp', 'video_downloader_vercel', 'video_downloader', 'ydl_pool', 'format_index')
+
+
+def child(entry, base_url):
+    """One cold start, run in a fresh interpreter; prints its timings as JSON"""
+    sys.path.insert(0, REPO_ROOT)
+    timings = {}
+
+    started = time.perf_counter()
+    module = __import__(entry)
+    timings['import'] = time.perf_counter() - started
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    client = module.app.test_client()
+
+    started = time.perf_counter()
+    status = client.get('/health').status_code if entry == 'app_vercel' else client.get('/').status_code
+    timings['first_health'] = time.perf_counter() - started
+    loaded_after_health = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    def analyze(name):
+        began = time.perf_counter()
+        response = client.post('/get_video_info', json={'url': f'{base_url}/page/{name}'})
+        return time.perf_counter() - began, response.status_code
+
+    timings['first_info'], info_status = analyze('cold-a')
+    timings['warm_info'], _ = analyze('cold-b')
+    timings['cached_info'], _ = analyze('cold-a')
+
+    print(json.dumps({
+        'timings': timings,
+        'health_status': status,
+        'info_status': info_status,
+        'loaded_after_health': loaded_after_health,
+    }))
+
+
+def ms(value):
+    return round(value * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entry', choices=['app_vercel', 'app'], default='app_vercel')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=400,
+                        help='target for import + first /health (median over runs)')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.entry, args.base_url)
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    from stub_media_server import start_stub_server
+    stub = start_stub_server(media_size=256 * 1024)
+
+    env = dict(os.environ, HOST_RATE_LIMIT='0', PYTHONDONTWRITEBYTECODE='0')
+    runs = []
+    try:
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', '--entry', args.entry, '--base-url', stub.base_url],
+                cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        stub.shutdown()
+
+    def summary(key):
+        values = [run['timings'][key] for run in runs]
+        return {'median_ms': ms(statistics.median(values)), 'max_ms': ms(max(values))}
+
+    cold = [run['timings']['import'] + run['timings']['first_health'] for run in runs]
+    cold_median = ms(statistics.median(cold))
+    results = {
+        'benchmark': 'cold_start',
+        'entry': args.entry,
+        'runs': args.runs,
+        'budget_ms': args.budget_ms,
+        'cold_path_ms': {'median': cold_median, 'max': ms(max(cold))},
+        'within_budget': cold_median <= args.budget_ms,
+        'stages': {key: summary(key) for key in ('import', 'first_health', 'first_info', 'warm_info', 'cached_info')},
+        'loaded_after_health': runs[0]['loaded_after_health'],
+        'info_status': runs[0]['info_status'],
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if not results['within_budget']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Load-test /get_video_info against a local stub site and report latency percentiles.
+
+Each request analyzes a distinct stub page that answers after --delay seconds,
+so every request is a real yt-dlp extraction (no info-cache hits unless
+--same-url is given). Servers:
+
+    asgi   gunicorn -k asgi asgi:app (async front end, bounded extraction pool)
+    sync   gunicorn main:app with one sync worker (the classic deployment)
+    inproc asgi.app driven directly in this process, without a server
+
+    python benchmarks/bench_extraction_load.py --server asgi --concurrency 200 --requests 400
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+# Every request goes to the same local stub host; measure the server, not the per-host limiter
+os.environ.setdefault('HOST_RATE_LIMIT', '0')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_media_server import start_stub_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(server, port, env):
+    if server == 'asgi':
+        cmd = [sys.executable, '-m', 'gunicorn', '-k', 'asgi', '--workers', '1',
+               '--worker-connections', '2000', '--backlog', '2048', '--bind', f'127.0.0.1:{port}', 'asgi:app']
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '--workers', '1', '--timeout', '300',
+               '--backlog', '2048', '--bind', f'127.0.0.1:{port}', 'main:app']
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{server} did not start on port {port}')
+
+
+async def post_over_http(port, payload, timeout):
+    body = json.dumps(payload).encode('utf-8')
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(
+            b'POST /get_video_info HTTP/1.1\r\n'
+            b'Host: 127.0.0.1\r\n'
+            b'Content-Type: application/json\r\n'
+            b'Connection: close\r\n'
+            + f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii') + body
+        )
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status_line = response.split(b'\r\n', 1)[0].split()
+    return int(status_line[1]) if len(status_line) > 1 else 0
+
+
+async def post_in_process(app, payload, timeout):
+    body = json.dumps(payload).encode('utf-8')
+    sent_body = False
+    status = 0
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif not message.get('more_body'):
+            finished.set()
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/get_video_info', 'headers': []}
+    try:
+        await asyncio.wait_for(app(scope, receive, send), timeout)
+    finally:
+        finished.set()
+    return status
+
+
+async def run_load(send_one, urls, concurrency, timeout):
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(url):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await send_one({'url': url}, timeout)
+            except (asyncio.TimeoutError, OSError):
+                status = 'timeout'
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(url) for url in urls))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=['asgi', 'sync', 'inproc'], default='asgi')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds the stub site takes per page')
+    parser.add_argument('--timeout', type=float, default=120, help='client-side timeout per request')
+    parser.add_argument('--same-url', action='store_true', help='analyze one URL repeatedly (cache/coalescing)')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    stub = start_stub_server(page_delay=args.delay)
+    urls = [f'{stub.base_url}/page/{"same" if args.same_url else f"v{i}"}' for i in range(args.requests)]
+
+    proc = None
+    if args.server == 'inproc':
+        import logging
+        from asgi import app
+        logging.getLogger().setLevel(logging.WARNING)
+
+        async def send_one(payload, timeout):
+            return await post_in_process(app, payload, timeout)
+    else:
+        port = free_port()
+        proc = start_server(args.server, port, dict(os.environ))
+
+        async def send_one(payload, timeout):
+            return await post_over_http(port, payload, timeout)
+
+    try:
+        latencies, statuses, wall = asyncio.run(run_load(send_one, urls, args.concurrency, args.timeout))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        stub.shutdown()
+
+    results = {
+        'benchmark': 'extraction_load',
+        'server': args.server,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'stub_delay_s': args.delay,
+        'same_url': args.same_url,
+        'statuses': statuses,
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(args.requests / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 1),
+            'p90': round(percentile(latencies, 90) * 1000, 1),
+            'p99': round(percentile(latencies, 99) * 1000, 1),
+            'max': round(max(latencies) * 1000, 1),
+        },
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
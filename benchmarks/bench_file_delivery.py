@@ -0,0 +1,171 @@
+"""Benchmark /download_file throughput and server CPU per GB served.
+
+Starts the app under gunicorn (or the Werkzeug server with --server werkzeug),
+registers a large synthetic file as a finished download through the SQLite
+progress store, then downloads it in full and as a series of ranged requests.
+
+    python benchmarks/bench_file_delivery.py --size-mb 1024 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from progress_store import SQLiteProgressStore
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree_cpu(root_pid):
+    """User+system CPU seconds of root_pid and its direct children (gunicorn master + workers)"""
+    total = 0.0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        pid, ppid = int(entry), int(fields[1])
+        if pid == root_pid or ppid == root_pid:
+            total += (int(fields[11]) + int(fields[12])) / CLK_TCK
+    return total
+
+
+def make_file(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(block[:min(len(block), size - written)])
+            written += len(block)
+
+
+def start_server(server, port, env):
+    if server == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '--workers', '1', '--bind', f'127.0.0.1:{port}', 'main:app']
+    else:
+        cmd = [sys.executable, '-c', f'from main import app; app.run(host="127.0.0.1", port={port}, threaded=True)']
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{server} did not start on port {port}')
+
+
+def fetch(port, path, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('GET', path, headers=headers or {})
+    resp = conn.getresponse()
+    received = 0
+    while True:
+        chunk = resp.read(1024 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+    conn.close()
+    return resp.status, received
+
+
+def measure(label, server_pid, func):
+    cpu_before = process_tree_cpu(server_pid)
+    started = time.perf_counter()
+    received = func()
+    elapsed = time.perf_counter() - started
+    cpu = process_tree_cpu(server_pid) - cpu_before
+    gigabytes = received / 1024 ** 3
+    return {
+        'scenario': label,
+        'bytes': received,
+        'seconds': round(elapsed, 4),
+        'throughput_mb_s': round(received / 1024 ** 2 / elapsed, 2) if elapsed else None,
+        'server_cpu_seconds': round(cpu, 4),
+        'server_cpu_seconds_per_gb': round(cpu / gigabytes, 4) if gigabytes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--ranges', type=int, default=32, help='number of ranged requests')
+    parser.add_argument('--range-mb', type=int, default=8)
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ytdown-bench-')
+    media_path = os.path.join(workdir, 'large.mp4')
+    size = args.size_mb * 1024 * 1024
+    make_file(media_path, size)
+
+    db_path = os.path.join(workdir, 'progress.sqlite3')
+    store = SQLiteProgressStore(db_path)
+    store.set('bench', {'status': 'finished', 'progress': 100, 'filename': media_path})
+
+    env = dict(os.environ, PROGRESS_BACKEND='sqlite', PROGRESS_DB_PATH=db_path)
+    port = free_port()
+    proc = start_server(args.server, port, env)
+
+    try:
+        results = []
+
+        def full():
+            status, received = fetch(port, '/download_file/bench')
+            assert status == 200, status
+            return received
+        results.append(measure('full', proc.pid, full))
+
+        def ranged():
+            span = args.range_mb * 1024 * 1024
+            received = 0
+            for _ in range(args.ranges):
+                start = random.randrange(0, max(1, size - span))
+                status, got = fetch(port, '/download_file/bench', {'Range': f'bytes={start}-{start + span - 1}'})
+                assert status == 206, status
+                received += got
+            return received
+        results.append(measure('ranges', proc.pid, ranged))
+
+        def resume():
+            # Simulate an interrupted download that resumes from the midpoint
+            status, received = fetch(port, '/download_file/bench', {'Range': f'bytes={size // 2}-'})
+            assert status == 206, status
+            return received
+        results.append(measure('resume_second_half', proc.pid, resume))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    report = {'benchmark': 'file_delivery', 'server': args.server, 'file_mb': args.size_mb, 'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    os.remove(media_path)
+
+
+if __name__ == '__main__':
+    main()
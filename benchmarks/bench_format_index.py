@@ -0,0 +1,178 @@
+"""Micro-benchmark format selection over large synthetic format lists.
+
+Compares the original list-scan selector (filter + full sort on every call)
+with FormatIndex: the one-off build cost, then per-lookup cost for
+"best <= H", "best audio", "exact id", "closest container" and a richer
+preference selector. Before timing, it checks that conversion-aware
+selection pairs each target container with the audio it can hold as-is,
+prefers video mp4 holds for mp4, and merges other video into webm/mkv.
+
+    python benchmarks/bench_format_index.py --sizes 50 500 5000 50000 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from format_index import FormatIndex
+from transcode import selection_cost, plan_conversion, TRANSCODE_STRICT_MP4
+
+HEIGHTS = [144, 240, 360, 480, 720, 1080, 1440, 2160, 4320]
+VCODECS = ['avc1.64001F', 'vp09.00.40.08', 'av01.0.08M.08', 'hev1.1.6.L120.90']
+ACODECS = ['mp4a.40.2', 'opus']
+EXTS = {'avc1': 'mp4', 'vp09': 'webm', 'av01': 'mp4', 'hev1': 'mp4'}
+
+
+def synthetic_formats(count, seed=0):
+    rng = random.Random(seed)
+    formats = []
+    for i in range(count):
+        if rng.random() < 0.2:
+            acodec = rng.choice(ACODECS)
+            formats.append({
+                'format_id': f'a{i}',
+                'ext': 'm4a' if acodec.startswith('mp4a') else 'webm',
+                'vcodec': 'none',
+                'acodec': acodec,
+                'abr': rng.choice([48, 64, 128, 160, 256]) + rng.random(),
+                'tbr': rng.uniform(40, 300),
+                'filesize': rng.randint(10 ** 6, 10 ** 8),
+            })
+        else:
+            vcodec = rng.choice(VCODECS)
+            height = rng.choice(HEIGHTS)
+            formats.append({
+                'format_id': f'v{i}',
+                'ext': EXTS[vcodec.split('.')[0]],
+                'vcodec': vcodec,
+                'acodec': 'none',
+                'height': height,
+                'width': height * 16 // 9,
+                'fps': rng.choice([24, 25, 30, 50, 60]),
+                'tbr': rng.uniform(100, 20000),
+                'dynamic_range': 'HDR10' if rng.random() < 0.1 else 'SDR',
+                'filesize': rng.randint(10 ** 6, 10 ** 10),
+            })
+    return formats
+
+
+def legacy_select(available_formats, requested_format_id):
+    """The selection algorithm FormatIndex replaced, kept here as the baseline"""
+    if requested_format_id and 'best[height<=' in requested_format_id:
+        height = int(requested_format_id.split('<=')[1].split(']')[0])
+        video_formats = [f for f in available_formats if f and f.get('height') and f.get('vcodec') and f.get('vcodec') != 'none']
+        suitable_formats = [f for f in video_formats if f.get('height') <= height]
+        if suitable_formats:
+            suitable_formats.sort(key=lambda x: (x.get('height', 0), x.get('tbr', 0)), reverse=True)
+            return suitable_formats[0]['format_id']
+        video_formats.sort(key=lambda x: x.get('height', 0))
+        return video_formats[0]['format_id'] if video_formats else None
+    for fmt in available_formats:
+        if fmt and fmt.get('format_id') == requested_format_id:
+            return requested_format_id
+    return 'best'
+
+
+def youtube_like_formats(height, video_mb, webm_mb=None):
+    """One height in H.264/mp4 (or AV1/mp4 above 1080p) and VP9/webm, plus m4a and opus audio"""
+    mb = 1024 * 1024
+    mp4_id, mp4_codec = ('137', 'avc1.640028') if height <= 1080 else ('401', 'av01.0.12M.08')
+    webm_id = '248' if height <= 1080 else '313'
+    return [
+        {'format_id': mp4_id, 'ext': 'mp4', 'vcodec': mp4_codec, 'acodec': 'none', 'height': height,
+         'fps': 30, 'filesize': video_mb * mb},
+        {'format_id': webm_id, 'ext': 'webm', 'vcodec': 'vp09.00.51.08', 'acodec': 'none', 'height': height,
+         'fps': 30, 'filesize': (webm_mb or video_mb) * mb},
+        {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129, 'filesize': 10 * mb},
+        {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 135, 'filesize': 11 * mb},
+    ]
+
+
+def check_cost_selection():
+    """Equal-quality pairs must go to the one the target container takes without re-encoding"""
+    for height, video_mb in ((1080, 300), (2160, 900)):
+        index = FormatIndex(youtube_like_formats(height, video_mb))
+        for target, audio_id in (('mp4', '140'), ('webm', '251')):
+            selected = index.select(f'best[height<={height}]', False, cost=selection_cost(target, False, 600))
+            pair = selected.split('/')[0]
+            assert pair.endswith(f'+{audio_id}'), f'{height}p {target}: selected {selected}, expected audio {audio_id}'
+
+    # A video stream mp4 holds wins however much smaller the VP9 one is
+    index = FormatIndex(youtube_like_formats(1080, 300, webm_mb=10))
+    selected = index.select('best[height<=1080]', False, cost=selection_cost('mp4', False, 600))
+    assert selected.startswith('137+140'), f'1080p mp4 with small VP9: selected {selected}'
+
+
+def check_mp4_fallback():
+    """VP9 bound for the default mp4 target is merged into webm/mkv, not re-encoded"""
+    formats = youtube_like_formats(2160, 900)
+    for audio, container in ((formats[3], 'webm'), (formats[2], 'mkv')):
+        chosen = {'ext': 'webm', 'requested_formats': [formats[1], audio]}
+        plan = plan_conversion(chosen, 'mp4')
+        assert (plan.action, plan.target, plan.merge_format) == ('remux', container, container), plan.to_dict()
+
+
+def per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_size(count, repeat):
+    formats = synthetic_formats(count)
+    last_id = formats[-1]['format_id']
+    rounds = max(1, repeat // max(1, count // 50))
+
+    start = time.perf_counter()
+    index = FormatIndex(formats)
+    index.best_video(1080)
+    index.best_audio()
+    build_us = (time.perf_counter() - start) * 1e6
+
+    # Warm the preference columns once so the lookups below measure steady state
+    index.select('best[height<=1080][vcodec=h264][fps<=30][hdr=no]', False)
+    index.closest_container('webm', 720)
+
+    # Both selectors must agree on the plain height cap
+    assert legacy_select(formats, 'best[height<=720]') == index.best_video(720)['format_id']
+
+    return {
+        'formats': count,
+        'index_build_us': round(build_us, 1),
+        'legacy_best_le_720_us': round(per_call(lambda: legacy_select(formats, 'best[height<=720]'), rounds), 2),
+        'legacy_exact_id_us': round(per_call(lambda: legacy_select(formats, last_id), rounds), 2),
+        'index_best_le_720_us': round(per_call(lambda: index.best_video(720), repeat), 2),
+        'index_best_audio_us': round(per_call(index.best_audio, repeat), 2),
+        'index_exact_id_us': round(per_call(lambda: index.get(last_id), repeat), 2),
+        'index_closest_container_us': round(per_call(lambda: index.closest_container('webm', 720), repeat), 2),
+        'index_preference_us': round(per_call(
+            lambda: index.select('best[height<=1080][vcodec=h264][fps<=30][hdr=no]', False), repeat), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000, 50000])
+    parser.add_argument('--repeat', type=int, default=2000, help='lookups timed per measurement')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    check_cost_selection()
+    if not TRANSCODE_STRICT_MP4:
+        check_mp4_fallback()
+    results = {'benchmark': 'format_index', 'results': [bench_size(n, args.repeat) for n in args.sizes]}
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Measure per-request YoutubeDL setup cost with and without the instance pool.
+
+    setup      build + close a fresh YoutubeDL vs lease + return a pooled one
+    extract    extract_info on distinct stub pages (no info cache), fresh vs pooled,
+               sequentially and from several threads
+
+    python benchmarks/bench_ydl_pool.py --requests 40 --threads 8 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yt_dlp
+from stub_media_server import start_stub_server
+from video_downloader import INFO_OPTS
+from ydl_pool import YDLPool
+
+
+def fresh_setup():
+    # YoutubeDL keeps (and fills in) the dict it is given, so pass a copy
+    with yt_dlp.YoutubeDL(dict(INFO_OPTS)):
+        pass
+
+
+def timed(func, count, threads=1):
+    started = time.perf_counter()
+    if threads == 1:
+        for i in range(count):
+            func(i)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(func, range(count)))
+    elapsed = time.perf_counter() - started
+    return round(elapsed / count * 1000, 2), round(elapsed, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=40, help='extractions per scenario')
+    parser.add_argument('--setups', type=int, default=50, help='instances built for the setup measurement')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stub = start_stub_server()
+    pool = YDLPool(max_idle=args.threads, max_uses=10 ** 6)
+
+    # Import extractors and build one instance so neither side pays first-use costs
+    fresh_setup()
+    pool.prewarm('info', INFO_OPTS, args.threads)
+
+    def pooled_setup(_):
+        with pool.lease('info', INFO_OPTS):
+            pass
+
+    def fresh_extract(i):
+        with yt_dlp.YoutubeDL(dict(INFO_OPTS)) as ydl:
+            ydl.extract_info(f'{stub.base_url}/page/fresh{i}', download=False)
+
+    def pooled_extract(i):
+        with pool.lease('info', INFO_OPTS) as ydl:
+            ydl.extract_info(f'{stub.base_url}/page/pooled{i}', download=False)
+
+    results = {'benchmark': 'ydl_pool', 'requests': args.requests, 'threads': args.threads}
+    results['setup_ms'] = {
+        'fresh': timed(lambda _: fresh_setup(), args.setups)[0],
+        'pooled': timed(pooled_setup, args.setups * 20)[0],
+    }
+    for label, threads in (('sequential', 1), ('threaded', args.threads)):
+        fresh_ms, fresh_wall = timed(fresh_extract, args.requests, threads)
+        pooled_ms, pooled_wall = timed(pooled_extract, args.requests, threads)
+        results[f'extract_{label}'] = {
+            'fresh_ms_per_request': fresh_ms,
+            'pooled_ms_per_request': pooled_ms,
+            'fresh_wall_s': fresh_wall,
+            'pooled_wall_s': pooled_wall,
+        }
+    results['pool'] = pool.stats()
+    stub.shutdown()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""End-to-end benchmark suite: the Flask app against the local stub site.
+
+Drives app.py in process (Flask test client) against stub_media_server.py,
+whose /watch/<kind>/<name> pages are resolved by the stub extractor in
+yt_dlp_plugins/extractor/, and measures:
+
+    extraction   /get_video_info latency, distinct pages and cached repeats
+    download     queued download throughput for progressive, HLS-segmented and
+                 DASH-split media (DASH needs ffmpeg for the merge)
+    relay        pipe-through throughput of a progressive stream
+    conversion   time added by remuxing/re-encoding the progressive download (needs ffmpeg)
+    delivery     /download_file throughput of a finished file
+    concurrency  analyze + download + fetch per simulated user, at each --users level
+
+When ffmpeg and ffprobe are available it also generates a real
+--media-seconds test video in all three forms, so merges, fixups and
+conversions see playable media; without them the downloads use the stub's
+synthetic bytes (--media-size).
+Stages that cannot run here are reported as skipped with the reason. Results
+are printed (and written to --output) as JSON; with --baseline the run is
+compared with an earlier results file and exits with status 1 when a metric
+regressed by more than --tolerance.
+
+    python benchmarks/run_all.py --output results.json
+    python benchmarks/run_all.py --bandwidth 20M --latency 0.02 --baseline results.json --tolerance 0.2
+    SEGMENTED_MIN_MB=4 python benchmarks/run_all.py --bandwidth 5M --connections 4
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import contextlib
+import tempfile
+import threading
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The stub extractor is found as a yt-dlp plugin under BENCH_DIR
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_media_server import start_stub_server, parse_bandwidth
+from bench_extraction_load import percentile
+
+# Metrics compared against --baseline: True when higher is better
+TRACKED_METRICS = {
+    'extraction.p50_ms': False,
+    'extraction.cached_p50_ms': False,
+    'download.progressive.mb_per_s': True,
+    'download.hls.mb_per_s': True,
+    'download.dash.mb_per_s': True,
+    'relay.mb_per_s': True,
+    'conversion.mkv.seconds': False,
+    'conversion.webm.seconds': False,
+    'conversion.mp3.seconds': False,
+    'delivery.mb_per_s': True,
+}
+
+MB = 1024 * 1024
+
+# Name of the real test video generated when ffmpeg is available
+REAL_MEDIA = 'real'
+
+
+def ms(value):
+    return round(value * 1000, 1)
+
+
+def rate(size, seconds):
+    return round(size / MB / seconds, 2) if seconds else None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_media(ffmpeg, media_dir, name, seconds):
+    """Real H.264/AAC test video as the stub serves it: progressive mp4, DASH-split streams and HLS"""
+    def run(*args):
+        subprocess.run([ffmpeg, '-v', 'error', '-y'] + list(args), check=True)
+
+    media = os.path.join(media_dir, 'media')
+    hls = os.path.join(media_dir, 'hls', name)
+    os.makedirs(os.path.join(hls, '720p'))
+    os.makedirs(media, exist_ok=True)
+    progressive = os.path.join(media, f'{name}.mp4')
+    run('-f', 'lavfi', '-i', 'testsrc=size=1280x720:rate=30', '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(seconds), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest',
+        '-movflags', '+faststart', progressive)
+    run('-i', progressive, '-map', '0:v', '-c', 'copy', '-movflags', '+faststart',
+        os.path.join(media, f'{name}-video.mp4'))
+    run('-i', progressive, '-map', '0:a', '-c', 'copy', '-movflags', '+faststart',
+        os.path.join(media, f'{name}-audio.m4a'))
+    run('-i', progressive, '-c', 'copy', '-f', 'hls', '-hls_time', '2', '-hls_playlist_type', 'vod',
+        '-hls_base_url', '720p/', '-hls_segment_filename', os.path.join(hls, '720p', '%d.ts'),
+        os.path.join(hls, '720p.m3u8'))
+    bandwidth = int(os.path.getsize(progressive) * 8 / seconds)
+    with open(os.path.join(hls, 'master.m3u8'), 'w') as f:
+        f.write('#EXTM3U\n#EXT-X-VERSION:3\n'
+                f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"\n'
+                '720p.m3u8\n')
+
+
+class AppDriver:
+    """Thin wrapper around the Flask test client for the request sequences the stages share"""
+
+    def __init__(self, app, base_url, timeout):
+        self.app = app
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def analyze(self, kind, name):
+        client = self.app.test_client()
+        started = time.perf_counter()
+        response = client.post('/get_video_info', json={'url': f'{self.base_url}/watch/{kind}/{name}'})
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200 or 'error' in response.get_json():
+            raise RuntimeError(f'analyze {kind}/{name}: {response.get_json()}')
+        return elapsed
+
+    def download(self, kind, name, file_format='mp4', audio_only=False, stream=False):
+        """Start a download and wait for it; returns (seconds, progress) once it is ready to fetch"""
+        client = self.app.test_client()
+        started = time.perf_counter()
+        # The selectors the UI offers; plain 'best' would need a stream that carries both video and audio
+        response = client.post('/download_video', json={
+            'url': f'{self.base_url}/watch/{kind}/{name}', 'file_format': file_format,
+            'format_id': 'bestaudio' if audio_only else 'best[height<=720]',
+            'audio_only': audio_only, 'stream': stream,
+        })
+        body = response.get_json()
+        if response.status_code != 200 or 'download_id' not in body:
+            raise RuntimeError(f'download {kind}/{name}: {body}')
+        download_id = body['download_id']
+        deadline = started + self.timeout
+        while True:
+            progress = client.get(f'/download_progress/{download_id}').get_json()
+            # A relay is ready to fetch before any byte has moved
+            if progress.get('status') == 'finished' or (progress.get('stream') and progress.get('status') == 'ready'):
+                return time.perf_counter() - started, dict(progress, download_id=download_id)
+            if progress.get('status') == 'error' or 'error' in progress:
+                raise RuntimeError(f'download {kind}/{name}: {progress.get("error")}')
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f'download {kind}/{name} timed out')
+            time.sleep(0.02)
+
+    def fetch(self, download_id):
+        """GET /download_file and read the whole body; returns (seconds, bytes)"""
+        client = self.app.test_client()
+        started = time.perf_counter()
+        response = client.get(f'/download_file/{download_id}', buffered=False)
+        size = 0
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+        if response.status_code not in (200, 206):
+            raise RuntimeError(f'fetch {download_id}: HTTP {response.status_code}')
+        return time.perf_counter() - started, size
+
+
+def stage_extraction(driver, args):
+    distinct = [driver.analyze('progressive', f'extract-{i}') for i in range(args.extractions)]
+    cached = [driver.analyze('progressive', 'extract-0') for _ in range(args.extractions)]
+    return {
+        'requests': args.extractions,
+        'p50_ms': ms(percentile(distinct, 50)),
+        'p90_ms': ms(percentile(distinct, 90)),
+        'cached_p50_ms': ms(percentile(cached, 50)),
+        'cached_p90_ms': ms(percentile(cached, 90)),
+    }
+
+
+def stage_download(driver, args, ffmpeg):
+    results = {}
+    for kind in ('progressive', 'hls', 'dash'):
+        if kind == 'dash' and not ffmpeg:
+            results[kind] = {'skipped': 'ffmpeg/ffprobe not found (needed to merge split video and audio)'}
+            continue
+        seconds, progress = driver.download(kind, REAL_MEDIA if ffmpeg else f'download-{kind}')
+        size = os.path.getsize(progress['filename'])
+        results[kind] = {'seconds': round(seconds, 3), 'bytes': size, 'mb_per_s': rate(size, seconds)}
+    return results
+
+
+def stage_relay(driver, args):
+    started = time.perf_counter()
+    # Relays are only planned from cached info, as after the UI's analyze step
+    driver.analyze('progressive', 'relay')
+    _, progress = driver.download('progressive', 'relay', stream=True)
+    if not progress.get('stream'):
+        return {'skipped': 'pipe-through is disabled (ENABLE_PIPE_THROUGH=0)'}
+    _, size = driver.fetch(progress['download_id'])
+    seconds = time.perf_counter() - started
+    return {'seconds': round(seconds, 3), 'bytes': size, 'mb_per_s': rate(size, seconds)}
+
+
+def stage_conversion(driver, args, ffmpeg):
+    if not ffmpeg:
+        return {'skipped': 'ffmpeg/ffprobe not found'}
+    # The app times its own merge/remux/re-encode steps; total_seconds includes the download
+    results = {'media_seconds': args.media_seconds}
+    for target, audio_only in (('mkv', False), ('webm', False), ('mp3', True)):
+        seconds, progress = driver.download('progressive', REAL_MEDIA, file_format=target, audio_only=audio_only)
+        converted = (progress.get('conversion') or {}).get('seconds') or 0.0
+        results[target] = {'total_seconds': round(seconds, 3), 'seconds': round(converted, 3)}
+    return results
+
+
+def stage_delivery(driver, args, download_id):
+    timings = []
+    size = 0
+    for _ in range(args.fetches):
+        seconds, size = driver.fetch(download_id)
+        timings.append(seconds)
+    seconds = percentile(timings, 50)
+    return {'fetches': args.fetches, 'bytes': size, 'p50_ms': ms(seconds), 'mb_per_s': rate(size, seconds)}
+
+
+def stage_concurrency(driver, args):
+    levels = {}
+    for users in args.users:
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def user(index):
+            name = f'user-{users}-{index}'
+            started = time.perf_counter()
+            try:
+                driver.analyze('progressive', name)
+                _, progress = driver.download('progressive', name)
+                driver.fetch(progress['download_id'])
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        levels[str(users)] = {
+            'wall_seconds': round(wall, 3),
+            'users_per_second': round(len(latencies) / wall, 2) if wall else None,
+            'p50_ms': ms(percentile(latencies, 50)) if latencies else None,
+            'p90_ms': ms(percentile(latencies, 90)) if latencies else None,
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+        }
+    return levels
+
+
+def flatten(stages):
+    """'stage.key.key' -> value for the numeric results, used for baseline comparison"""
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f'{prefix}.{key}' if prefix else key, item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    walk('', stages)
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Tracked metrics that got worse than the baseline by more than tolerance (a fraction)"""
+    current = flatten(results['stages'])
+    previous = flatten(baseline.get('stages', {}))
+    regressions = []
+    for name, higher_is_better in TRACKED_METRICS.items():
+        if name not in current or not previous.get(name):
+            continue
+        change = (current[name] - previous[name]) / previous[name]
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({'metric': name, 'baseline': previous[name], 'current': current[name],
+                                'change': round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--delay', type=float, default=0.2, help='seconds the stub site takes per info request')
+    parser.add_argument('--media-size', type=int, default=4 * MB, help='bytes of synthetic media per 720p stream')
+    parser.add_argument('--bandwidth', default='0', help='stub bytes/s per connection, e.g. 20M (0: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub seconds before the first media byte')
+    parser.add_argument('--segments', type=int, default=10, help='segments per HLS variant')
+    parser.add_argument('--extractions', type=int, default=10)
+    parser.add_argument('--fetches', type=int, default=5)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 16], help='concurrency levels')
+    parser.add_argument('--connections', type=int, help='SEGMENTED_CONNECTIONS for progressive downloads')
+    parser.add_argument('--media-seconds', type=int, default=30, help='length of the real test video (with ffmpeg)')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for one download')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--baseline', help='earlier results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, as a fraction')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ytdown-bench-')
+    media_dir = os.path.join(work_dir, 'media')
+    os.makedirs(media_dir)
+    # A private download root, and every request goes to the same local stub host
+    os.environ['DOWNLOAD_ROOT'] = os.path.join(work_dir, 'downloads')
+    os.environ.setdefault('HOST_RATE_LIMIT', '0')
+    os.environ.setdefault('ENABLE_PIPE_THROUGH', '1')
+    if args.connections:
+        os.environ['SEGMENTED_CONNECTIONS'] = str(args.connections)
+
+    # yt-dlp's merges and fixups probe their input, so real media needs ffprobe as well
+    ffmpeg = shutil.which(os.environ.get('FFMPEG_LOCATION') or 'ffmpeg')
+    if ffmpeg and not shutil.which('ffprobe', path=os.path.dirname(ffmpeg) + os.pathsep + os.environ.get('PATH', '')):
+        ffmpeg = None
+    if ffmpeg:
+        make_media(ffmpeg, media_dir, REAL_MEDIA, args.media_seconds)
+
+    stub = start_stub_server(page_delay=args.delay, media_size=args.media_size,
+                             bandwidth=parse_bandwidth(args.bandwidth), latency=args.latency,
+                             segments=args.segments, media_dir=media_dir,
+                             duration=float(args.media_seconds) if ffmpeg else 60.0)
+
+    import logging
+    import yt_dlp
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    driver = AppDriver(app, stub.base_url, args.timeout)
+
+    stages = {}
+    started = time.perf_counter()
+    try:
+        # yt-dlp's console output goes to stderr so stdout stays machine-readable
+        with contextlib.redirect_stdout(sys.stderr):
+            stages['extraction'] = stage_extraction(driver, args)
+            stages['download'] = stage_download(driver, args, ffmpeg)
+            stages['relay'] = stage_relay(driver, args)
+            stages['conversion'] = stage_conversion(driver, args, ffmpeg)
+            _, finished = driver.download('progressive', 'delivery')
+            stages['delivery'] = stage_delivery(driver, args, finished['download_id'])
+            stages['concurrency'] = stage_concurrency(driver, args)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'benchmark': 'end_to_end',
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'ffmpeg': bool(ffmpeg),
+            'commit': git_commit(),
+        },
+        'settings': {
+            'stub_delay_s': args.delay,
+            'media_size': args.media_size,
+            'real_media_seconds': args.media_seconds if ffmpeg else None,
+            'bandwidth': parse_bandwidth(args.bandwidth),
+            'latency_s': args.latency,
+            'segments': args.segments,
+            'connections': int(os.environ.get('SEGMENTED_CONNECTIONS', 1)),
+        },
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'stages': stages,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results['baseline'] = {'file': args.baseline, 'tolerance': args.tolerance, 'regressions': regressions}
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
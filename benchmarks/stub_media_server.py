@@ -0,0 +1,307 @@
+"""Local stub site for benchmarks: slow video pages, synthetic media and a JSON API.
+
+    GET /page/<name>[?delay=seconds]   HTML page embedding /media/<name>.mp4, served after a delay
+    GET /media/<name>.mp4              progressive media, honours single Range requests
+    GET /media/<name>-video.mp4        video-only stream of a DASH-style split format
+    GET /media/<name>-audio.m4a        audio-only stream of a DASH-style split format
+    GET /hls/<name>/master.m3u8        HLS master playlist (720p and 360p variants)
+    GET /hls/<name>/<variant>.m3u8     HLS media playlist of --segments segments
+    GET /hls/<name>/<variant>/<i>.ts   one HLS segment
+    GET /api/<kind>/<name>             info for /watch/<kind>/<name> (kind: progressive, dash, hls),
+                                       read by the stub extractor in yt_dlp_plugins/extractor/
+
+yt-dlp's generic extractor resolves each /page/ to one mp4 format, so the page
+delay stands in for a slow remote site during extraction benchmarks. With the
+benchmarks directory on sys.path, yt-dlp also loads the stub extractor, which
+resolves /watch/ URLs through the API with the delay applied there.
+
+Media bytes are synthetic unless --media-dir holds a real file at the same
+path as the URL (e.g. <media-dir>/media/clip.mp4 or <media-dir>/hls/clip/
+master.m3u8, generated with ffmpeg), which is served instead. --bandwidth
+paces every media response and --latency delays its first byte.
+
+    python benchmarks/stub_media_server.py --port 8766 --delay 0.5 --bandwidth 5M --latency 0.05
+"""
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+CONTENT_TYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t', '.m4a': 'audio/mp4'}
+MEDIA_RE = re.compile(r'^/media/(?P<name>[\w.-]+?)(?:-(?P<part>video|audio))?\.(?P<ext>mp4|m4a)$')
+HLS_RE = re.compile(r'^/hls/(?P<name>[\w.-]+)/(?:master\.m3u8|(?P<variant>\d+p)(?:\.m3u8|/(?P<segment>\d+)\.ts))$')
+API_RE = re.compile(r'^/api/(?P<kind>progressive|dash|hls)/(?P<name>[\w.-]+)$')
+
+# Synthetic variants: (name, width, height, share of --media-size)
+VARIANTS = (('720p', 1280, 720, 1.0), ('360p', 640, 360, 1 / 3))
+AUDIO_SHARE = 1 / 8
+WRITE_CHUNK = 64 * 1024
+
+
+def parse_bandwidth(value):
+    """'5M', '500K' or bytes per second; 0 means unlimited"""
+    value = str(value).strip().upper()
+    if value and value[-1] in 'KMG':
+        return float(value[:-1]) * 1024 ** ('KMG'.index(value[-1]) + 1)
+    return float(value or 0)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        real = self.server.real_file(path) if not path.startswith(('/page/', '/api/')) else None
+        if real:
+            content_type = CONTENT_TYPES.get(os.path.splitext(real)[1], 'video/mp4')
+            self._send_range(os.path.getsize(real), content_type, head, path=real)
+        elif path.startswith('/page/'):
+            self._page(parsed, head)
+        elif MEDIA_RE.match(path):
+            self._media(MEDIA_RE.match(path), head)
+        elif HLS_RE.match(path):
+            self._hls(HLS_RE.match(path), head)
+        elif API_RE.match(path):
+            self._api(API_RE.match(path), parsed, head)
+        else:
+            self.send_error(404)
+
+    def _page(self, parsed, head):
+        query = parse_qs(parsed.query)
+        delay = float(query.get('delay', [self.server.page_delay])[0])
+        if delay > 0:
+            time.sleep(delay)
+        name = parsed.path[len('/page/'):].strip('/') or 'video'
+        body = (
+            f'<html><head><title>{name}</title></head><body>'
+            f'<video src="/media/{name}.mp4"></video></body></html>'
+        ).encode('utf-8')
+        self._send_small(body, 'text/html; charset=utf-8', head)
+
+    def _send_small(self, body, content_type, head):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _api(self, match, parsed, head):
+        query = parse_qs(parsed.query)
+        delay = float(query.get('delay', [self.server.page_delay])[0])
+        if delay > 0:
+            time.sleep(delay)
+        info = self.server.info(match.group('kind'), match.group('name'))
+        self._send_small(json.dumps(info).encode('utf-8'), 'application/json', head)
+
+    def _media(self, match, head):
+        part = match.group('part')
+        size = self.server.stream_size(part)
+        self._send_range(size, 'audio/mp4' if part == 'audio' else 'video/mp4', head)
+
+    def _hls(self, match, head):
+        name, variant, segment = match.group('name', 'variant', 'segment')
+        server = self.server
+        if variant is None:
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+            for label, width, height, share in VARIANTS:
+                bandwidth = int(server.media_size * share * 8 / server.duration)
+                lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height},'
+                             f'CODECS="avc1.64001f,mp4a.40.2"')
+                lines.append(f'{label}.m3u8')
+            self._send_small(('\n'.join(lines) + '\n').encode('utf-8'), 'application/vnd.apple.mpegurl', head)
+        elif segment is None:
+            seconds = server.duration / server.segments
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(seconds + 0.999)}',
+                     '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+            for index in range(server.segments):
+                lines.append(f'#EXTINF:{seconds:.3f},')
+                lines.append(f'{variant}/{index}.ts')
+            lines.append('#EXT-X-ENDLIST')
+            self._send_small(('\n'.join(lines) + '\n').encode('utf-8'), 'application/vnd.apple.mpegurl', head)
+        else:
+            share = dict((label, share) for label, _, _, share in VARIANTS).get(variant, 1.0)
+            self._send_range(max(1, int(server.media_size * share) // server.segments), 'video/mp2t', head)
+
+    def _send_range(self, size, content_type, head, path=None):
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        start, end = 0, size - 1
+        status = 200
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head:
+            return
+
+        bandwidth = self.server.bandwidth
+        began = time.monotonic()
+        sent = 0
+        source = open(path, 'rb') if path else None
+        try:
+            if source:
+                source.seek(start)
+            block = self.server.block
+            pos = start
+            while pos <= end:
+                want = min(WRITE_CHUNK, end - pos + 1)
+                if source:
+                    chunk = source.read(want)
+                    if not chunk:
+                        break
+                else:
+                    offset = pos % len(block)
+                    chunk = block[offset:offset + min(len(block) - offset, want)]
+                self.wfile.write(chunk)
+                pos += len(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    # Pace this connection to --bandwidth
+                    ahead = sent / bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            if source:
+                source.close()
+
+
+class StubMediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, page_delay=0.0, media_size=1024 * 1024, bandwidth=0, latency=0.0,
+                 segments=10, duration=60.0, media_dir=None):
+        super().__init__(address, StubHandler)
+        self.page_delay = page_delay
+        self.media_size = media_size
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.segments = segments
+        self.duration = duration
+        self.media_dir = media_dir
+        self.block = bytes(range(256)) * 4096
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def real_file(self, url_path):
+        """File under media_dir mirroring url_path, if there is one"""
+        if not self.media_dir:
+            return None
+        parts = [part for part in url_path.split('/') if part]
+        if not parts or '..' in parts:
+            return None
+        path = os.path.join(self.media_dir, *parts)
+        return path if os.path.isfile(path) else None
+
+    def stream_size(self, part=None):
+        if part == 'audio':
+            return max(1, int(self.media_size * AUDIO_SHARE))
+        return self.media_size
+
+    def info(self, kind, name):
+        """Info dict the stub extractor returns for /watch/<kind>/<name>"""
+        base = self.base_url
+        info = {'id': f'{kind}-{name}', 'title': f'{kind} {name}', 'duration': self.duration,
+                'thumbnail': f'{base}/media/{name}.jpg'}
+        if kind == 'hls':
+            info['hls_url'] = f'{base}/hls/{name}/master.m3u8'
+            return info
+
+        # A real file stands in for every variant of its stream, with its actual size
+        formats = []
+        if kind == 'progressive':
+            real = self.real_file(f'/media/{name}.mp4')
+            for label, width, height, share in VARIANTS[:1] if real else VARIANTS:
+                size = os.path.getsize(real) if real else int(self.media_size * share)
+                formats.append({'format_id': f'progressive-{label}', 'url': f'{base}/media/{name}.mp4', 'ext': 'mp4',
+                                'width': width, 'height': height, 'fps': 30, 'filesize': size,
+                                'vcodec': 'avc1.64001f', 'acodec': 'mp4a.40.2'})
+        else:
+            video = self.real_file(f'/media/{name}-video.mp4')
+            audio = self.real_file(f'/media/{name}-audio.m4a')
+            for label, width, height, share in VARIANTS[:1] if video else VARIANTS:
+                formats.append({'format_id': f'dash-{label}', 'url': f'{base}/media/{name}-video.mp4',
+                                'ext': 'mp4', 'width': width, 'height': height, 'fps': 30,
+                                'filesize': os.path.getsize(video) if video else self.stream_size('video'),
+                                'vcodec': 'avc1.64001f', 'acodec': 'none'})
+            formats.append({'format_id': 'dash-audio', 'url': f'{base}/media/{name}-audio.m4a', 'ext': 'm4a',
+                            'filesize': os.path.getsize(audio) if audio else self.stream_size('audio'),
+                            'abr': 128, 'vcodec': 'none', 'acodec': 'mp4a.40.2'})
+        info['formats'] = formats
+        return info
+
+
+def start_stub_server(host='127.0.0.1', port=0, page_delay=0.0, media_size=1024 * 1024, **options):
+    """Start a stub server on a background thread and return it (see .base_url).
+
+    options: bandwidth (bytes/s per connection), latency (seconds), segments,
+    duration and media_dir, as for StubMediaServer.
+    """
+    server = StubMediaServer((host, port), page_delay=page_delay, media_size=media_size, **options)
+    thread = threading.Thread(target=server.serve_forever, name='stub-media-server')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before each page or API answer')
+    parser.add_argument('--media-size', type=int, default=1024 * 1024, help='bytes per media file')
+    parser.add_argument('--bandwidth', default='0', help='bytes/s per media connection, e.g. 5M (0: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first byte of media')
+    parser.add_argument('--segments', type=int, default=10, help='segments per HLS variant')
+    parser.add_argument('--media-dir', help='serve real files from here when their path matches the URL')
+    args = parser.parse_args()
+
+    server = StubMediaServer((args.host, args.port), page_delay=args.delay, media_size=args.media_size,
+                             bandwidth=parse_bandwidth(args.bandwidth), latency=args.latency,
+                             segments=args.segments, media_dir=args.media_dir)
+    print(f'Serving stub media site on {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
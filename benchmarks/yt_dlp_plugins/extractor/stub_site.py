@@ -0,0 +1,22 @@
+"""yt-dlp extractor for the benchmark stub site (benchmarks/stub_media_server.py).
+
+yt-dlp loads it as a plugin whenever the benchmarks directory is on sys.path
+(or PYTHONPATH) before its extractors are first imported.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class StubSiteIE(InfoExtractor):
+    IE_NAME = 'stubsite'
+    IE_DESC = False  # benchmark-only, kept out of --list-extractors descriptions
+    _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost)(?::\d+)?/watch/(?P<kind>progressive|dash|hls)/(?P<id>[\w.-]+)'
+
+    def _real_extract(self, url):
+        kind, name = self._match_valid_url(url).group('kind', 'id')
+        base = url.split('/watch/', 1)[0]
+        info = self._download_json(f'{base}/api/{kind}/{name}', name, note='Downloading stub info')
+
+        hls_url = info.pop('hls_url', None)
+        if hls_url:
+            info['formats'] = self._extract_m3u8_formats(hls_url, name, 'mp4', m3u8_id='hls')
+        return info
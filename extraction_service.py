@@ -0,0 +1,118 @@
+import os
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from video_downloader import VideoDownloader
+from info_cache import normalize_url
+
+# Threads running yt-dlp extractions for the async front end (asgi.py)
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', 32))
+
+# Seconds a client waits for an extraction before getting a 504
+EXTRACT_TIMEOUT = float(os.environ.get('EXTRACT_TIMEOUT', 45))
+
+# Distinct extractions allowed to wait for or occupy a thread before new ones get a 503
+EXTRACT_MAX_PENDING = int(os.environ.get('EXTRACT_MAX_PENDING', 500))
+
+
+class ExtractionOverloaded(Exception):
+    """Raised when too many distinct extractions are already pending"""
+
+
+class ExtractionService:
+    """Runs blocking yt-dlp extractions for an asyncio server on a bounded thread pool.
+
+    Waiting requests cost a coroutine, not a thread. Identical URLs share one
+    extraction; each caller has its own deadline. When the last caller of an
+    extraction goes away before a thread has picked it up, the job is dropped
+    from the pool queue. Extractions already running cannot be interrupted and
+    finish into the info cache, so a retry is served from there.
+    """
+
+    def __init__(self, max_workers=32, timeout=45, max_pending=500):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.completed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so importing never starts threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='extract')
+            return self._executor
+
+    def _finished(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+        if not entry['future'].cancelled():
+            # Mark the outcome as retrieved even when every caller has left
+            entry['future'].exception()
+            self.completed += 1
+
+    async def get_video_info(self, url, timeout=None):
+        """Return VideoDownloader.get_video_info(url) without blocking the event loop.
+
+        Raises asyncio.TimeoutError after the deadline and ExtractionOverloaded
+        when max_pending extractions are already queued or running.
+        """
+        key = normalize_url(url)
+        entry = self._inflight.get(key)
+        if entry is None:
+            if len(self._inflight) >= self.max_pending:
+                self.rejected += 1
+                raise ExtractionOverloaded(f'{self.max_pending} extractions already pending')
+            job = self._get_executor().submit(VideoDownloader().get_video_info, url)
+            entry = {'job': job, 'future': asyncio.wrap_future(job), 'waiters': 0}
+            self._inflight[key] = entry
+            entry['future'].add_done_callback(lambda _: self._finished(key, entry))
+        else:
+            self.coalesced += 1
+
+        entry['waiters'] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(entry['future']), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            entry['waiters'] -= 1
+            # Nobody is waiting any more: drop the job if no thread has started it
+            if entry['waiters'] == 0 and entry['job'].cancel():
+                self.cancelled += 1
+                logging.info(f"Dropped abandoned extraction for {url}")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            'pending': len(self._inflight),
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'timeout': self.timeout,
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'coalesced': self.coalesced,
+        }
+
+
+# Shared extraction service for the async front end
+extraction_service = ExtractionService(
+    max_workers=EXTRACT_WORKERS,
+    timeout=EXTRACT_TIMEOUT,
+    max_pending=EXTRACT_MAX_PENDING,
+)
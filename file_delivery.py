@@ -0,0 +1,100 @@
+import os
+import mimetypes
+import unicodedata
+from urllib.parse import quote
+from flask import request, Response
+from werkzeug.http import http_date, quote_etag
+
+# Read size used when the server cannot hand the file to the kernel
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(stat_result):
+    """Strong ETag (unquoted) derived from the file's identity: inode, size and modification time"""
+    return f'{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}'
+
+
+def content_disposition(download_name):
+    """attachment header with an ASCII fallback and an RFC 5987 UTF-8 filename"""
+    ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    ascii_name = ascii_name.replace('"', '').replace('\\', '') or 'download'
+    if ascii_name == download_name:
+        return f'attachment; filename="{ascii_name}"'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(download_name)}"
+
+
+def _if_range_matches(if_range, etag, mtime):
+    """True when the If-Range validator still describes the current file"""
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(mtime) <= if_range.date.timestamp()
+    return True
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def send_download(path, download_name, max_age=3600, pace=None):
+    """Send path as an attachment with Range/If-Range support and validators.
+
+    Under gunicorn the opened file is handed to wsgi.file_wrapper, which
+    gunicorn serves with the kernel's sendfile(); the file position and the
+    Content-Length tell it exactly which bytes to send. When pace is given
+    (bandwidth shaping), the body is read in chunks and passed through it.
+    """
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(stat_result.st_mtime),
+        'Cache-Control': f'private, max-age={max_age}',
+        'Content-Disposition': content_disposition(download_name),
+    }
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    start, length, status = 0, size, 200
+    byte_range = request.range
+    if byte_range is not None and _if_range_matches(request.if_range, etag, stat_result.st_mtime):
+        # Multiple ranges are allowed to fall back to the full body
+        if len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, end = bounds
+            length = end - start
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+
+    headers['Content-Length'] = str(length)
+
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    server = request.environ.get('SERVER_SOFTWARE', '')
+    if pace is not None:
+        # sendfile() cannot be paced
+        body = pace(_read_range(path, start, length))
+    # Generic file wrappers stream to EOF, so only use them when that is what we want
+    elif file_wrapper is not None and ('gunicorn' in server or start + length == size):
+        f = open(path, 'rb')
+        f.seek(start)
+        body = file_wrapper(f, CHUNK_SIZE)
+    else:
+        body = _read_range(path, start, length)
+
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
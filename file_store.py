@@ -0,0 +1,77 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import logging
+from storage import FILES_DIR
+
+
+def request_key(url_key, format_id, audio_only, file_format, clip=None):
+    """Canonical string describing what a download request produces"""
+    key = [url_key, format_id or '', bool(audio_only), file_format or '']
+    # Whole-video keys keep their old form, so files stored before clips existed still match
+    if clip:
+        key.append(clip)
+    return json.dumps(key)
+
+
+class FinishedFileStore:
+    """On-disk store of finished downloads addressed by the digest of their request key.
+
+    Each output lives in <root>/<sha256>/ next to a small meta.json, so any
+    process on the host can find it without shared memory.
+    """
+
+    META_NAME = 'meta.json'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def digest(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, self.digest(key))
+
+    def lookup(self, key):
+        """Return the stored metadata (including 'filename') for key, or None"""
+        meta_path = os.path.join(self._entry_dir(key), self.META_NAME)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not os.path.isfile(meta.get('filename', '')):
+            return None
+        return meta
+
+    def add(self, key, filename, title=None):
+        """Move a finished file into the store and return its metadata"""
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        target = os.path.join(entry_dir, os.path.basename(filename))
+        if os.path.abspath(filename) != os.path.abspath(target):
+            shutil.move(filename, target)
+
+        meta = {
+            'filename': target,
+            'title': title or os.path.splitext(os.path.basename(target))[0],
+            'filesize': os.path.getsize(target),
+        }
+
+        # Write metadata atomically so concurrent readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, self.META_NAME))
+
+        logging.info(f"Stored finished download {target}")
+        return meta
+
+
+# Shared store for finished downloads on this host
+file_store = FinishedFileStore(FILES_DIR)
@@ -0,0 +1,440 @@
+import re
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+
+# Codec string prefixes mapped to the family names accepted in selectors
+CODEC_FAMILIES = {
+    'avc': 'h264', 'h264': 'h264',
+    'hev': 'h265', 'hvc': 'h265', 'h265': 'h265',
+    'vp09': 'vp9', 'vp9': 'vp9', 'vp8': 'vp8',
+    'av01': 'av1', 'av1': 'av1', 'mp4v': 'mpeg4',
+    'mp4a': 'aac', 'aac': 'aac',
+    'opus': 'opus', 'vorbis': 'vorbis', 'mp3': 'mp3',
+    'ac-3': 'ac3', 'ac3': 'ac3', 'ec-3': 'eac3', 'eac3': 'eac3', 'flac': 'flac',
+}
+
+# One selector filter such as [height<=1080], [vcodec=h264] or [filesize<500M]
+FILTER_RE = re.compile(r'\[\s*(\w+)\s*(<=|>=|<|>|!=|=)\s*([^\]]*?)\s*\]')
+SELECTOR_RE = re.compile(r'^(best|bestvideo|bestaudio)((?:\[[^\]]*\])*)$')
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmg]?)i?b?$', re.IGNORECASE)
+
+# Containers that can hold a format's streams without re-encoding
+COMPATIBLE_CONTAINERS = {
+    'mp4': ('mp4', 'm4a', 'mov'),
+    'm4a': ('m4a', 'mp4'),
+    'webm': ('webm',),
+    'mkv': ('mkv', 'mp4', 'webm'),
+    'mov': ('mov', 'mp4'),
+}
+
+
+def codec_family(codec):
+    """Map a codec string like 'avc1.64001F' to its family name ('h264'), or None"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for prefix, family in CODEC_FAMILIES.items():
+        if codec.startswith(prefix):
+            return family
+    return codec.split('.')[0]
+
+
+def is_hdr(fmt):
+    return (fmt.get('dynamic_range') or 'SDR').upper() not in ('SDR', '')
+
+
+def parse_size(value):
+    match = SIZE_RE.match(value.strip())
+    if not match:
+        raise ValueError(f'Invalid size: {value}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def _num(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+class FormatPreference:
+    """Parsed selector such as best[height<=1080][vcodec=h264][fps<=30][hdr=no][filesize<=500M].
+
+    Supported filters: height, fps, abr and filesize (<, <=, =, >=, >), vcodec
+    and acodec (codec family, = or !=), ext (=) and hdr (yes/no).
+    """
+
+    def __init__(self, kind='video'):
+        self.kind = kind
+        self.max_height = None
+        self.min_height = None
+        self.max_fps = None
+        self.max_abr = None
+        self.max_filesize = None
+        self.vcodec = None
+        self.acodec = None
+        self.exclude_codecs = set()
+        self.ext = None
+        self.hdr = None
+
+    @classmethod
+    def parse(cls, selector):
+        """Return a FormatPreference for a best/bestvideo/bestaudio selector, or None for format IDs"""
+        match = SELECTOR_RE.match(selector.strip().replace(' ', ''))
+        if not match:
+            return None
+
+        pref = cls('audio' if match.group(1) == 'bestaudio' else 'video')
+        filters = match.group(2)
+        parsed = FILTER_RE.findall(filters)
+        if ''.join(f'[{k}{op}{v}]' for k, op, v in parsed) != filters:
+            raise ValueError(f'Unsupported filter in {selector}')
+
+        for key, op, value in parsed:
+            # yt-dlp's "?" (allow unknown) is implied: unknown values never exclude a format
+            value = value.lstrip('?')
+            pref._apply(key.lower(), op, value)
+        return pref
+
+    def _apply(self, key, op, value):
+        if key == 'height':
+            height = int(value)
+            if op in ('<=', '<', '='):
+                self.max_height = height - 1 if op == '<' else height
+            if op in ('>=', '>', '='):
+                self.min_height = height + 1 if op == '>' else height
+        elif key == 'fps' and op in ('<=', '<', '='):
+            self.max_fps = float(value) - (0.001 if op == '<' else 0)
+        elif key == 'abr' and op in ('<=', '<', '='):
+            self.max_abr = float(value) - (0.001 if op == '<' else 0)
+        elif key == 'filesize' and op in ('<=', '<'):
+            self.max_filesize = parse_size(value) - (1 if op == '<' else 0)
+        elif key in ('vcodec', 'acodec') and op in ('=', '!='):
+            family = codec_family(value)
+            if op == '!=':
+                self.exclude_codecs.add(family)
+            else:
+                setattr(self, key, family)
+        elif key == 'ext' and op == '=':
+            self.ext = value.lower()
+        elif key in ('hdr', 'dynamic_range') and op == '=':
+            self.hdr = value.lower() in ('yes', 'true', '1', 'hdr') or value.upper().startswith('HDR')
+        else:
+            raise ValueError(f'Unsupported filter [{key}{op}{value}]')
+
+    def accepts(self, fmt):
+        """Checks that are not answered by the sorted columns themselves"""
+        if self.max_fps is not None and _num(fmt.get('fps')) > self.max_fps:
+            return False
+        if self.max_abr is not None and _num(fmt.get('abr')) > self.max_abr:
+            return False
+        if self.max_filesize is not None:
+            size = fmt.get('filesize') or fmt.get('filesize_approx')
+            if size and size > self.max_filesize:
+                return False
+        if self.exclude_codecs:
+            if codec_family(fmt.get('vcodec')) in self.exclude_codecs or codec_family(fmt.get('acodec')) in self.exclude_codecs:
+                return False
+        return True
+
+
+class _Column:
+    """Formats sorted by quality with a parallel list of sort keys for bisection"""
+
+    def __init__(self, formats, key):
+        formats = sorted(formats, key=key)
+        self.formats = formats
+        self.primary = [key(f)[0] for f in formats]
+
+    def __len__(self):
+        return len(self.formats)
+
+    def best_at_most(self, limit, accepts=None, floor=None):
+        """Highest-quality format whose primary key is <= limit (None means no limit)"""
+        end = len(self.formats) if limit is None else bisect.bisect_right(self.primary, limit)
+        start = 0 if floor is None else bisect.bisect_left(self.primary, floor)
+        for i in range(end - 1, start - 1, -1):
+            fmt = self.formats[i]
+            if accepts is None or accepts(fmt):
+                return fmt
+        return None
+
+    def lowest(self):
+        return self.formats[0] if self.formats else None
+
+    def equal_to(self, value):
+        """Formats whose primary key equals value, best first"""
+        lo = bisect.bisect_left(self.primary, value)
+        hi = bisect.bisect_right(self.primary, value)
+        return self.formats[lo:hi][::-1]
+
+
+class FormatIndex:
+    """Index over one extraction's formats, built once and reused for every lookup.
+
+    Video formats (known height, real vcodec) are kept sorted by (height, tbr, abr)
+    and audio-only formats by (abr, tbr). Columns narrowed by codec family, HDR
+    and container are built on first use, so height and bitrate lookups bisect
+    instead of filtering and re-sorting the whole list.
+    """
+
+    def __init__(self, formats):
+        self.formats = [f for f in formats or [] if f]
+        self.by_id = {f['format_id']: f for f in self.formats if f.get('format_id')}
+
+        self._video = [f for f in self.formats
+                       if f.get('height') and f.get('vcodec') not in (None, 'none')]
+        self._audio = [f for f in self.formats
+                       if f.get('vcodec') in (None, 'none') and f.get('acodec') not in (None, 'none')]
+        self._columns = {}
+        self._lock = threading.Lock()
+        self._listing = None
+
+    @staticmethod
+    def _video_key(fmt):
+        return (fmt['height'], _num(fmt.get('tbr')), _num(fmt.get('abr')))
+
+    @staticmethod
+    def _audio_key(fmt):
+        return (_num(fmt.get('abr')), _num(fmt.get('tbr')))
+
+    def _column(self, kind, codec=None, hdr=None, ext=None):
+        key = (kind, codec, hdr, ext)
+        column = self._columns.get(key)
+        if column is not None:
+            return column
+
+        if kind == 'video':
+            source, sort_key, codec_field = self._video, self._video_key, 'vcodec'
+        else:
+            source, sort_key, codec_field = self._audio, self._audio_key, 'acodec'
+        selected = [
+            f for f in source
+            if (codec is None or codec_family(f.get(codec_field)) == codec)
+            and (hdr is None or is_hdr(f) == hdr)
+            and (ext is None or f.get('ext') == ext)
+        ]
+        column = _Column(selected, sort_key)
+        with self._lock:
+            self._columns[key] = column
+        return column
+
+    def has_video(self):
+        return bool(self._video)
+
+    def get(self, format_id):
+        return self.by_id.get(format_id)
+
+    def best_video(self, max_height=None, pref=None):
+        """Best video format no taller than max_height that satisfies pref"""
+        if pref is None:
+            return self._column('video').best_at_most(max_height)
+        limit = pref.max_height if max_height is None else min(max_height, pref.max_height or max_height)
+        column = self._column('video', pref.vcodec, pref.hdr, pref.ext)
+        return column.best_at_most(limit, pref.accepts, pref.min_height)
+
+    def lowest_video(self):
+        return self._column('video').lowest()
+
+    def best_audio(self, pref=None):
+        if pref is None:
+            return self._column('audio').best_at_most(None)
+        column = self._column('audio', pref.acodec, None, pref.ext)
+        return column.best_at_most(None, pref.accepts)
+
+    def audio_by_codec(self, pref=None):
+        """Best audio-only format of each codec family that satisfies pref"""
+        column = self._column('audio', pref.acodec if pref else None)
+        best = {}
+        for fmt in reversed(column.formats):
+            family = codec_family(fmt.get('acodec'))
+            if family not in best and (pref is None or pref.accepts(fmt)):
+                best[family] = fmt
+        return list(best.values())
+
+    def closest_container(self, ext, max_height=None):
+        """Best video format <= max_height already stored in (or losslessly remuxable to) ext"""
+        for candidate in COMPATIBLE_CONTAINERS.get(ext, (ext,)):
+            fmt = self._column('video', ext=candidate).best_at_most(max_height)
+            if fmt:
+                return fmt
+        return None
+
+    def select(self, requested_format_id, audio_only, cost=None):
+        """Turn a requested format ID or preference selector into a yt-dlp format string.
+
+        cost, when given, is called as cost(video_fmt, audio_fmt) (either may be
+        None) and decides between formats of equal quality, e.g. to prefer one
+        that needs no conversion.
+        """
+        try:
+            pref = FormatPreference.parse(requested_format_id) if requested_format_id else None
+        except ValueError as e:
+            logging.error(f"Error parsing format selector: {e}")
+            return 'bestaudio/best' if audio_only else 'best'
+
+        if audio_only:
+            if pref is not None and pref.kind == 'audio':
+                fmt = self.best_audio(pref)
+                if fmt and cost is not None:
+                    fmt = min([fmt] + self.audio_by_codec(pref), key=lambda a: cost(None, a))
+                return f"{fmt['format_id']}/bestaudio/best" if fmt else 'bestaudio/best'
+            fmt = self.by_id.get(requested_format_id)
+            if fmt is not None and fmt.get('vcodec') in (None, 'none') and fmt.get('acodec') not in (None, 'none'):
+                return f'{requested_format_id}/bestaudio/best'
+            return 'bestaudio/best'
+
+        if pref is not None and pref.kind == 'video':
+            return self._select_video(pref, requested_format_id, cost)
+
+        # For specific format IDs, check if available
+        if requested_format_id and requested_format_id in self.by_id:
+            logging.debug("Found exact format match: %s", requested_format_id)
+            return requested_format_id
+
+        logging.debug("Using fallback format: best")
+        return 'best'
+
+    def _cheapest_pair(self, best, pref, cost):
+        """Among formats as good as best (same height, fps and HDR), the (video, audio) pair of lowest cost"""
+        column = self._column('video', pref.vcodec, pref.hdr, pref.ext)
+        fps = _num(best.get('fps'))
+        videos = [f for f in column.equal_to(best['height'])
+                  if pref.accepts(f) and _num(f.get('fps')) >= fps - 1 and is_hdr(f) == is_hdr(best)]
+        if best not in videos:
+            videos.insert(0, best)
+
+        if best['height'] < 480:
+            # Not merged: keep to formats that carry audio exactly when best does
+            has_audio = best.get('acodec') not in (None, 'none')
+            videos = [v for v in videos if (v.get('acodec') not in (None, 'none')) == has_audio]
+            return min(((v, None) for v in videos), key=lambda pair: cost(*pair))
+
+        audios = self.audio_by_codec()
+        default_audio = self.best_audio()
+        if default_audio in audios:
+            audios.remove(default_audio)
+            audios.insert(0, default_audio)
+        pairs = []
+        for video in videos:
+            pairs.extend((video, audio) for audio in audios)
+            if not audios or video.get('acodec') not in (None, 'none'):
+                pairs.append((video, None))
+        # min() keeps the first of equal costs, so ties go to the plain quality ranking
+        return min(pairs, key=lambda pair: cost(*pair))
+
+    def _select_video(self, pref, requested_format_id, cost=None):
+        height = pref.max_height
+        if not self._video:
+            # Nothing to index (e.g. generic pages without height info); let yt-dlp decide
+            logging.debug("Using generic format selector for %s", requested_format_id)
+            return f'best[height<=?{height}]' if height else 'best'
+
+        best = self.best_video(pref=pref)
+        if best is None:
+            # Codec, fps, HDR and size preferences are soft: fall back to the height cap alone
+            best = self.best_video(height)
+        if best is None:
+            fallback = self.lowest_video()
+            logging.debug("No format <= %sp available, using: %s (%sp)", height, fallback['format_id'], fallback['height'])
+            return fallback['format_id']
+
+        if cost is not None:
+            best, audio = self._cheapest_pair(best, pref, cost)
+            logging.debug("Lowest-cost format: %s (%sp) + %s", best['format_id'], best['height'],
+                          audio['format_id'] if audio else 'own audio')
+            if audio is not None:
+                return f"{best['format_id']}+{audio['format_id']}/{best['format_id']}"
+            if best['height'] < 480 or best.get('acodec') not in (None, 'none'):
+                return best['format_id']
+
+        logging.debug("Found suitable format: %s (%sp)", best['format_id'], best['height'])
+        # For better quality, try to combine with audio
+        if best['height'] >= 480:
+            return f"{best['format_id']}+bestaudio/{best['format_id']}"
+        return best['format_id']
+
+    def listing(self):
+        """Formats offered to the client: one per (ext, resolution) for video and per ext for audio"""
+        if self._listing is None:
+            listing = []
+            seen_formats = set()
+            for fmt in self.formats:
+                if fmt.get('vcodec') and fmt.get('vcodec') != 'none':
+                    format_info = {
+                        'format_id': fmt['format_id'],
+                        'ext': fmt.get('ext', 'mp4'),
+                        'resolution': f"{fmt.get('width', 0)}x{fmt.get('height', 0)}",
+                        'filesize': fmt.get('filesize', 0),
+                        'type': 'video',
+                        'quality': fmt.get('height', 0),
+                    }
+                    format_key = (format_info['ext'], format_info['resolution'])
+                elif fmt.get('acodec') and fmt.get('acodec') != 'none':
+                    format_info = {
+                        'format_id': fmt['format_id'],
+                        'ext': fmt.get('ext', 'mp3'),
+                        'resolution': 'Audio Only',
+                        'filesize': fmt.get('filesize', 0),
+                        'type': 'audio',
+                        'quality': fmt.get('abr', 0),
+                    }
+                    format_key = (format_info['ext'], 'audio')
+                else:
+                    continue
+                if format_key not in seen_formats:
+                    listing.append(format_info)
+                    seen_formats.add(format_key)
+
+            listing.sort(key=lambda x: x['quality'] or 0, reverse=True)
+            self._listing = listing
+        return [dict(f) for f in self._listing]
+
+    def qualities(self, exts=('mp4', 'webm'), limit=None):
+        """First format of each height among exts, tallest first"""
+        seen = set()
+        result = []
+        for fmt in self.formats:
+            if fmt.get('height') and fmt.get('ext') in exts and fmt['height'] not in seen:
+                seen.add(fmt['height'])
+                result.append(fmt)
+        result.sort(key=lambda f: f['height'], reverse=True)
+        return result[:limit] if limit else result
+
+
+class _IndexCache:
+    """Small LRU of FormatIndex objects keyed by the identity of a formats list"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, formats):
+        key = id(formats)
+        with self._lock:
+            entry = self._entries.get(key)
+            # The entry holds a reference to the list, so its id cannot be reused while cached
+            if entry is not None and entry[0] is formats:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        index = FormatIndex(formats)
+        with self._lock:
+            self._entries[key] = (formats, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+
+_index_cache = _IndexCache()
+
+
+def index_for(info):
+    """FormatIndex for an info dict, shared by every caller holding the same (cached) info"""
+    formats = info.get('formats')
+    if formats is None:
+        return FormatIndex([])
+    return _index_cache.get(formats)
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import logging
+import functools
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+# Query parameters that never change which video a URL points at
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src'}
+
+_extractor_classes = None
+
+# URLs whose cache key is remembered; finding the extractor tries every extractor class in turn
+_KEY_MEMO_SIZE = 4096
+
+
+def _find_extractor_id(url):
+    """Return (extractor_key, video_id) for URLs yt-dlp can identify offline"""
+    global _extractor_classes
+    if _extractor_classes is None:
+        from yt_dlp.extractor import gen_extractor_classes
+        _extractor_classes = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+    for ie in _extractor_classes:
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return ie.ie_key(), video_id
+            return None
+    return None
+
+
+def normalize_url(url):
+    """Normalize a URL so equivalent links share one cache key"""
+    parsed = urlparse(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+             if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')]
+    query.sort()
+    return urlunparse((
+        (parsed.scheme or 'https').lower(),
+        parsed.netloc.lower(),
+        parsed.path.rstrip('/') or '/',
+        '',
+        urlencode(query),
+        '',
+    ))
+
+
+@functools.lru_cache(maxsize=_KEY_MEMO_SIZE)
+def cache_key(url):
+    """Build the cache key for a URL: extractor + video ID when known, else the normalized URL"""
+    try:
+        found = _find_extractor_id(url)
+    except Exception as e:
+        logging.debug(f"Extractor lookup failed for {url}: {e}")
+        found = None
+
+    if found:
+        return f"{found[0]}:{found[1]}"
+    return normalize_url(url)
+
+
+class InfoCache:
+    """Thread-safe LRU cache of yt-dlp info dicts with a per-entry TTL"""
+
+    def __init__(self, max_entries=64, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _fresh(self, key):
+        # Caller holds the lock; expired entries are dropped on the way
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            value = self._fresh(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """The fresh value for key, or None; does not count as a hit or miss"""
+        with self._lock:
+            return self._fresh(key)
+
+    def contains(self, key):
+        """True when key has a fresh entry; does not count as a hit or miss"""
+        return self.peek(key) is not None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() once on a miss.
+
+        Concurrent misses for the same key wait for the first loader instead of
+        running their own extraction. Only that load counts as a miss; the
+        callers it serves count as hits.
+        """
+        with self._lock:
+            value = self._fresh(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                self.misses += 1
+                event = threading.Event()
+                self._inflight[key] = event
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                value = self._fresh(key)
+                if value is not None:
+                    self.hits += 1
+                    return value
+                # The first loader failed; try on our own
+                self.misses += 1
+            return self._load(key, loader)
+
+        try:
+            return self._load(key, loader)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _load(self, key, loader):
+        value = loader()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared cache used by every VideoDownloader in this process
+info_cache = InfoCache(
+    max_entries=int(os.environ.get('INFO_CACHE_SIZE', 64)),
+    ttl=float(os.environ.get('INFO_CACHE_TTL', 300)),
+)
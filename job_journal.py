@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from storage import DOWNLOAD_ROOT
+
+# Append-only record of download jobs, replayed at startup to resume interrupted ones
+JOB_JOURNAL_PATH = os.environ.get('JOB_JOURNAL_PATH', os.path.join(DOWNLOAD_ROOT, 'journal.jsonl'))
+
+# Resume interrupted downloads after a restart (0 only re-registers finished ones)
+JOB_RESUME = os.environ.get('JOB_RESUME', '1') == '1'
+
+# Jobs older than this are neither resumed nor re-registered
+JOB_RESUME_MAX_AGE = float(os.environ.get('JOB_RESUME_MAX_AGE', 6 * 3600))
+
+# Journal size (in kilobytes) past which it is compacted while the app runs
+JOB_JOURNAL_COMPACT_KB = float(os.environ.get('JOB_JOURNAL_COMPACT_KB', 1024))
+
+# Events after which a job still needs work
+OPEN_EVENTS = ('submitted', 'started', 'resumed')
+
+# Events written without fsync: losing one in a crash at worst resumes a job that had
+# started anyway, or re-registers a file that had already been served
+LAZY_EVENTS = ('started', 'served')
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobJournal:
+    """Crash-safe JSON-lines journal of download jobs and their state transitions.
+
+    Each line is one event for one job: submitted (with the request parameters
+    and work directory), started, finished (with the output file), failed,
+    served or resumed. Every event carries the pid of the process that owns
+    the job. After a restart the journal is replayed under a file lock, so of
+    several workers starting at once only one takes each job:
+
+    - open jobs whose owner process is gone are handed to `resume`, which
+      restarts them in their old work directory so yt-dlp continues the
+      .part file instead of starting over;
+    - finished jobs that were never served are handed to `restore`, which
+      registers their output again so clients polling the old id can fetch it.
+
+    The journal is then rewritten with only the jobs still of interest, and
+    again whenever it grows past compact_bytes (and has at least doubled
+    since the last compaction) while the app runs.
+    """
+
+    def __init__(self, path, compact_bytes=JOB_JOURNAL_COMPACT_KB * 1024, max_age=JOB_RESUME_MAX_AGE):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.compact_bytes = compact_bytes
+        self.max_age = max_age
+        self._compacted_size = 0
+        self._recovered = False
+        self._recover_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def record(self, job_id, event, **fields):
+        """Append one event; failures are logged, never raised into the job"""
+        line = json.dumps(dict(fields, id=job_id, event=event, time=time.time(), pid=os.getpid())) + '\n'
+        try:
+            # Opened per write so a compaction (which replaces the file) never swallows events
+            with self._locked():
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line.encode('utf-8'))
+                    if event not in LAZY_EVENTS:
+                        os.fsync(fd)
+                    size = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+                if size > max(self.compact_bytes, 2 * self._compacted_size):
+                    self._compact()
+        except OSError as e:
+            logging.error(f"Could not write job journal {self.path}: {str(e)}")
+
+    def _compact(self):
+        """Rewrite the journal with open jobs and unserved finished ones only (call under the lock)"""
+        now = time.time()
+        keep = [job for job in self._replay().values()
+                if now - job['submitted'] <= self.max_age
+                and (job.get('event') in OPEN_EVENTS or job.get('event') == 'finished')]
+        self._rewrite(keep)
+        self._compacted_size = os.path.getsize(self.path)
+        logging.info(f"Compacted job journal to {len(keep)} jobs ({self._compacted_size} bytes)")
+
+    def _replay(self):
+        """Latest state of every job: the submitted fields merged with later events"""
+        jobs = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    job = jobs.get(entry.get('id'))
+                    if job is None:
+                        if entry.get('event') != 'submitted':
+                            continue
+                        job = jobs[entry['id']] = {'submitted': entry['time'], '_entry': entry}
+                    job.update(entry)
+        except FileNotFoundError:
+            pass
+        return jobs
+
+    def _rewrite(self, jobs):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in jobs:
+                # The original submitted line, then one line with the latest state
+                submitted = job['_entry']
+                f.write(json.dumps(submitted) + '\n')
+                if job['event'] != 'submitted':
+                    state = {key: value for key, value in job.items()
+                             if key not in submitted or key in ('event', 'time', 'pid')}
+                    state.pop('_entry')
+                    state.pop('submitted')
+                    f.write(json.dumps(dict(state, id=job['id'])) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def recover(self, resume, restore, max_age=None, resume_open=True):
+        """Resume interrupted jobs and restore unserved finished ones; runs once per process"""
+        max_age = self.max_age if max_age is None else max_age
+        if self._recovered:
+            return
+        with self._recover_lock:
+            if self._recovered:
+                return
+            self._recovered = True
+
+        resumed = restored = 0
+        with self._locked():
+            now = time.time()
+            keep = []
+            for job in self._replay().values():
+                if now - job['submitted'] > max_age:
+                    continue
+                event = job.get('event')
+                if event in OPEN_EVENTS:
+                    if job.get('pid') != os.getpid() and _pid_alive(job.get('pid')):
+                        # Still running in another worker
+                        keep.append(job)
+                        continue
+                    if not resume_open:
+                        continue
+                    try:
+                        resume(job)
+                    except Exception as e:
+                        logging.error(f"Could not resume download {job['id']}: {str(e)}")
+                        continue
+                    job.update(event='resumed', time=now, pid=os.getpid())
+                    keep.append(job)
+                    resumed += 1
+                elif event == 'finished':
+                    if not os.path.isfile(job.get('filename') or ''):
+                        continue
+                    try:
+                        restore(job)
+                    except Exception as e:
+                        logging.error(f"Could not restore download {job['id']}: {str(e)}")
+                        continue
+                    keep.append(job)
+                    restored += 1
+            try:
+                self._rewrite(keep)
+                self._compacted_size = os.path.getsize(self.path)
+            except OSError as e:
+                logging.error(f"Could not compact job journal {self.path}: {str(e)}")
+
+        if resumed or restored:
+            logging.info(f"Job journal: resumed {resumed} interrupted and restored {restored} finished downloads")
+
+
+# Shared journal for every process on the host
+job_journal = JobJournal(JOB_JOURNAL_PATH)
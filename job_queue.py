@@ -0,0 +1,219 @@
+import os
+import time
+import bisect
+import itertools
+import threading
+import logging
+
+# yt-dlp postprocessors that run ffmpeg and are CPU-bound rather than network-bound
+CPU_POSTPROCESSORS = {'VideoConvertor', 'ExtractAudio', 'Merger', 'VideoRemuxer'}
+
+# Cost of a job whose size is unknown, in megabytes of expected download
+DEFAULT_JOB_COST = float(os.environ.get('DEFAULT_JOB_COST', 50))
+
+
+class QueueFullError(Exception):
+    """Raised when the download queue cannot accept another job"""
+
+
+class RetryLater(Exception):
+    """Raised by a job that cannot run yet; the scheduler queues it again for delay seconds"""
+
+    def __init__(self, delay, message=''):
+        super().__init__(message or f'retry in {delay:.1f}s')
+        self.delay = delay
+
+
+class JobSlots:
+    """Tracks which concurrency slots a single running job holds"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.downloading = False
+        self.postprocessing = False
+
+    def start_download(self):
+        if not self.downloading:
+            self.scheduler.download_slots.acquire()
+            self.downloading = True
+
+    def start_postprocessing(self):
+        # Give the network slot back before waiting for a CPU slot
+        if self.downloading:
+            self.scheduler.download_slots.release()
+            self.downloading = False
+        if not self.postprocessing:
+            self.scheduler.conversion_slots.acquire()
+            self.postprocessing = True
+
+    def release(self):
+        if self.downloading:
+            self.scheduler.download_slots.release()
+            self.downloading = False
+        if self.postprocessing:
+            self.scheduler.conversion_slots.release()
+            self.postprocessing = False
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook that moves the job into a CPU slot before ffmpeg runs"""
+        if d.get('status') == 'started' and d.get('postprocessor') in CPU_POSTPROCESSORS:
+            self.start_postprocessing()
+
+
+class DownloadScheduler:
+    """Bounded worker pool with a fair-share job queue across clients.
+
+    Jobs are ordered by start-time fair queueing: each job is tagged with the
+    virtual time at which its client's earlier jobs will have been served
+    (their costs added up, in megabytes of expected download), and workers
+    take the job with the smallest tag. One client's long run of large jobs
+    therefore cannot hold back another client's small ones, while jobs of a
+    single client still run in submission order.
+
+    While downloading a job holds one of max_downloads network slots; when
+    its first ffmpeg postprocessor starts it swaps that for one of
+    max_conversions CPU slots. A job that raises RetryLater (its site has no
+    request slot yet) goes back into the queue with its original tag and is
+    not picked up again before the delay has passed, so waiting holds no
+    worker.
+    """
+
+    def __init__(self, max_workers=6, max_downloads=4, max_conversions=2, max_queue=100):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.download_slots = threading.BoundedSemaphore(max_downloads)
+        self.conversion_slots = threading.BoundedSemaphore(max_conversions)
+        self.max_downloads = max_downloads
+        self.max_conversions = max_conversions
+        # Sorted (start_tag, sequence, job_id, client, func, ready_at)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._clock = 0.0
+        self._client_finish = {}
+        self._cond = threading.Condition()
+        self._workers = []
+        self._active = 0
+        # Optional callback receiving [(job_id, position), ...] whenever the queue shifts
+        self.on_queue_change = None
+
+    def submit(self, job_id, func, client=None, cost=None):
+        """Queue func(slots) to run as job_id; raises QueueFullError when the queue is full"""
+        cost = max(1.0, cost or DEFAULT_JOB_COST)
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f'Download queue is full ({self.max_queue} jobs waiting)')
+            start = max(self._clock, self._client_finish.get(client, 0.0))
+            self._client_finish[client] = start + cost
+            entry = (start, next(self._sequence), job_id, client, func, 0.0)
+            bisect.insort(self._queue, entry)
+            position = self._queue.index(entry) + 1
+            self._ensure_workers()
+            self._cond.notify()
+            # A cheap job can overtake waiting ones, so their positions change too
+            queued_ids = [entry[2] for entry in self._queue] if position < len(self._queue) else None
+        self._publish_positions(queued_ids)
+        return position
+
+    def _publish_positions(self, queued_ids):
+        if self.on_queue_change is None or not queued_ids:
+            return
+        try:
+            self.on_queue_change([(job_id, index + 1) for index, job_id in enumerate(queued_ids)])
+        except Exception as e:
+            logging.error(f"Queue position callback failed: {str(e)}")
+
+    def reserve_download(self, timeout=0):
+        """JobSlots holding a network slot for a transfer that runs outside the queue, or None.
+
+        Pipe-through relays use this so they count against max_downloads like
+        queued jobs; the caller releases the slots when the transfer ends.
+        """
+        if not self.download_slots.acquire(timeout=timeout):
+            return None
+        slots = JobSlots(self)
+        slots.downloading = True
+        return slots
+
+    def position(self, job_id):
+        """1-based position of a waiting job, or None if it is not queued"""
+        with self._cond:
+            for index, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    return index + 1
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'queued_clients': len({entry[3] for entry in self._queue}),
+                'active': self._active,
+                'workers': len(self._workers),
+                'max_workers': self.max_workers,
+                'max_downloads': self.max_downloads,
+                'max_conversions': self.max_conversions,
+                'max_queue': self.max_queue,
+            }
+
+    def _ensure_workers(self):
+        # Workers start lazily so importing the app never spawns threads
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, name=f'download-worker-{len(self._workers)}')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    index = next((i for i, entry in enumerate(self._queue) if entry[5] <= now), None)
+                    if index is not None:
+                        break
+                    # Nothing runnable: sleep until a job arrives or a put-back job is due
+                    due = min((entry[5] for entry in self._queue), default=None)
+                    self._cond.wait(None if due is None else due - now)
+                entry = self._queue.pop(index)
+                start, _, job_id, client, func, _ = entry
+                self._clock = max(self._clock, start)
+                # Clients whose queued work has all been served start afresh at the clock
+                for idle in [c for c, finish in self._client_finish.items() if finish <= start]:
+                    del self._client_finish[idle]
+                self._active += 1
+                queued_ids = [entry[2] for entry in self._queue]
+
+            # Let other processes see the new positions of the jobs still waiting
+            self._publish_positions(queued_ids)
+
+            slots = JobSlots(self)
+            try:
+                slots.start_download()
+                func(slots)
+            except RetryLater as e:
+                logging.info(f"Download job {job_id} put back: {str(e)}")
+                with self._cond:
+                    bisect.insort(self._queue, entry[:5] + (time.monotonic() + e.delay,))
+                    self._cond.notify()
+            except Exception as e:
+                logging.error(f"Download job {job_id} failed: {str(e)}", exc_info=True)
+            finally:
+                slots.release()
+                with self._cond:
+                    self._active -= 1
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+_max_downloads = _env_int('MAX_CONCURRENT_DOWNLOADS', 4)
+_max_conversions = _env_int('MAX_CONCURRENT_CONVERSIONS', max(1, (os.cpu_count() or 2) // 2))
+
+# Shared scheduler for all download requests handled by this process
+scheduler = DownloadScheduler(
+    max_workers=_env_int('DOWNLOAD_WORKERS', _max_downloads + _max_conversions),
+    max_downloads=_max_downloads,
+    max_conversions=_max_conversions,
+    max_queue=_env_int('DOWNLOAD_QUEUE_SIZE', 100),
+)
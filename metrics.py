@@ -0,0 +1,232 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit to a slow extraction or long conversion
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Throughput buckets in bytes per second (100 KB/s .. 1 GB/s)
+THROUGHPUT_BUCKETS = (1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 1e9)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, key, value in self.samples():
+            extra = key[len(self.label_names):] if len(key) > len(self.label_names) else None
+            lines.append(f'{name}{_format_labels(self.label_names, key[:len(self.label_names)], extra[0] if extra else None)} '
+                         f'{_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._values.items())]
+        samples = []
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', key + (('le', _format_value(float(bound))),), cumulative))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Counters, gauges and histograms are updated where things happen;
+    collectors are called at scrape time for values other components
+    already keep (queue depth, cache hits, disk usage) and return
+    [(name, kind, help, [(labels_dict, value), ...]), ...].
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def collector(self, func):
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logging.error(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {str(e)}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared registry for this process (each gunicorn worker exposes its own)
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'ytdown_stage_seconds', 'Time spent in each stage of a request', ('operation', 'stage'))
+EXTRACTION_SECONDS = registry.histogram(
+    'ytdown_extraction_seconds', 'yt-dlp metadata extractions (cache misses only)', ('outcome',))
+DOWNLOAD_BYTES = registry.counter(
+    'ytdown_download_bytes_total', 'Bytes downloaded from media hosts')
+DOWNLOAD_THROUGHPUT = registry.histogram(
+    'ytdown_download_throughput_bytes_per_second', 'Average speed of each finished media download',
+    buckets=THROUGHPUT_BUCKETS)
+DOWNLOADS = registry.counter(
+    'ytdown_downloads_total', 'Finished download jobs', ('outcome',))
+CONVERSION_SECONDS = registry.histogram(
+    'ytdown_conversion_seconds', 'Duration of each postprocessing step', ('step',))
+
+
+@contextmanager
+def span(operation, stage):
+    """Time one stage of an operation into ytdown_stage_seconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, operation=operation, stage=stage)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s.%s took %.3fs", operation, stage, elapsed)
+
+
+class ThroughputRecorder:
+    """yt-dlp progress hook recording bytes and average speed of each finished download"""
+
+    def progress_hook(self, d):
+        if d.get('status') != 'finished':
+            return
+        # A file found already downloaded (resumed job, segmented prefetch) is reported without
+        # downloaded_bytes; its bytes were counted when they actually moved
+        size = d.get('downloaded_bytes')
+        if not size:
+            return
+        DOWNLOAD_BYTES.inc(size)
+        elapsed = d.get('elapsed')
+        if elapsed:
+            DOWNLOAD_THROUGHPUT.observe(size / elapsed)
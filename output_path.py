@@ -0,0 +1,39 @@
+import os
+
+
+class OutputTracker:
+    """Records where yt-dlp writes a download so the final file never has to be searched for.
+
+    The download's 'finished' progress event names the raw file, each
+    postprocessor's 'finished' event names its output (merge, conversion,
+    audio extraction), and the returned info dict lists the final filepath
+    of every requested download.
+    """
+
+    def __init__(self):
+        self.downloaded = None
+        self.postprocessed = None
+
+    def progress_hook(self, d):
+        if d.get('status') == 'finished' and d.get('filename'):
+            self.downloaded = d['filename']
+
+    def postprocessor_hook(self, d):
+        if d.get('status') == 'finished':
+            filepath = (d.get('info_dict') or {}).get('filepath')
+            if filepath:
+                self.postprocessed = filepath
+
+    def final_path(self, info=None):
+        """Best known final output path that exists on disk, or None"""
+        candidates = []
+        if info:
+            for download in reversed(info.get('requested_downloads') or []):
+                candidates.append(download.get('filepath'))
+            candidates.append(info.get('filepath'))
+        candidates.extend([self.postprocessed, self.downloaded])
+
+        for path in candidates:
+            if path and os.path.isfile(path):
+                return path
+        return None
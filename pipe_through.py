@@ -0,0 +1,124 @@
+import re
+import logging
+import urllib.request
+import urllib.error
+from flask import request, Response, jsonify
+from file_delivery import content_disposition
+
+# Bytes read from upstream per iteration; this bounds memory per relayed stream
+RELAY_CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_TOTAL = re.compile(r'/(\d+)\s*$')
+
+
+def _open_upstream(plan, start, end=None):
+    headers = dict(plan.get('http_headers') or {})
+    headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    req = urllib.request.Request(plan['url'], headers=headers)
+    return urllib.request.urlopen(req, timeout=30)
+
+
+def _pump(resp):
+    try:
+        while True:
+            chunk = resp.read(RELAY_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        resp.close()
+
+
+def _unpaced(chunks):
+    return chunks
+
+
+def _tracked(chunks, length, report):
+    # report(sent, length, done): done is None while bytes flow, then whether the body was complete
+    sent = 0
+    complete = False
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            report(sent, length, None)
+            yield chunk
+        complete = length is None or sent >= length
+    finally:
+        report(sent, length, complete)
+
+
+def relay_stream(plan, download_name, pace=None, report=None):
+    """Relay a planned direct media URL to the client while it downloads.
+
+    Nothing is written to disk. When the extractor asks for chunked requests
+    (YouTube throttles long single requests) the upstream is fetched as a
+    series of byte windows, exactly as yt-dlp's HTTP downloader would.
+    report, when given, is called as report(sent, length, done) for every
+    chunk relayed and once more when the body ends or the client goes away.
+    """
+    paced = pace or _unpaced
+
+    def pace(chunks, length=None):
+        return paced(_tracked(chunks, length, report) if report else chunks)
+
+    chunk_size = plan.get('chunk_size')
+
+    # Honour a single "start-" or "start-end" client range
+    start, want_end = 0, None
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) == 1 and byte_range.ranges[0][0] >= 0:
+        start, stop = byte_range.ranges[0]
+        want_end = stop - 1 if stop is not None else None
+
+    first_end = want_end
+    if chunk_size:
+        first_end = start + chunk_size - 1 if want_end is None else min(start + chunk_size - 1, want_end)
+
+    try:
+        resp = _open_upstream(plan, start, first_end)
+    except (urllib.error.URLError, OSError) as e:
+        logging.error(f"Upstream stream failed: {str(e)}")
+        return jsonify({'error': f'Failed to reach media source: {str(e)}'}), 502
+
+    headers = {
+        'Content-Disposition': content_disposition(download_name),
+        'Cache-Control': 'no-store',
+    }
+    mimetype = resp.headers.get('Content-Type', 'application/octet-stream')
+
+    if resp.status != 206:
+        # Upstream ignored the range: relay the whole body as it arrives
+        length = resp.headers.get('Content-Length')
+        if length:
+            headers['Content-Length'] = length
+        return Response(pace(_pump(resp), int(length) if length else None), status=200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    match = CONTENT_RANGE_TOTAL.search(resp.headers.get('Content-Range', ''))
+    total = int(match.group(1)) if match else None
+    if total is None:
+        # Unknown size: relay this response without windowing
+        return Response(pace(_pump(resp)), status=200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    last = min(want_end, total - 1) if want_end is not None else total - 1
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Content-Length'] = str(last - start + 1)
+    status = 200
+    if byte_range is not None and (start > 0 or last < total - 1):
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{last}/{total}'
+
+    def generate():
+        yield from _pump(resp)
+        pos = (first_end + 1) if first_end is not None else total
+        while pos <= last:
+            window_end = min(pos + chunk_size - 1, last) if chunk_size else last
+            try:
+                window = _open_upstream(plan, pos, window_end)
+            except (urllib.error.URLError, OSError) as e:
+                # Headers are already sent; the client sees a short body and can resume
+                logging.error(f"Upstream window {pos}-{window_end} failed: {str(e)}")
+                return
+            yield from _pump(window)
+            pos = window_end + 1
+
+    return Response(pace(generate(), last - start + 1), status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
@@ -0,0 +1,277 @@
+import os
+import math
+import time
+import threading
+import logging
+
+# Share of the overall bar given to postprocessing, by what it has to do
+CONVERSION_WEIGHTS = {'transcode': 0.35, 'remux': 0.05, 'none': 0.0}
+MERGE_WEIGHT = 0.05
+
+# Half-life in seconds of the rolling download speed
+SPEED_HALFLIFE = 3.0
+
+# Postprocessors that run ffmpeg, mapped to the stage they report
+POSTPROCESSOR_STAGES = {
+    'Merger': 'merge',
+    'VideoConvertor': 'convert',
+    'VideoRemuxer': 'convert',
+    'ExtractAudio': 'convert',
+}
+
+# postprocessor_args keys of the ffmpeg postprocessors above
+FFMPEG_ARG_KEYS = ('merger', 'videoconvertor', 'videoremuxer', 'extractaudio')
+
+
+class _Stage:
+    def __init__(self, name, weight, total_bytes=None, format_id=None):
+        self.name = name
+        self.weight = weight
+        self.total_bytes = total_bytes
+        self.format_id = format_id
+        self.done_bytes = 0
+        self.fraction = 0.0
+
+
+class ProgressModel:
+    """Progress of one download across its stages, published at most once per interval.
+
+    Stages are download_video / download_audio (weighted by their expected
+    bytes), merge and convert (weighted by how much work the conversion plan
+    needs). Overall percent is the weighted sum of stage fractions. Download
+    speed is an exponentially weighted moving average over byte deltas; ETA
+    covers the remaining bytes, or the remaining ffmpeg time while converting.
+    ffmpeg progress is read from the file named in its -progress option.
+
+    Hook calls are cheap when nothing is due: they update a few attributes
+    and return; only one thread at a time builds and publishes a snapshot.
+    """
+
+    def __init__(self, publish, interval=0.5, duration=None):
+        self.publish = publish
+        self.interval = interval
+        self.duration = duration
+        self.stages = [_Stage('download_video', 1.0)]
+        self.current = self.stages[0]
+        self.speed = None
+        self.status = 'downloading'
+        self.progress_path = None
+        self._last_bytes = None
+        self._last_time = None
+        self._last_publish = 0.0
+        self._stage_started = None
+        self._publish_lock = threading.Lock()
+        self._poller = None
+        self._poll_stop = threading.Event()
+
+    def configure(self, plan, duration=None):
+        """Build the stages from a download plan (see VideoDownloader._describe_plan)"""
+        if duration:
+            self.duration = duration
+        streams = plan.get('streams') or []
+        action = (plan.get('conversion') or {}).get('action', 'none')
+        merged = len(streams) > 1
+
+        post_weight = (MERGE_WEIGHT if merged else 0.0) + (CONVERSION_WEIGHTS.get(action, 0.0) if plan.get('convert') else 0.0)
+        sizes = [stream.get('bytes') for stream in streams]
+        if streams and all(sizes):
+            shares = [size / float(sum(sizes)) for size in sizes]
+        elif merged:
+            # Unknown sizes: video usually dwarfs audio
+            shares = [0.85 if stream['kind'] == 'video' else 0.15 for stream in streams]
+            total = sum(shares)
+            shares = [share / total for share in shares]
+        else:
+            shares = [1.0] * len(streams)
+
+        stages = [
+            _Stage(f"download_{stream['kind']}", share * (1.0 - post_weight), stream.get('bytes'), stream.get('format_id'))
+            for stream, share in zip(streams, shares)
+        ] or [_Stage('download_video', 1.0 - post_weight)]
+        if merged:
+            stages.append(_Stage('merge', MERGE_WEIGHT))
+        if plan.get('convert') and CONVERSION_WEIGHTS.get(action):
+            stages.append(_Stage('convert', CONVERSION_WEIGHTS[action]))
+        self.stages = stages
+        self.current = stages[0]
+
+    def ffmpeg_args(self, path):
+        """Options that make ffmpeg write machine-readable progress to path"""
+        self.progress_path = path
+        return ['-progress', path, '-nostats']
+
+    def _stage_for_download(self, d):
+        format_id = (d.get('info_dict') or {}).get('format_id')
+        downloads = [stage for stage in self.stages if stage.name.startswith('download_')]
+        for stage in downloads:
+            if stage.format_id and stage.format_id == format_id:
+                return stage
+        # Unknown format: the first download stage that has not finished
+        for stage in downloads:
+            if stage.fraction < 1.0:
+                return stage
+        return downloads[-1] if downloads else self.current
+
+    def _stage_named(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        stage = _Stage(name, 0.0)
+        self.stages.append(stage)
+        return stage
+
+    def progress_hook(self, d):
+        status = d.get('status')
+        if status == 'downloading':
+            stage = self.current
+            if not stage.name.startswith('download_') or stage.fraction >= 1.0:
+                stage = self.current = self._stage_for_download(d)
+            done = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or stage.total_bytes
+            stage.done_bytes = done
+            if total:
+                stage.total_bytes = total
+                stage.fraction = min(1.0, done / float(total))
+            self._update_speed(done)
+            self.status = 'downloading'
+            self._maybe_publish()
+        elif status == 'finished':
+            stage = self.current if self.current.name.startswith('download_') else self._stage_for_download(d)
+            stage.fraction = 1.0
+            stage.done_bytes = d.get('downloaded_bytes') or d.get('total_bytes') or stage.done_bytes
+            if stage.done_bytes:
+                stage.total_bytes = stage.done_bytes
+            self._last_bytes = None
+            # d['filename'] is a part file still to be merged or converted; the job publishes the final path
+            self._maybe_publish(force=True)
+
+    def postprocessor_hook(self, d):
+        name = POSTPROCESSOR_STAGES.get(d.get('postprocessor'))
+        if name is None:
+            return
+        stage = self._stage_named(name)
+        if d.get('status') == 'started':
+            for earlier in self.stages:
+                if earlier.name.startswith('download_'):
+                    earlier.fraction = 1.0
+            self.current = stage
+            self.status = 'converting'
+            self._stage_started = time.monotonic()
+            self._start_polling()
+            self._maybe_publish(force=True)
+        elif d.get('status') == 'finished':
+            self._stop_polling()
+            stage.fraction = 1.0
+            self._maybe_publish(force=True)
+
+    def _update_speed(self, done):
+        now = time.monotonic()
+        if self._last_bytes is not None and now > self._last_time and done >= self._last_bytes:
+            dt = now - self._last_time
+            sample = (done - self._last_bytes) / dt
+            if self.speed is None:
+                self.speed = sample
+            else:
+                alpha = 1.0 - math.exp(-dt * math.log(2) / SPEED_HALFLIFE)
+                self.speed += alpha * (sample - self.speed)
+        self._last_bytes = done
+        self._last_time = now
+
+    def _ffmpeg_fraction(self):
+        # ffmpeg appends key=value blocks; the last out_time_us is the position reached
+        if not self.progress_path or not self.duration:
+            return None
+        try:
+            with open(self.progress_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 2048))
+                tail = f.read().decode('ascii', 'ignore')
+        except OSError:
+            return None
+        position = None
+        for line in tail.splitlines():
+            if line.startswith('out_time_us=') or line.startswith('out_time_ms='):
+                try:
+                    position = int(line.split('=', 1)[1])
+                except ValueError:
+                    continue
+        if position is None:
+            return None
+        return max(0.0, min(1.0, position / (self.duration * 1e6)))
+
+    def _start_polling(self):
+        self._stop_polling()
+        if self.progress_path:
+            try:
+                os.remove(self.progress_path)
+            except OSError:
+                pass
+        if not self.progress_path or not self.duration:
+            return
+        self._poll_stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll, args=(self._poll_stop,), name='ffmpeg-progress')
+        self._poller.daemon = True
+        self._poller.start()
+
+    def _stop_polling(self):
+        if self._poller is not None:
+            self._poll_stop.set()
+            self._poller = None
+
+    def _poll(self, stop):
+        while not stop.wait(max(self.interval, 0.25)):
+            fraction = self._ffmpeg_fraction()
+            if fraction is not None:
+                self.current.fraction = fraction
+                self._maybe_publish()
+
+    def _eta(self):
+        if self.status == 'converting':
+            fraction = self.current.fraction
+            if self._stage_started and fraction > 0:
+                elapsed = time.monotonic() - self._stage_started
+                return int(elapsed * (1.0 - fraction) / fraction)
+            return None
+        if not self.speed:
+            return None
+        remaining = sum(max(0, (stage.total_bytes or 0) - stage.done_bytes)
+                        for stage in self.stages if stage.name.startswith('download_'))
+        return int(remaining / self.speed)
+
+    def snapshot(self):
+        """Current progress fields as stored in the progress store"""
+        overall = sum(stage.weight * stage.fraction for stage in self.stages)
+        total_weight = sum(stage.weight for stage in self.stages) or 1.0
+        downloads = [stage for stage in self.stages if stage.name.startswith('download_')]
+        totals = [stage.total_bytes for stage in downloads]
+        return {
+            'status': self.status,
+            'stage': self.current.name,
+            'stage_progress': round(self.current.fraction * 100, 1),
+            # Never report 100 before the job has actually finished
+            'progress': round(min(99.9, overall / total_weight * 100), 1),
+            'downloaded_bytes': sum(stage.done_bytes for stage in downloads),
+            'total_bytes': sum(totals) if totals and all(totals) else None,
+            'speed': round(self.speed) if self.speed else None,
+            'eta': self._eta(),
+        }
+
+    def _maybe_publish(self, force=False, **extra):
+        now = time.monotonic()
+        if not force and now - self._last_publish < self.interval:
+            return
+        # Another thread is already publishing (e.g. concurrent fragment downloads); skip this one
+        if not self._publish_lock.acquire(blocking=force):
+            return
+        try:
+            self._last_publish = now
+            fields = self.snapshot()
+            fields.update(extra)
+            self.publish(fields, force)
+        except Exception as e:
+            logging.debug("Publishing progress failed: %s", e)
+        finally:
+            self._publish_lock.release()
+
+    def close(self):
+        self._stop_polling()
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+
+
+def _is_live(entry):
+    """True when a claimed job can still be attached to"""
+    return entry is not None and entry.get('status') not in ('finished', 'error')
+
+
+class MemoryProgressStore:
+    """Progress and job state kept in this process only"""
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        self._updated = {}
+        self._claims = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            return dict(entry) if entry is not None else None
+
+    def set(self, job_id, entry):
+        with self._lock:
+            self._entries[job_id] = dict(entry)
+            self._bump(job_id)
+
+    def update(self, job_id, fields):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                entry.update(fields)
+                self._bump(job_id)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+            self._versions.pop(job_id, None)
+            self._updated.pop(job_id, None)
+            self._changed.notify_all()
+
+    def _bump(self, job_id):
+        self._versions[job_id] = self._versions.get(job_id, 0) + 1
+        self._updated[job_id] = time.time()
+        self._changed.notify_all()
+
+    def expire(self, max_age):
+        """Drop entries not updated for max_age seconds; returns how many were removed"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            stale = [job_id for job_id, updated in self._updated.items() if updated < cutoff]
+            for job_id in stale:
+                self._entries.pop(job_id, None)
+                self._versions.pop(job_id, None)
+                self._updated.pop(job_id, None)
+            stale_ids = set(stale)
+            for key in [k for k, v in self._claims.items() if v in stale_ids]:
+                del self._claims[key]
+            if stale:
+                self._changed.notify_all()
+            return len(stale)
+
+    def wait_for_change(self, job_id, version, timeout):
+        """Block until the entry's version differs from version; return (entry, version)"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._versions.get(job_id) == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            entry = self._entries.get(job_id)
+            return (dict(entry) if entry is not None else None), self._versions.get(job_id)
+
+    def claim(self, key, job_id):
+        """Register job_id as the producer of key; return the existing owner if there is one"""
+        with self._lock:
+            existing = self._claims.get(key)
+            if existing is not None and _is_live(self._entries.get(existing)):
+                return existing
+            self._claims[key] = job_id
+            return None
+
+    def release(self, key):
+        with self._lock:
+            self._claims.pop(key, None)
+
+
+class SQLiteProgressStore:
+    """Progress and job state in a SQLite file shared by every process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                'job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS claims ('
+                'key TEXT PRIMARY KEY, job_id TEXT NOT NULL, created REAL NOT NULL)'
+            )
+
+    def _conn(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT data FROM progress WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def wait_for_change(self, job_id, version, timeout, poll_interval=0.2):
+        """Poll until the row's update time differs from version; return (entry, version)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            row = self._conn().execute(
+                'SELECT data, updated FROM progress WHERE job_id = ?', (job_id,)
+            ).fetchone()
+            current = row[1] if row else None
+            if current != version or time.monotonic() >= deadline:
+                return (json.loads(row[0]) if row else None), current
+            time.sleep(poll_interval)
+
+    def set(self, job_id, entry):
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO progress (job_id, data, updated) VALUES (?, ?, ?)',
+                (job_id, json.dumps(entry), time.time()),
+            )
+
+    def update(self, job_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT data FROM progress WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            entry = json.loads(row[0])
+            entry.update(fields)
+            conn.execute(
+                'UPDATE progress SET data = ?, updated = ? WHERE job_id = ?',
+                (json.dumps(entry), time.time(), job_id),
+            )
+
+    def delete(self, job_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM progress WHERE job_id = ?', (job_id,))
+
+    def expire(self, max_age):
+        cutoff = time.time() - max_age
+        with self._transaction() as conn:
+            conn.execute(
+                'DELETE FROM claims WHERE job_id IN (SELECT job_id FROM progress WHERE updated < ?)',
+                (cutoff,),
+            )
+            return conn.execute('DELETE FROM progress WHERE updated < ?', (cutoff,)).rowcount
+
+    def claim(self, key, job_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT claims.job_id, progress.data FROM claims '
+                'LEFT JOIN progress ON progress.job_id = claims.job_id WHERE claims.key = ?',
+                (key,),
+            ).fetchone()
+            if row is not None and _is_live(json.loads(row[1]) if row[1] else None):
+                return row[0]
+            conn.execute(
+                'INSERT OR REPLACE INTO claims (key, job_id, created) VALUES (?, ?, ?)',
+                (key, job_id, time.time()),
+            )
+            return None
+
+    def release(self, key):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+
+class _Transaction:
+    """Runs a block inside BEGIN IMMEDIATE ... COMMIT so read-modify-write is atomic across processes"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class ThrottledProgressWriter:
+    """Batches frequent progress updates for one job into at most one store write per interval.
+
+    Fields from every call are merged; the merged batch is written when the
+    interval has elapsed or when the caller forces it (status changes, errors).
+    """
+
+    def __init__(self, store, job_id, interval=0.5):
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval
+        self._pending = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, force=False, **fields):
+        with self._lock:
+            self._pending.update(fields)
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.interval:
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+
+            # Write while holding the lock so batches for one job land in order
+            if pending:
+                self.store.update(self.job_id, pending)
+
+    def flush(self):
+        self.update(force=True)
+
+
+def create_progress_store():
+    """Build the progress store selected by PROGRESS_BACKEND (memory or sqlite)"""
+    backend = os.environ.get('PROGRESS_BACKEND', 'memory').lower()
+    if backend == 'sqlite':
+        path = os.environ.get('PROGRESS_DB_PATH', os.path.join(tempfile.gettempdir(), 'ytdown-progress.sqlite3'))
+        logging.info(f"Using SQLite progress store at {path}")
+        return SQLiteProgressStore(path)
+    if backend != 'memory':
+        logging.warning(f"Unknown PROGRESS_BACKEND {backend!r}, using in-memory progress store")
+    return MemoryProgressStore()
+
+
+# Shared progress store for this process
+progress_store = create_progress_store()
+
+# Minimum seconds between progress writes coming from yt-dlp hooks
+PROGRESS_WRITE_INTERVAL = float(os.environ.get('PROGRESS_WRITE_INTERVAL', 0.5))
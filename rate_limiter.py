@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Extraction requests per second allowed to one site (0 disables), and how many may burst at once
+HOST_RATE_LIMIT = float(os.environ.get('HOST_RATE_LIMIT', 2.0))
+HOST_RATE_BURST = int(os.environ.get('HOST_RATE_BURST', 10))
+
+# Longest a queued download may be put back for its turn before it is turned away
+HOST_MAX_WAIT = float(os.environ.get('HOST_MAX_WAIT', 20))
+
+# Consecutive throttling errors that open a site's circuit, and the first cool-down
+HOST_BREAKER_THRESHOLD = int(os.environ.get('HOST_BREAKER_THRESHOLD', 4))
+HOST_BREAKER_COOLDOWN = float(os.environ.get('HOST_BREAKER_COOLDOWN', 60))
+
+# Error text that means the site is throttling or bot-checking us
+THROTTLE_MARKERS = (
+    'sign in to confirm',
+    'not a bot',
+    'http error 429',
+    'too many requests',
+    'rate-limit',
+    'rate limit',
+)
+
+# Hostnames served by the same backend share one limiter
+HOST_ALIASES = {'youtu.be': 'youtube.com', 'youtube-nocookie.com': 'youtube.com'}
+HOST_PREFIXES = ('www.', 'm.', 'music.', 'mobile.')
+
+
+class RateLimited(Exception):
+    """Raised when a request to a host cannot be scheduled in time"""
+
+    def __init__(self, host, retry_after, message):
+        super().__init__(message)
+        self.host = host
+        self.retry_after = retry_after
+
+
+def host_key(url):
+    host = (urlparse(url).hostname or '').lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return HOST_ALIASES.get(host, host)
+
+
+def is_throttle_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+
+class _HostState:
+    def __init__(self, rate, cooldown):
+        self.rate = rate
+        self.tat = 0.0
+        self.throttles = 0
+        self.consecutive = 0
+        self.open_until = 0.0
+        self.cooldown = cooldown
+        self.probing = False
+        self.rejected = 0
+
+
+class HostRateLimiter:
+    """Per-host request scheduling with adaptive backoff and a circuit breaker.
+
+    - Each host has a token bucket (GCRA form) of `rate` requests per second
+      with `burst` tolerance. A request that would have to wait is turned
+      away with RateLimited, whose retry_after says when the host has a
+      slot; nothing sleeps in the limiter. Request handlers answer 429 with
+      Retry-After and the download scheduler queues the job again.
+    - Throttling errors (429, bot checks) halve the host's rate; successes
+      win it back additively (AIMD).
+    - `breaker_threshold` throttles in a row open the circuit: requests fail
+      fast for the cool-down, then one probe decides whether it closes again.
+      Each reopening doubles the cool-down, up to 16x.
+    """
+
+    def __init__(self, rate=2.0, burst=10, max_wait=20, breaker_threshold=4, breaker_cooldown=60):
+        self.base_rate = rate
+        self.min_rate = rate / 16
+        self.burst = burst
+        self.max_wait = max_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.base_rate, self.breaker_cooldown)
+        return state
+
+    def reserve(self, url, max_wait=None):
+        """Claim the next slot for url's host and return how long to wait for it (at most max_wait)"""
+        host = host_key(url)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(host)
+
+            if state.open_until:
+                if now < state.open_until or state.probing:
+                    state.rejected += 1
+                    retry_after = max(state.open_until - now, 1.0)
+                    raise RateLimited(host, retry_after, f'{host} is blocking requests; retry in {int(retry_after) + 1}s')
+                # Cool-down over: let a single probe through
+                state.probing = True
+                return 0.0
+
+            if self.base_rate <= 0:
+                return 0.0
+
+            interval = 1.0 / state.rate
+            tolerance = (self.burst - 1) * interval
+            tat = max(state.tat, now)
+            delay = max(0.0, tat - tolerance - now)
+            if delay > (self.max_wait if max_wait is None else max_wait):
+                state.rejected += 1
+                raise RateLimited(host, delay, f'Too many requests to {host}; retry in {int(delay) + 1}s')
+            state.tat = tat + interval
+            return delay
+
+    def acquire(self, url):
+        """Take a slot for url's host now, or raise RateLimited saying when one is free.
+
+        The slot is not booked when the caller has to come back later, so a
+        request that is turned away costs the host nothing.
+        """
+        self.reserve(url, max_wait=0)
+
+    def record_success(self, url):
+        with self._lock:
+            state = self._state(host_key(url))
+            state.consecutive = 0
+            state.rate = min(self.base_rate, state.rate + self.base_rate / 10)
+            if state.open_until:
+                logging.info(f"Circuit for {host_key(url)} closed")
+                state.open_until = 0.0
+                state.cooldown = self.breaker_cooldown
+            state.probing = False
+
+    def record_throttle(self, url):
+        host = host_key(url)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(host)
+            state.throttles += 1
+            state.consecutive += 1
+            if self.base_rate > 0:
+                state.rate = max(self.min_rate, state.rate / 2)
+                # Use up the burst allowance so the next request waits a full (now longer) interval
+                state.tat = max(state.tat, now + (self.burst - 1) / state.rate) + 1.0 / state.rate
+
+            if state.probing or state.consecutive >= self.breaker_threshold:
+                if state.probing:
+                    state.cooldown = min(state.cooldown * 2, self.breaker_cooldown * 16)
+                state.open_until = now + state.cooldown
+                state.probing = False
+                logging.warning(f"Circuit for {host} open for {state.cooldown:.0f}s after {state.consecutive} throttled requests")
+
+    def record_other(self, url):
+        """Outcome that says nothing about throttling (e.g. a removed video)"""
+        with self._lock:
+            self._state(host_key(url)).probing = False
+
+    @contextmanager
+    def request(self, url):
+        """Take a slot (or raise RateLimited), then record how the request inside the block went"""
+        self.acquire(url)
+        try:
+            yield
+        except Exception as e:
+            if is_throttle_error(e):
+                self.record_throttle(url)
+            else:
+                self.record_other(url)
+            raise
+        self.record_success(url)
+
+    def call(self, url, func, attempts=3):
+        """Run func() under the limiter; a throttled attempt is retried only if the host still has a slot"""
+        for attempt in range(attempts):
+            try:
+                with self.request(url):
+                    return func()
+            except RateLimited:
+                raise
+            except Exception as e:
+                if not is_throttle_error(e) or attempt == attempts - 1:
+                    raise
+                logging.info(f"Throttled by {host_key(url)} (attempt {attempt + 1}), retrying: {e}")
+
+    def retry_after(self, url):
+        """Whole seconds until url's host accepts requests again (0 when it does now)"""
+        with self._lock:
+            state = self._hosts.get(host_key(url))
+            if not state or not state.open_until:
+                return 0
+            return max(0, int(state.open_until - time.monotonic()) + 1)
+
+    def is_open(self, url):
+        with self._lock:
+            state = self._hosts.get(host_key(url))
+            return bool(state and state.open_until and time.monotonic() < state.open_until)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'rate': round(state.rate, 3),
+                    'queued_seconds': round(max(0.0, state.tat - now), 2),
+                    'throttles': state.throttles,
+                    'rejected': state.rejected,
+                    'circuit_open': bool(state.open_until and now < state.open_until),
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+# Shared limiter for every extraction in this process
+rate_limiter = HostRateLimiter(
+    rate=HOST_RATE_LIMIT,
+    burst=HOST_RATE_BURST,
+    max_wait=HOST_MAX_WAIT,
+    breaker_threshold=HOST_BREAKER_THRESHOLD,
+    breaker_cooldown=HOST_BREAKER_COOLDOWN,
+)
@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import logging
+import threading
+import http.client
+import urllib.request
+import urllib.error
+
+# Parallel connections for one progressive download; 1 leaves it to yt-dlp's single connection
+SEGMENTED_CONNECTIONS = int(os.environ.get('SEGMENTED_CONNECTIONS', 1))
+
+# Progressive files smaller than this (in megabytes) are not worth splitting
+SEGMENTED_MIN_MB = float(os.environ.get('SEGMENTED_MIN_MB', 16))
+
+# Attempts per byte range before the download falls back to a single connection
+SEGMENT_RETRIES = int(os.environ.get('SEGMENT_RETRIES', 3))
+
+# Ranges are small enough that fast connections take over the work of slow ones
+SEGMENTS_PER_CONNECTION = 4
+MIN_SEGMENT_SIZE = 1024 * 1024
+READ_SIZE = 256 * 1024
+REQUEST_TIMEOUT = 30
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)\s*$')
+
+
+class RangeNotSupported(Exception):
+    """The server answered a range request with the whole file (or without a usable size)"""
+
+
+class SegmentedDownloadError(Exception):
+    """A byte range still failed after SEGMENT_RETRIES attempts"""
+
+
+class SegmentedDownload:
+    """Fetches one file as byte ranges over several connections into a preallocated .part file.
+
+    The first range request doubles as the probe: a 206 with a Content-Range
+    gives the file size, anything else raises RangeNotSupported before a
+    byte is written. Workers then take ranges from a shared list, write them
+    in place with pwrite() and retry a failed range from where it stopped.
+    Progress is reported to yt-dlp-style progress hooks with the combined
+    byte count, so the usual hooks (progress model, bandwidth pacing,
+    output tracking) work unchanged.
+    """
+
+    def __init__(self, url, path, connections, http_headers=None, progress_hooks=(), info_dict=None,
+                 max_segment_size=None):
+        self.url = url
+        self.path = path
+        self.tmp_path = path + '.part'
+        self.connections = connections
+        self.http_headers = dict(http_headers or {})
+        self.progress_hooks = list(progress_hooks)
+        self.info_dict = info_dict or {}
+        self.max_segment_size = max_segment_size
+        self.total = None
+        self.downloaded = 0
+        self._segments = []
+        self._failed = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def applicable(chosen, connections):
+        """True when chosen (a resolved yt-dlp format) is a single direct HTTP file worth splitting"""
+        if not connections or connections < 2 or chosen.get('requested_formats'):
+            return False
+        if chosen.get('protocol') not in ('http', 'https') or not chosen.get('url'):
+            return False
+        # Unknown sizes are probed: the first range response says how large the file is
+        size = chosen.get('filesize') or chosen.get('filesize_approx')
+        return not size or size >= SEGMENTED_MIN_MB * 1024 * 1024
+
+    def _open(self, start, end):
+        headers = dict(self.http_headers, Range=f'bytes={start}-{end}')
+        return urllib.request.urlopen(urllib.request.Request(self.url, headers=headers), timeout=REQUEST_TIMEOUT)
+
+    def _segment_size(self, total):
+        size = max(MIN_SEGMENT_SIZE, -(-total // (self.connections * SEGMENTS_PER_CONNECTION)))
+        # Sites that throttle long requests (yt-dlp's http_chunk_size) get ranges no larger than that
+        if self.max_segment_size:
+            size = min(size, self.max_segment_size)
+        return size
+
+    def _probe(self):
+        known = self.info_dict.get('filesize')
+        first_end = (self._segment_size(known) if known else MIN_SEGMENT_SIZE) - 1
+        resp = self._open(0, first_end)
+        match = CONTENT_RANGE.match(resp.headers.get('Content-Range', ''))
+        if resp.status != 206 or not match or int(match.group(1)) != 0:
+            resp.close()
+            raise RangeNotSupported(f'server answered a range request with HTTP {resp.status}')
+        return resp, int(match.group(2)), int(match.group(3))
+
+    def run(self):
+        """Download to path; raises RangeNotSupported, SegmentedDownloadError or OSError"""
+        started = time.monotonic()
+        try:
+            first, first_end, self.total = self._probe()
+        except urllib.error.URLError as e:
+            raise SegmentedDownloadError(f'probe failed: {str(e)}')
+
+        # Each range tracks how far it got, so a retry continues instead of starting over
+        self._segments = [[0, first_end, 0]]
+        size = self._segment_size(self.total)
+        for start in range(first_end + 1, self.total, size):
+            self._segments.append([start, min(start + size, self.total) - 1, 0])
+
+        try:
+            with open(self.tmp_path, 'wb') as f:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, self.total)
+                except (AttributeError, OSError):
+                    f.truncate(self.total)
+
+            pending = list(range(1, len(self._segments)))
+            workers = [threading.Thread(target=self._work, args=(pending, first), name='segment-0')]
+            for index in range(1, min(self.connections, len(self._segments))):
+                workers.append(threading.Thread(target=self._work, args=(pending, None), name=f'segment-{index}'))
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            if self._failed or any(done < end - start + 1 for start, end, done in self._segments):
+                raise SegmentedDownloadError(self._failed or 'a connection stopped before its ranges were done')
+            os.replace(self.tmp_path, self.path)
+        except BaseException:
+            first.close()
+            # A preallocated .part would look complete to yt-dlp's resume logic
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+            raise
+
+        elapsed = time.monotonic() - started
+        self._report({'status': 'finished', 'downloaded_bytes': self.total, 'total_bytes': self.total,
+                      'filename': self.path, 'elapsed': elapsed})
+        logging.info(f"Segmented download of {self.total} bytes over {len(workers)} connections "
+                     f"took {elapsed:.2f}s")
+        return self.path
+
+    def _work(self, pending, first):
+        fd = os.open(self.tmp_path, os.O_WRONLY)
+        try:
+            index = 0
+            while not self._stop.is_set():
+                if first is None:
+                    with self._lock:
+                        if not pending:
+                            return
+                        index = pending.pop(0)
+                if not self._fetch(fd, index, first):
+                    return
+                first = None
+        finally:
+            os.close(fd)
+
+    def _fetch(self, fd, index, resp):
+        segment = self._segments[index]
+        start, end = segment[0], segment[1]
+        for attempt in range(SEGMENT_RETRIES):
+            try:
+                if resp is None:
+                    resp = self._open(start + segment[2], end)
+                    # Bytes are written where the range says, so it must be exactly the one asked for
+                    match = CONTENT_RANGE.match(resp.headers.get('Content-Range', ''))
+                    if resp.status != 206 or not match or int(match.group(1)) != start + segment[2] \
+                            or int(match.group(3)) != self.total:
+                        resp.close()
+                        raise urllib.error.URLError(f'HTTP {resp.status} with unexpected range '
+                                                    f'{resp.headers.get("Content-Range")}')
+                with resp:
+                    while segment[2] < end - start + 1:
+                        if self._stop.is_set():
+                            return False
+                        chunk = resp.read(min(READ_SIZE, end - start + 1 - segment[2]))
+                        if not chunk:
+                            raise urllib.error.URLError('connection closed early')
+                        os.pwrite(fd, chunk, start + segment[2])
+                        segment[2] += len(chunk)
+                        self._advance(len(chunk))
+                return True
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                resp = None
+                logging.warning("Range %d-%d failed (attempt %d/%d): %s", start, end, attempt + 1,
+                                SEGMENT_RETRIES, e)
+                if attempt + 1 < SEGMENT_RETRIES:
+                    time.sleep(2 ** attempt)
+        self._failed = f'range {start}-{end} failed {SEGMENT_RETRIES} times'
+        self._stop.set()
+        return False
+
+    def _advance(self, amount):
+        # Hooks run under the lock: they see a monotonic byte count, and a pacing hook
+        # that sleeps holds back every connection at once
+        with self._lock:
+            self.downloaded += amount
+            self._report({'status': 'downloading', 'downloaded_bytes': self.downloaded,
+                          'total_bytes': self.total, 'filename': self.path, 'tmpfilename': self.tmp_path})
+
+    def _report(self, fields):
+        fields['info_dict'] = self.info_dict
+        for hook in self.progress_hooks:
+            try:
+                hook(fields)
+            except Exception as e:
+                logging.error(f"Progress hook failed during segmented download: {str(e)}")
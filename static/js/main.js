@@ -2,7 +2,9 @@
 class VideoDownloader {
     constructor() {
         this.currentDownloadId = null;
+        this.relayStarted = false;
         this.progressInterval = null;
+        this.progressSource = null;
         this.selectedFormat = null;
         this.selectedQuality = null;
         this.selectedFileFormat = null;
@@ -159,6 +161,13 @@ class VideoDownloader {
         // Update thumbnail
         const thumbnail = document.getElementById('video-thumbnail');
         if (videoData.thumbnail) {
+            // Proxied thumbnails come in the sizes the card needs
+            if (videoData.thumbnail.startsWith('/thumbnail/')) {
+                thumbnail.srcset = `${videoData.thumbnail}?w=320 320w, ${videoData.thumbnail}?w=640 640w`;
+                thumbnail.sizes = '(max-width: 767px) 100vw, 320px';
+            } else {
+                thumbnail.removeAttribute('srcset');
+            }
             thumbnail.src = videoData.thumbnail;
             thumbnail.style.display = 'block';
         } else {
@@ -174,6 +183,12 @@ class VideoDownloader {
         document.querySelectorAll('.format-option').forEach(opt => opt.classList.remove('selected'));
         document.querySelectorAll('.quality-option').forEach(opt => opt.classList.remove('selected'));
         
+        // Clear any clip times from the previous video
+        document.getElementById('clip-start').value = '';
+        document.getElementById('clip-end').value = '';
+        document.getElementById('clip-end').placeholder = videoData.duration
+            ? `End, e.g. ${this.formatDuration(videoData.duration)}` : 'End, e.g. 2:00';
+        
         // Hide quality and file format sections initially
         document.getElementById('quality-section').style.display = 'none';
         document.getElementById('file-format-section').style.display = 'none';
@@ -338,6 +353,10 @@ class VideoDownloader {
             clearInterval(this.progressInterval);
             this.progressInterval = null;
         }
+        if (this.progressSource) {
+            this.progressSource.close();
+            this.progressSource = null;
+        }
     }
 
     updateProgress(percent, status) {
@@ -414,6 +433,10 @@ class VideoDownloader {
             return;
         }
 
+        // Optional clip: blank start means the beginning, blank end the end of the video
+        const clipStart = document.getElementById('clip-start').value.trim();
+        const clipEnd = document.getElementById('clip-end').value.trim();
+
         this.showDownloadProgress();
 
         try {
@@ -424,7 +447,9 @@ class VideoDownloader {
                     url: url,
                     format_id: this.selectedQuality,
                     audio_only: this.selectedFormat === 'audio',
-                    file_format: this.selectedFileFormat
+                    file_format: this.selectedFileFormat,
+                    start: clipStart || null,
+                    end: clipEnd || null
                 })
             });
 
@@ -435,6 +460,7 @@ class VideoDownloader {
             }
 
             this.currentDownloadId = data.download_id;
+            this.relayStarted = false;
             this.trackDownloadProgress();
 
         } catch (error) {
@@ -446,29 +472,54 @@ class VideoDownloader {
     trackDownloadProgress() {
         if (!this.currentDownloadId) return;
 
+        // Prefer the server push stream; fall back to polling if it is unavailable
+        if (window.EventSource) {
+            this.streamDownloadProgress();
+        } else {
+            this.pollDownloadProgress();
+        }
+    }
+
+    streamDownloadProgress() {
+        const source = new EventSource(`/download_progress/${this.currentDownloadId}/stream`);
+        let received = false;
+        this.progressSource = source;
+
+        source.onmessage = (event) => {
+            received = true;
+            try {
+                const data = JSON.parse(event.data);
+                if (this.handleProgressUpdate(data)) {
+                    source.close();
+                    this.progressSource = null;
+                }
+            } catch (error) {
+                console.error('Error parsing progress event:', error);
+            }
+        };
+
+        source.onerror = () => {
+            // The browser reconnects on its own after a dropped stream; only give up
+            // and poll when streaming never worked or the connection is closed for good
+            // (a sync server worker answers 204 so that no stream holds it)
+            if (!received || source.readyState === EventSource.CLOSED) {
+                console.warn('Progress stream unavailable, falling back to polling');
+                source.close();
+                this.progressSource = null;
+                this.pollDownloadProgress();
+            }
+        };
+    }
+
+    pollDownloadProgress() {
         this.progressInterval = setInterval(async () => {
             try {
                 const response = await fetch(`/download_progress/${this.currentDownloadId}`);
                 const data = await response.json();
 
-                if (data.error) {
-                    this.showError(data.error);
-                    this.hideDownloadProgress();
-                    return;
-                }
-
-                if (data.status === 'downloading') {
-                    this.updateProgress(data.progress || 0, 'Downloading...');
-                } else if (data.status === 'converting') {
-                    this.updateProgress(data.progress || 90, 'Converting to selected format...');
-                } else if (data.status === 'finished' || data.progress >= 100) {
-                    this.updateProgress(100, 'Download completed!');
-                    this.showDownloadComplete();
-                    clearInterval(this.progressInterval);
-                } else if (data.status === 'error') {
-                    this.showError(data.error || 'Download failed');
-                    this.hideDownloadProgress();
+                if (this.handleProgressUpdate(data)) {
                     clearInterval(this.progressInterval);
+                    this.progressInterval = null;
                 }
 
             } catch (error) {
@@ -477,6 +528,48 @@ class VideoDownloader {
         }, 1000);
     }
 
+    // Apply one progress update; returns true once the download has finished or failed
+    handleProgressUpdate(data) {
+        if (data.error && !data.status) {
+            this.showError(data.error);
+            this.hideDownloadProgress();
+            return true;
+        }
+
+        if (data.status === 'queued') {
+            const position = data.queue_position ? ` (position ${data.queue_position})` : '';
+            this.updateProgress(0, `Waiting in queue${position}...`);
+        } else if (data.status === 'downloading') {
+            const what = data.stage === 'download_audio' ? 'Downloading audio' : 'Downloading';
+            this.updateProgress(data.progress || 0, `${what}...${this.formatTransfer(data)}`);
+        } else if (data.status === 'converting') {
+            const what = data.stage === 'merge' ? 'Merging audio and video' : 'Converting to selected format';
+            const eta = data.eta ? ` (${this.formatEta(data.eta)} left)` : '';
+            this.updateProgress(data.progress || 0, `${what}...${eta}`);
+        } else if (data.stream && data.status === 'ready') {
+            // A relay starts when the browser fetches the file; keep following its progress
+            if (!this.relayStarted) {
+                this.relayStarted = true;
+                this.updateProgress(0, 'Streaming to your browser...');
+                this.showDownloadComplete();
+            }
+        } else if (data.status === 'streaming') {
+            this.updateProgress(data.progress || 0, `Streaming to your browser...${this.formatTransfer(data)}`);
+        } else if (data.status === 'finished' || data.progress >= 100) {
+            this.updateProgress(100, 'Download completed!');
+            if (!this.relayStarted) {
+                this.showDownloadComplete();
+            }
+            this.relayStarted = false;
+            return true;
+        } else if (data.status === 'error') {
+            this.showError(data.error || 'Download failed');
+            this.hideDownloadProgress();
+            return true;
+        }
+        return false;
+    }
+
     showDownloadComplete() {
         const completeDiv = document.getElementById('download-complete');
         const downloadLink = document.getElementById('download-link');
@@ -529,6 +622,29 @@ class VideoDownloader {
         return num.toString();
     }
 
+    // " 12.3 MB of 45.6 MB at 2.1 MB/s, 0:16 left" from a progress entry
+    formatTransfer(data) {
+        const parts = [];
+        if (data.downloaded_bytes) {
+            const total = data.total_bytes ? ` of ${this.formatFileSize(data.total_bytes)}` : '';
+            parts.push(`${this.formatFileSize(data.downloaded_bytes)}${total}`);
+        }
+        if (data.speed) {
+            parts.push(`at ${this.formatFileSize(data.speed)}/s`);
+        }
+        let text = parts.length ? ` ${parts.join(' ')}` : '';
+        if (data.eta) {
+            text += `, ${this.formatEta(data.eta)} left`;
+        }
+        return text;
+    }
+
+    formatEta(seconds) {
+        const minutes = Math.floor(seconds / 60);
+        const rest = String(Math.floor(seconds % 60)).padStart(2, '0');
+        return minutes >= 60 ? `${Math.floor(minutes / 60)}:${String(minutes % 60).padStart(2, '0')}:${rest}` : `${minutes}:${rest}`;
+    }
+
     formatFileSize(bytes) {
         if (!bytes) return '';
         
@@ -0,0 +1,254 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import logging
+
+# Root directory that owns every file the downloader writes
+DOWNLOAD_ROOT = os.environ.get('DOWNLOAD_ROOT', os.path.join(tempfile.gettempdir(), 'ytdown'))
+
+# Marker file whose mtime records when a stored output was last served
+SERVED_MARKER = '.served'
+
+
+def _dir_usage(path):
+    """Total bytes and newest mtime of the files directly inside path"""
+    total, newest = 0, 0.0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry.is_file(follow_symlinks=False):
+                    total += st.st_size
+                newest = max(newest, st.st_mtime)
+    except OSError:
+        pass
+    return total, newest
+
+
+class StorageManager:
+    """Owns download output on disk: per-job work dirs and the finished-file store.
+
+    - Job work dirs live in <root>/jobs/<job_id> and are removed when the job ends;
+      dirs left behind by crashed processes are swept after orphan_ttl.
+    - Finished outputs in the file store expire served_ttl after they were last
+      served (or orphan_ttl after creation if never served).
+    - When total usage exceeds quota_bytes the least recently used outputs are evicted.
+    - Progress entries older than progress_ttl are dropped from the progress store.
+    - Other caches under the root (thumbnails) hook their own cleanup into each sweep.
+    """
+
+    def __init__(self, root, files_dir, quota_bytes, served_ttl, orphan_ttl, progress_ttl,
+                 sweep_interval, progress_store=None):
+        self.root = os.path.abspath(root)
+        self.jobs_dir = os.path.join(self.root, 'jobs')
+        self.files_dir = os.path.abspath(files_dir)
+        self.quota_bytes = quota_bytes
+        self.served_ttl = served_ttl
+        self.orphan_ttl = orphan_ttl
+        self.progress_ttl = progress_ttl
+        self.sweep_interval = sweep_interval
+        self.progress_store = progress_store
+
+        self.evictions = 0
+        self.expired = 0
+        self.orphans_removed = 0
+        self.progress_expired = 0
+        self.bytes_used = 0
+        self.last_sweep = None
+
+        self._active_dirs = set()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweep_hooks = []
+
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        os.makedirs(self.files_dir, exist_ok=True)
+
+    def create_job_dir(self, job_id):
+        """Create the private work directory for one download job"""
+        self._ensure_sweeper()
+        path = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._active_dirs.add(path)
+        return path
+
+    def add_sweep_hook(self, hook):
+        """Call hook() on every sweep from now on; starts the sweeper if it is not running"""
+        with self._lock:
+            self._sweep_hooks.append(hook)
+        self._ensure_sweeper()
+
+    def remove_job_dir(self, path):
+        with self._lock:
+            self._active_dirs.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def mark_served(self, filename):
+        """Record that a stored output was just served, restarting its TTL"""
+        entry_dir = os.path.dirname(os.path.abspath(filename))
+        if os.path.dirname(entry_dir) != self.files_dir:
+            return
+        marker = os.path.join(entry_dir, SERVED_MARKER)
+        try:
+            with open(marker, 'a'):
+                pass
+            os.utime(marker)
+        except OSError as e:
+            logging.debug(f"Could not mark {filename} as served: {e}")
+
+    def _stored_entries(self):
+        """(last_access, bytes, path, served) for every finished-file store entry"""
+        entries = []
+        try:
+            names = os.listdir(self.files_dir)
+        except OSError:
+            return entries
+        for name in names:
+            path = os.path.join(self.files_dir, name)
+            if not os.path.isdir(path):
+                continue
+            size, newest = _dir_usage(path)
+            served = os.path.exists(os.path.join(path, SERVED_MARKER))
+            entries.append((newest, size, path, served))
+        return entries
+
+    def _job_dirs(self):
+        dirs = []
+        try:
+            names = os.listdir(self.jobs_dir)
+        except OSError:
+            return dirs
+        for name in names:
+            path = os.path.join(self.jobs_dir, name)
+            if os.path.isdir(path):
+                size, newest = _dir_usage(path)
+                dirs.append((newest, size, path))
+        return dirs
+
+    def _remove_entry(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def enforce_quota(self):
+        """Evict least recently used stored outputs until usage fits the quota"""
+        entries = self._stored_entries()
+        job_bytes = sum(size for _, size, _ in self._job_dirs())
+        used = job_bytes + sum(size for _, size, _, _ in entries)
+
+        if self.quota_bytes and used > self.quota_bytes:
+            for last_access, size, path, _ in sorted(entries):
+                if used <= self.quota_bytes:
+                    break
+                logging.info(f"Evicting {path} ({size} bytes) to stay under storage quota")
+                self._remove_entry(path)
+                used -= size
+                with self._lock:
+                    self.evictions += 1
+
+        with self._lock:
+            self.bytes_used = used
+        return used
+
+    def sweep(self):
+        """Expire served outputs, remove orphaned job dirs and old progress entries"""
+        now = time.time()
+
+        for last_access, size, path, served in self._stored_entries():
+            ttl = self.served_ttl if served else self.orphan_ttl
+            if now - last_access > ttl:
+                self._remove_entry(path)
+                with self._lock:
+                    self.expired += 1
+
+        with self._lock:
+            active = set(self._active_dirs)
+        for newest, size, path in self._job_dirs():
+            if path not in active and now - newest > self.orphan_ttl:
+                logging.info(f"Removing orphaned job directory {path}")
+                shutil.rmtree(path, ignore_errors=True)
+                with self._lock:
+                    self.orphans_removed += 1
+
+        if self.progress_store is not None:
+            removed = self.progress_store.expire(self.progress_ttl)
+            with self._lock:
+                self.progress_expired += removed
+
+        with self._lock:
+            hooks = list(self._sweep_hooks)
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logging.error(f"Sweep hook failed: {str(e)}", exc_info=True)
+
+        self.enforce_quota()
+        with self._lock:
+            self.last_sweep = now
+
+    def _ensure_sweeper(self):
+        # The sweeper starts lazily so importing the app never spawns threads
+        with self._lock:
+            if self._sweeper is not None or self.sweep_interval <= 0:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='storage-sweeper')
+            self._sweeper.daemon = True
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Storage sweep failed: {str(e)}", exc_info=True)
+            time.sleep(self.sweep_interval)
+
+    def disk_usage(self):
+        """Bytes currently on disk in job work dirs and the file store, plus free space on the volume"""
+        job_bytes = sum(size for _, size, _ in self._job_dirs())
+        stored_bytes = sum(size for _, size, _, _ in self._stored_entries())
+        try:
+            free_bytes = shutil.disk_usage(self.root).free
+        except OSError:
+            free_bytes = None
+        return {'jobs_bytes': job_bytes, 'files_bytes': stored_bytes, 'free_bytes': free_bytes}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes_used': self.bytes_used,
+                'quota_bytes': self.quota_bytes,
+                'active_jobs': len(self._active_dirs),
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'orphans_removed': self.orphans_removed,
+                'progress_expired': self.progress_expired,
+                'last_sweep': self.last_sweep,
+            }
+
+
+# Finished outputs reused for identical requests (see file_store.py)
+FILES_DIR = os.environ.get('FILE_STORE_DIR', os.path.join(DOWNLOAD_ROOT, 'files'))
+
+
+def _build_storage():
+    from progress_store import progress_store
+    return StorageManager(
+        root=DOWNLOAD_ROOT,
+        files_dir=FILES_DIR,
+        quota_bytes=int(float(os.environ.get('STORAGE_QUOTA_MB', 10240)) * 1024 * 1024),
+        served_ttl=float(os.environ.get('SERVED_FILE_TTL', 3600)),
+        orphan_ttl=float(os.environ.get('ORPHAN_TTL', 6 * 3600)),
+        progress_ttl=float(os.environ.get('PROGRESS_TTL', 24 * 3600)),
+        sweep_interval=float(os.environ.get('STORAGE_SWEEP_INTERVAL', 300)),
+        progress_store=progress_store,
+    )
+
+
+# Shared storage manager for this process
+storage = _build_storage()
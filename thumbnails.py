@@ -0,0 +1,393 @@
+import os
+import io
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import urllib.request
+from collections import OrderedDict
+from storage import DOWNLOAD_ROOT, storage
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow thumbnails are cached and served at their original size
+    Image = None
+
+# Directory holding fetched and resized thumbnails
+THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', os.path.join(DOWNLOAD_ROOT, 'thumbnails'))
+
+# Disk budget for cached thumbnails; least recently served videos are evicted above it
+THUMBNAIL_CACHE_MB = float(os.environ.get('THUMBNAIL_CACHE_MB', 64))
+
+# Seconds after which a video whose thumbnail was neither registered nor served is forgotten
+THUMBNAIL_SOURCE_TTL = float(os.environ.get('THUMBNAIL_SOURCE_TTL', 24 * 3600))
+
+# Resized thumbnails also kept in memory
+THUMBNAIL_MEMORY_ITEMS = int(os.environ.get('THUMBNAIL_MEMORY_ITEMS', 256))
+
+# Widths the UI asks for (1x and 2x of the info card)
+THUMBNAIL_WIDTHS = (320, 640)
+
+# Browser cache lifetime of a served thumbnail
+THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 7 * 24 * 3600))
+
+JPEG_QUALITY = 82
+FETCH_TIMEOUT = 10
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_-]')
+
+# Leading bytes of the image types thumbnails come in (CDNs do not always label them correctly)
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def _sniff(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    return None
+
+
+def thumbnail_id(info):
+    """Stable id for a video's thumbnail: extractor and video id, safe for URLs and paths"""
+    extractor = info.get('extractor_key') or info.get('extractor') or 'video'
+    video_id = info.get('id')
+    if not video_id:
+        video_id = hashlib.sha1((info.get('thumbnail') or '').encode('utf-8')).hexdigest()[:16]
+    return _UNSAFE.sub('_', f'{extractor}-{video_id}'.lower())[:128]
+
+
+def _source_candidates(info):
+    """Thumbnail URLs to try, smallest first among those at least as wide as the UI needs"""
+    wanted = max(THUMBNAIL_WIDTHS)
+    sized = [t for t in info.get('thumbnails') or [] if t.get('url') and t.get('width')]
+    large_enough = sorted((t for t in sized if t['width'] >= wanted), key=lambda t: t['width'])
+    urls = [t['url'] for t in large_enough[:2]]
+    # yt-dlp's own pick is the safest fallback (listed sizes are not always available)
+    if info.get('thumbnail') and info['thumbnail'] not in urls:
+        urls.append(info['thumbnail'])
+    return urls
+
+
+class ThumbnailCache:
+    """Fetches each video's thumbnail once and serves it downscaled from memory or disk.
+
+    /get_video_info registers the source URLs under a thumbnail id (on disk,
+    so every worker can serve it). The first request for an id fetches the
+    image, renders every width in THUMBNAIL_WIDTHS as JPEG and stores them
+    under <dir>/<id>/. Later requests are answered from an in-memory LRU or
+    from disk; the disk cache evicts the least recently served videos once it
+    grows past its budget, tracking its size as it writes and evicts. The
+    storage sweeper calls sweep(), which removes videos untouched for
+    source_ttl (registration included) and measures the cache afresh.
+    """
+
+    SOURCE_NAME = 'source.json'
+
+    def __init__(self, root, max_bytes, memory_items, source_ttl, storage=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.source_ttl = source_ttl
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.expired = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # thumb_id -> [lock, threads using it]
+        self._fetch_locks = {}
+        # Rendered bytes per video dir, and their sum; None until first measured
+        self._sizes = None
+        self._total = 0
+        self._sweeping = False
+
+    def _dir(self, thumb_id):
+        return os.path.join(self.root, _UNSAFE.sub('_', thumb_id))
+
+    def register(self, info):
+        """Remember where info's thumbnail comes from; returns the proxied URL or ''"""
+        urls = _source_candidates(info)
+        if not urls:
+            return ''
+        thumb_id = thumbnail_id(info)
+        entry_dir = self._dir(thumb_id)
+        source_path = os.path.join(entry_dir, self.SOURCE_NAME)
+        source = {'urls': urls, 'http_headers': info.get('http_headers') or {}}
+        self._start_sweeping()
+        try:
+            with open(source_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get('urls') == urls:
+                    # Registered again: keeps the video from expiring
+                    os.utime(entry_dir)
+                    return f'/thumbnail/{thumb_id}'
+        except (OSError, ValueError):
+            pass
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(source, f)
+            os.replace(tmp_path, source_path)
+        except OSError as e:
+            logging.error(f"Could not register thumbnail for {thumb_id}: {str(e)}")
+            return urls[-1]
+        return f'/thumbnail/{thumb_id}'
+
+    def _start_sweeping(self):
+        if self.storage is None or self._sweeping:
+            return
+        with self._lock:
+            if self._sweeping:
+                return
+            self._sweeping = True
+        self.storage.add_sweep_hook(self.sweep)
+
+    @staticmethod
+    def _width(requested):
+        # Snap to a rendered size: the smallest one at least as wide as requested
+        for width in THUMBNAIL_WIDTHS:
+            if requested and requested <= width:
+                return width
+        return THUMBNAIL_WIDTHS[-1]
+
+    def get(self, thumb_id, requested_width=None):
+        """(bytes, mimetype, etag) for a registered thumbnail, or None if the id is unknown.
+
+        Raises OSError when the source cannot be fetched.
+        """
+        width = self._width(requested_width)
+        key = (thumb_id, width)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        entry_dir = self._dir(thumb_id)
+        result = self._read(entry_dir, width)
+        if result is None:
+            # One fetch per id even when the page asks for both sizes at once
+            with self._lock:
+                fetch_lock = self._fetch_locks.setdefault(thumb_id, [threading.Lock(), 0])
+                fetch_lock[1] += 1
+            try:
+                with fetch_lock[0]:
+                    result = self._read(entry_dir, width)
+                    if result is None:
+                        with self._lock:
+                            self.misses += 1
+                        if not self._fetch(entry_dir):
+                            return None
+                        result = self._read(entry_dir, width)
+            finally:
+                # The last thread out drops the lock; one still waiting on it keeps it in place
+                with self._lock:
+                    fetch_lock[1] -= 1
+                    if fetch_lock[1] == 0 and self._fetch_locks.get(thumb_id) is fetch_lock:
+                        del self._fetch_locks[thumb_id]
+        else:
+            with self._lock:
+                self.hits += 1
+        if result is None:
+            return None
+
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return result
+
+    def _read(self, entry_dir, width):
+        for name, mimetype in ((f'{width}.jpg', 'image/jpeg'), ('original', None)):
+            path = os.path.join(entry_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if mimetype is None:
+                try:
+                    with open(path + '.type', 'r') as f:
+                        mimetype = f.read().strip() or 'image/jpeg'
+                except OSError:
+                    mimetype = 'image/jpeg'
+            # Served recently: keeps the entry at the young end of the disk LRU
+            try:
+                os.utime(entry_dir)
+            except OSError:
+                pass
+            return data, mimetype, hashlib.sha1(data).hexdigest()[:20]
+        return None
+
+    def _download(self, source):
+        last_error = None
+        for url in source['urls']:
+            request = urllib.request.Request(url, headers=source.get('http_headers') or {})
+            try:
+                with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as resp:
+                    data = resp.read(MAX_SOURCE_BYTES + 1)
+            except OSError as e:
+                last_error = e
+                continue
+            mimetype = _sniff(data)
+            if len(data) > MAX_SOURCE_BYTES or mimetype is None:
+                last_error = OSError(f'{url} is not a usable image')
+                continue
+            return data, mimetype
+        raise last_error or OSError('No thumbnail source')
+
+    def _fetch(self, entry_dir):
+        """Fetch the source once and store every size; False if the id was never registered"""
+        try:
+            with open(os.path.join(entry_dir, self.SOURCE_NAME), 'r', encoding='utf-8') as f:
+                source = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        started = time.perf_counter()
+        data, mimetype = self._download(source)
+        with self._lock:
+            self.fetches += 1
+
+        outputs = {}
+        if Image is not None:
+            try:
+                image = Image.open(io.BytesIO(data))
+                image = image.convert('RGB')
+                for width in THUMBNAIL_WIDTHS:
+                    resized = image
+                    if image.width > width:
+                        height = max(1, round(image.height * width / image.width))
+                        resized = image.resize((width, height), Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    resized.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                    outputs[f'{width}.jpg'] = buffer.getvalue()
+            except Exception as e:
+                logging.warning(f"Could not resize thumbnail in {entry_dir}: {str(e)}")
+                outputs = {}
+        if not outputs:
+            outputs = {'original': data, 'original.type': mimetype.encode('ascii')}
+
+        for name, content in outputs.items():
+            fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, os.path.join(entry_dir, name))
+        logging.debug("Fetched thumbnail into %s in %.3fs", entry_dir, time.perf_counter() - started)
+
+        if self._sizes is None:
+            self._measure()
+        with self._lock:
+            written = sum(len(content) for content in outputs.values())
+            self._total += written - self._sizes.get(entry_dir, 0)
+            self._sizes[entry_dir] = written
+        self._enforce_budget()
+        return True
+
+    def _images_size(self, entry_dir):
+        # Everything but the registration counts against the budget
+        size = 0
+        for file_name in os.listdir(entry_dir):
+            if file_name != self.SOURCE_NAME:
+                size += os.path.getsize(os.path.join(entry_dir, file_name))
+        return size
+
+    def _forget(self, entry_dir):
+        with self._lock:
+            for key in [key for key in self._memory if self._dir(key[0]) == entry_dir]:
+                del self._memory[key]
+
+    def _measure(self, expire=False):
+        """Re-read the size of every video dir; with expire, first remove those untouched for source_ttl"""
+        now = time.time()
+        sizes = {}
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            names = []
+        for name in names:
+            entry_dir = os.path.join(self.root, name)
+            try:
+                if expire and now - os.path.getmtime(entry_dir) > self.source_ttl:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    self._forget(entry_dir)
+                    with self._lock:
+                        self.expired += 1
+                    continue
+                sizes[entry_dir] = self._images_size(entry_dir)
+            except OSError:
+                continue
+        with self._lock:
+            self._sizes = sizes
+            self._total = sum(sizes.values())
+
+    def sweep(self):
+        """Remove videos neither registered nor served for source_ttl, then re-check the budget"""
+        self._measure(expire=True)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        """Drop the images of least recently served videos while the cache is over budget"""
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            cached = [(entry_dir, size) for entry_dir, size in self._sizes.items() if size]
+
+        # Only when over budget: order the videos by when they were last served
+        entries = []
+        for entry_dir, size in cached:
+            try:
+                entries.append((os.path.getmtime(entry_dir), entry_dir, size))
+            except OSError:
+                entries.append((0.0, entry_dir, size))
+
+        for _, entry_dir, size in sorted(entries):
+            with self._lock:
+                if self._total <= self.max_bytes:
+                    break
+                self._total -= size
+                self._sizes[entry_dir] = 0
+            # The source stays registered, so an evicted thumbnail is simply fetched again
+            try:
+                file_names = os.listdir(entry_dir)
+            except OSError:
+                file_names = []
+            for file_name in file_names:
+                if file_name != self.SOURCE_NAME:
+                    try:
+                        os.remove(os.path.join(entry_dir, file_name))
+                    except OSError:
+                        pass
+            self._forget(entry_dir)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetches': self.fetches,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._total,
+                'expired': self.expired,
+                'resize': Image is not None,
+            }
+
+
+# Shared thumbnail cache for this host
+thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, THUMBNAIL_CACHE_MB * 1024 * 1024, THUMBNAIL_MEMORY_ITEMS,
+                                 THUMBNAIL_SOURCE_TTL, storage)
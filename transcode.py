@@ -0,0 +1,384 @@
+import os
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from format_index import codec_family
+from job_queue import scheduler
+from metrics import CONVERSION_SECONDS
+
+# ffmpeg binary (or the directory holding it); found on PATH when unset
+FFMPEG_LOCATION = os.environ.get('FFMPEG_LOCATION', '')
+
+# x264-style speed preset used when re-encoding (ultrafast ... veryslow); mapped for other encoders
+TRANSCODE_PRESET = os.environ.get('TRANSCODE_PRESET', 'veryfast')
+
+# ffmpeg threads per conversion; by default the cores are split between concurrent conversions
+TRANSCODE_THREADS = int(os.environ.get('TRANSCODE_THREADS', 0)) or max(1, (os.cpu_count() or 2) // scheduler.max_conversions)
+
+# Hardware H.264 encoder: 'auto' probes nvenc/qsv/videotoolbox/amf once, 'off' or an encoder family name
+TRANSCODE_HWACCEL = os.environ.get('TRANSCODE_HWACCEL', 'auto').lower()
+
+# Download bytes one byte of re-encoded video is worth when choosing between formats
+TRANSCODE_COST_FACTOR = float(os.environ.get('TRANSCODE_COST_FACTOR', 8))
+
+# The same for audio encodes, and for a stream copy (remux or merge)
+AUDIO_TRANSCODE_COST = 1.0
+REMUX_COST = 0.05
+
+# Re-encode video that mp4 cannot hold; by default it is kept as-is in webm or mkv instead
+TRANSCODE_STRICT_MP4 = os.environ.get('TRANSCODE_STRICT_MP4', '0') == '1'
+
+PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+# Codec families each target container can hold as-is, and what to encode to when it cannot
+CONTAINERS = {
+    'mp4': {'video': {'h264', 'h265', 'av1'}, 'audio': {'aac', 'mp3', 'ac3', 'eac3'},
+            'encode': ('h264', 'aac')},
+    'mkv': {'video': None, 'audio': None, 'encode': ('h264', 'aac')},
+    'webm': {'video': {'vp8', 'vp9', 'av1'}, 'audio': {'opus', 'vorbis'}, 'encode': ('vp9', 'opus')},
+    'mov': {'video': {'h264', 'h265'}, 'audio': {'aac', 'mp3'}, 'encode': ('h264', 'aac')},
+    'avi': {'video': {'mpeg4', 'h264'}, 'audio': {'mp3', 'ac3'}, 'encode': ('mpeg4', 'mp3')},
+    '3gp': {'video': {'h264', 'h263', 'mpeg4'}, 'audio': {'aac', 'amr'}, 'encode': ('h264', 'aac')},
+}
+
+# Audio targets: the codec FFmpegExtractAudio is asked for, and the source codec it can keep (stream copy)
+AUDIO_TARGETS = {
+    'mp3': ('mp3', 'mp3'),
+    'm4a': ('m4a', 'aac'),
+    'aac': ('aac', 'aac'),
+    'ogg': ('vorbis', 'vorbis'),
+    'opus': ('opus', 'opus'),
+    'flac': ('flac', 'flac'),
+    'wav': ('wav', None),
+}
+
+# Hardware H.264 encoders that take ordinary (software) frames, in probe order
+HW_ENCODERS = {
+    'nvenc': 'h264_nvenc',
+    'qsv': 'h264_qsv',
+    'videotoolbox': 'h264_videotoolbox',
+    'amf': 'h264_amf',
+}
+
+AUDIO_ENCODERS = {'aac': 'aac', 'opus': 'libopus', 'mp3': 'libmp3lame', 'vorbis': 'libvorbis'}
+
+_ffmpeg_path = None
+_hw_encoder = None
+_probe_lock = threading.Lock()
+
+
+def find_ffmpeg():
+    """Path of the ffmpeg binary, or None when it is not installed"""
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        location = FFMPEG_LOCATION
+        if location and os.path.isdir(location):
+            location = os.path.join(location, 'ffmpeg')
+        _ffmpeg_path = (location if location and os.path.exists(location) else shutil.which(location or 'ffmpeg')) or ''
+        if not _ffmpeg_path:
+            logging.warning("ffmpeg not found; merging and conversion will fail")
+    return _ffmpeg_path or None
+
+
+def _encoder_works(ffmpeg, encoder):
+    # Listing an encoder does not mean the device is there; encode a few frames to be sure
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.2',
+             '-frames:v', '5', '-c:v', encoder, '-f', 'null', '-'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=15)
+        return result.returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def hardware_encoder():
+    """Usable hardware H.264 encoder name, or None; probed once per process"""
+    global _hw_encoder
+    if TRANSCODE_HWACCEL in ('off', '0', 'none', ''):
+        return None
+    with _probe_lock:
+        if _hw_encoder is None:
+            _hw_encoder = ''
+            ffmpeg = find_ffmpeg()
+            if ffmpeg:
+                if TRANSCODE_HWACCEL == 'auto':
+                    candidates = list(HW_ENCODERS.values())
+                else:
+                    candidates = [HW_ENCODERS.get(TRANSCODE_HWACCEL, TRANSCODE_HWACCEL)]
+                try:
+                    listed = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=15).stdout
+                except (OSError, subprocess.SubprocessError):
+                    listed = ''
+                for encoder in candidates:
+                    if f' {encoder} ' in listed and _encoder_works(ffmpeg, encoder):
+                        _hw_encoder = encoder
+                        logging.info(f"Using hardware encoder {encoder} for H.264 conversions")
+                        break
+        return _hw_encoder or None
+
+
+def _speed(preset):
+    # Position of the preset on x264's scale: 0 (ultrafast) .. 8 (veryslow)
+    return PRESETS.index(preset) if preset in PRESETS else PRESETS.index('veryfast')
+
+
+def video_encoder_args(codec, preset=None, threads=None):
+    """ffmpeg output arguments that encode the video stream to codec at the configured speed"""
+    preset = preset or TRANSCODE_PRESET
+    threads = threads or TRANSCODE_THREADS
+    speed = _speed(preset)
+
+    if codec == 'h264':
+        encoder = hardware_encoder()
+        if encoder == 'h264_nvenc':
+            return ['-c:v', encoder, '-preset', f'p{min(7, speed + 1)}']
+        if encoder == 'h264_qsv':
+            return ['-c:v', encoder, '-preset', PRESETS[max(speed, 2)]]
+        if encoder == 'h264_amf':
+            return ['-c:v', encoder, '-quality', 'speed' if speed <= 3 else 'balanced' if speed <= 5 else 'quality']
+        if encoder:
+            return ['-c:v', encoder, '-q:v', '65']
+        return ['-c:v', 'libx264', '-preset', PRESETS[speed], '-crf', '23', '-pix_fmt', 'yuv420p', '-threads', str(threads)]
+    if codec == 'vp9':
+        # libvpx realtime mode; cpu-used 8 is the fastest
+        return ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', str(8 - speed), '-row-mt', '1',
+                '-crf', '32', '-b:v', '0', '-threads', str(threads)]
+    if codec == 'mpeg4':
+        return ['-c:v', 'mpeg4', '-vtag', 'xvid', '-q:v', '4', '-threads', str(threads)]
+    raise ValueError(f'No encoder configured for {codec}')
+
+
+class ConversionPlan:
+    """How a download reaches its target container: nothing, a remux or a transcode"""
+
+    def __init__(self, target, action, reason, video=None, audio=None, merge_format=None, postprocessor=None, args=None):
+        self.target = target
+        self.action = action
+        self.reason = reason
+        self.video = video
+        self.audio = audio
+        self.merge_format = merge_format
+        self.postprocessor = postprocessor
+        self.args = args or []
+
+    def apply(self, ydl_opts):
+        """Add the merge format, postprocessor and ffmpeg arguments for this plan to ydl_opts"""
+        ffmpeg = find_ffmpeg()
+        if ffmpeg:
+            ydl_opts['ffmpeg_location'] = ffmpeg
+        if self.merge_format:
+            ydl_opts['merge_output_format'] = self.merge_format
+        if self.postprocessor:
+            ydl_opts['postprocessors'] = [self.postprocessor]
+            if self.args:
+                ydl_opts['postprocessor_args'] = {self.postprocessor['key'][len('FFmpeg'):].lower(): list(self.args)}
+        return ydl_opts
+
+    def to_dict(self):
+        return {
+            'target': self.target,
+            'action': self.action,
+            'reason': self.reason,
+            'video': self.video,
+            'audio': self.audio,
+        }
+
+
+def _codec(fmt, key):
+    # None when the stream is absent, 'unknown' when the extractor did not say
+    value = fmt.get(key)
+    if value == 'none':
+        return None
+    return codec_family(value) or 'unknown'
+
+
+def _streams(chosen):
+    # The formats yt-dlp picked: both halves of a merge, or the single format
+    formats = chosen.get('requested_formats') or [chosen]
+    vcodec = acodec = None
+    for fmt in formats:
+        vcodec = vcodec or _codec(fmt, 'vcodec')
+        acodec = acodec or _codec(fmt, 'acodec')
+    return formats, vcodec, acodec
+
+
+def stream_fits(kind, codec, target):
+    """Whether a 'video' or 'audio' stream of codec family codec can be copied into target"""
+    container = CONTAINERS.get(target)
+    if container is None:
+        return False
+    return codec is None or container[kind] is None or codec in container[kind]
+
+
+def _size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    # tbr is in kbit/s
+    return _num(fmt.get('tbr')) * 125 * (duration or 0)
+
+
+def _num(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def selection_cost(target, audio_only=False, duration=None):
+    """cost(video_fmt, audio_fmt) for FormatIndex.select: download size plus weighted conversion work for target.
+
+    Costs are (video_unfit, bytes) tuples, so a video stream the target holds
+    as-is always beats one that would be re-encoded (or, for mp4, kept in
+    another container), whatever their sizes.
+    """
+    def audio_cost(audio):
+        size = _size(audio, duration)
+        preferred, keeps = AUDIO_TARGETS.get(target, (target, target))
+        if audio.get('ext') == target:
+            return size
+        if keeps and codec_family(audio.get('acodec')) == keeps:
+            return size * (1 + REMUX_COST)
+        return size * (1 + AUDIO_TRANSCODE_COST)
+
+    def video_cost(video, audio):
+        video_size = _size(video, duration)
+        audio_size = _size(audio, duration) if audio else 0
+        total = video_size + audio_size
+        if target not in CONTAINERS:
+            return False, total
+        vcodec = _codec(video, 'vcodec')
+        acodec = _codec(audio or video, 'acodec')
+        video_fits = stream_fits('video', vcodec, target)
+        audio_fits = stream_fits('audio', acodec, target)
+        if video_fits and audio_fits and audio is None and video.get('ext') == target:
+            return False, total
+        # ffmpeg rewrites every byte whether it copies or encodes, so the merge/remux is charged
+        # either way and an encode is charged on top
+        cost = total * (1 + REMUX_COST)
+        if not video_fits:
+            cost += video_size * TRANSCODE_COST_FACTOR
+        if not audio_fits:
+            # Audio muxed into the video stream is small next to it; approximate it from abr
+            cost += (audio_size or _num(video.get('abr')) * 125 * (duration or 0)) * AUDIO_TRANSCODE_COST
+        return not video_fits, cost
+
+    def cost(video, audio):
+        if audio_only or video is None:
+            return False, audio_cost(audio)
+        return video_cost(video, audio)
+    return cost
+
+
+def _plan_audio(chosen, target, source_ext, acodec):
+    preferred, keeps = AUDIO_TARGETS.get(target, (target, target))
+    if source_ext == target:
+        return ConversionPlan(target, 'none', f'source is already {target}')
+    # FFmpegExtractAudio copies the stream itself when the codec fits
+    postprocessor = {
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': preferred,
+        'preferredquality': '192' if preferred == 'mp3' else '5',
+    }
+    if keeps and acodec == keeps:
+        return ConversionPlan(target, 'remux', f'{acodec} audio fits {target}', audio='copy', postprocessor=postprocessor)
+    encoder = AUDIO_ENCODERS.get(preferred, preferred)
+    return ConversionPlan(target, 'transcode', f'{acodec} audio must be encoded to {preferred}', audio=encoder,
+                          postprocessor=postprocessor, args=['-threads', str(TRANSCODE_THREADS)])
+
+
+def _plan_fallback(target, source_ext, merged, vcodec, acodec):
+    # webm when both streams fit it, otherwise mkv, which takes anything
+    fallback = 'webm' if stream_fits('video', vcodec, 'webm') and stream_fits('audio', acodec, 'webm') else 'mkv'
+    reason = f'{vcodec} video does not fit {target}; kept in {fallback} (TRANSCODE_STRICT_MP4=1 re-encodes it)'
+    if merged:
+        return ConversionPlan(fallback, 'remux', reason, video='copy', audio='copy', merge_format=fallback)
+    if source_ext == fallback:
+        return ConversionPlan(fallback, 'none', reason)
+    return ConversionPlan(fallback, 'remux', reason, video='copy', audio='copy',
+                          postprocessor={'key': 'FFmpegVideoRemuxer', 'preferedformat': fallback})
+
+
+def plan_conversion(chosen, target, audio_only=False):
+    """Decide how to turn the selected formats into target.
+
+    chosen is the info dict after format selection (process_ie_result with
+    download=False). Streams whose codec the target container accepts are
+    copied; only the others are re-encoded. Streams of unknown codec are
+    re-encoded unless the container takes anything. Video that mp4 cannot
+    hold is kept in webm or mkv unless TRANSCODE_STRICT_MP4 is set; the
+    plan's target is the container actually written.
+    """
+    formats, vcodec, acodec = _streams(chosen)
+    source_ext = chosen.get('ext')
+    merged = len(formats) > 1
+
+    if audio_only:
+        if not target:
+            return ConversionPlan(target, 'none', 'no target format requested')
+        return _plan_audio(chosen, target, source_ext, acodec)
+
+    container = CONTAINERS.get(target)
+    if not target or (source_ext == target and not merged):
+        return ConversionPlan(target, 'none', f'source is already {source_ext}')
+    if container is None:
+        # Unknown container: leave it to yt-dlp's converter defaults
+        return ConversionPlan(target, 'transcode', f'no codec table for {target}',
+                              postprocessor={'key': 'FFmpegVideoConvertor', 'preferedformat': target})
+
+    video_fits = stream_fits('video', vcodec, target)
+    audio_fits = stream_fits('audio', acodec, target)
+
+    if video_fits and audio_fits:
+        if merged:
+            # The merger writes straight into the target container
+            return ConversionPlan(target, 'remux', f'{vcodec}/{acodec} fit {target}', video='copy', audio='copy',
+                                  merge_format=target)
+        return ConversionPlan(target, 'remux', f'{vcodec}/{acodec} fit {target}', video='copy', audio='copy',
+                              postprocessor={'key': 'FFmpegVideoRemuxer', 'preferedformat': target})
+
+    # mp4 is the default target: keep video it cannot hold in a container that takes it, as a plain merge would
+    if target == 'mp4' and not video_fits and not TRANSCODE_STRICT_MP4:
+        return _plan_fallback(target, source_ext, merged, vcodec, acodec)
+
+    # Re-encode only the streams the container cannot hold
+    video_codec, audio_codec = container['encode']
+    args = []
+    video = audio = 'copy'
+    if vcodec is not None:
+        if video_fits:
+            args += ['-c:v', 'copy']
+        else:
+            args += video_encoder_args(video_codec)
+            video = args[args.index('-c:v') + 1]
+    if acodec is not None:
+        if audio_fits:
+            args += ['-c:a', 'copy']
+        else:
+            audio = AUDIO_ENCODERS[audio_codec]
+            args += ['-c:a', audio]
+    reasons = [f'{codec} {kind} must be encoded for {target}'
+               for kind, codec, fits in (('video', vcodec, video_fits), ('audio', acodec, audio_fits)) if not fits]
+    return ConversionPlan(target, 'transcode', '; '.join(reasons), video=video, audio=audio,
+                          postprocessor={'key': 'FFmpegVideoConvertor', 'preferedformat': target}, args=args)
+
+
+class ConversionTimer:
+    """yt-dlp postprocessor hook recording how long each postprocessing step ran"""
+
+    def __init__(self):
+        self.steps = []
+        self._started = {}
+
+    def postprocessor_hook(self, d):
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            self._started[name] = time.monotonic()
+        elif d.get('status') == 'finished' and name in self._started:
+            seconds = time.monotonic() - self._started.pop(name)
+            self.steps.append({'step': name, 'seconds': round(seconds, 3)})
+            CONVERSION_SECONDS.observe(seconds, step=name)
+            logging.info("Postprocessor %s took %.2fs", name, seconds)
+
+    def total(self):
+        return round(sum(step['seconds'] for step in self.steps), 3)
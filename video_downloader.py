@@ -1,280 +1,423 @@
 import yt_dlp
 import os
+import time
 import tempfile
 import logging
-from urllib.parse import urlparse
+from info_cache import info_cache, cache_key
+from output_path import OutputTracker
+from format_index import index_for
+from ydl_pool import ydl_pool
+from rate_limiter import rate_limiter, RateLimited
+from transcode import plan_conversion, selection_cost, ConversionTimer, find_ffmpeg
+from metrics import span, EXTRACTION_SECONDS, DOWNLOADS, ThroughputRecorder
+from progress_model import FFMPEG_ARG_KEYS
+from thumbnails import thumbnail_cache
+from segmented_download import SegmentedDownload, RangeNotSupported, SegmentedDownloadError, SEGMENTED_CONNECTIONS
+
+# Options used for every metadata extraction so cached results are interchangeable.
+# Playlists are listed flat; their entries are resolved one by one when downloaded.
+INFO_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',
+    'socket_timeout': 30,
+}
+
+# Fragments of one DASH/HLS download fetched in parallel (yt-dlp's -N option)
+CONCURRENT_FRAGMENTS = int(os.environ.get('CONCURRENT_FRAGMENTS', 1))
+
+# Clips are cut with stream copy at the keyframes nearest the requested times; 1 re-encodes for exact cuts
+CLIP_EXACT_CUTS = os.environ.get('CLIP_EXACT_CUTS', '0') == '1'
+
+
+def parse_clip(start=None, end=None):
+    """[start, end] in seconds from request values (seconds or [HH:]MM:SS[.ms]), or None for the whole video.
+    
+    end is None when the clip runs to the end. Raises ValueError for unusable times.
+    """
+    def seconds(value, name):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            parsed = float(value)
+        else:
+            parsed = yt_dlp.utils.parse_duration(str(value).strip())
+        if parsed is None or parsed != parsed or parsed < 0 or parsed == float('inf'):
+            raise ValueError(f'Invalid clip {name} time: {value}')
+        return float(parsed)
+    
+    start, end = seconds(start, 'start') or 0.0, seconds(end, 'end')
+    if end is not None and end <= start:
+        raise ValueError('Clip end must be after its start')
+    if start == 0 and end is None:
+        return None
+    return [start, end]
+
+
+def clip_label(clip):
+    """Filename-safe description of a clip, e.g. '1m30s-2m05s' or '1h02m00s-end'"""
+    def stamp(value):
+        hours, rest = divmod(int(value), 3600)
+        minutes, secs = divmod(rest, 60)
+        if hours:
+            return f'{hours}h{minutes:02d}m{secs:02d}s'
+        return f'{minutes}m{secs:02d}s' if minutes else f'{secs}s'
+    return f"{stamp(clip[0])}-{stamp(clip[1]) if clip[1] is not None else 'end'}"
+
+
+def clip_fraction(clip, duration):
+    """Share of the video a clip covers, or 1.0 when either is unknown"""
+    if not clip or not duration:
+        return 1.0
+    end = min(clip[1], duration) if clip[1] is not None else duration
+    return max(0.0, min(1.0, (end - clip[0]) / duration))
+
 
 class VideoDownloader:
-    def __init__(self):
-        self.temp_dir = tempfile.mkdtemp()
+    def __init__(self, temp_dir=None):
+        # Created on first download so info-only use never leaves empty directories
+        self.temp_dir = temp_dir
     
-    def _select_best_format(self, available_formats, requested_format_id, audio_only):
-        """Select the best available format based on user preference"""
-        logging.info(f"_select_best_format called with format_id: {requested_format_id}, audio_only: {audio_only}")
+    def _extract_info(self, url):
+        """Return the raw yt-dlp info dict for url, served from the shared info cache when possible"""
+        def extract():
+            with ydl_pool.lease('info', INFO_OPTS) as ydl:
+                return ydl.extract_info(url, download=False)
         
-        # If audio only requested
-        if audio_only:
-            if requested_format_id and 'bestaudio' in requested_format_id:
-                return requested_format_id
-            return 'bestaudio/best'
-        
-        # For video downloads with generic selectors like best[height<=1080]
-        if requested_format_id and 'best[height<=' in requested_format_id:
+        def load():
+            # Only real extractions count against the site's rate limit, cache hits do not
+            started = time.perf_counter()
+            outcome = 'error'
             try:
-                # Extract the height from the selector
-                height = int(requested_format_id.split('<=')[1].split(']')[0])
-                logging.info(f"Looking for video format <= {height}p from available formats")
-                
-                # Look through available formats to find the best match
-                if available_formats:
-                    video_formats = [f for f in available_formats if f and f.get('height') and f.get('vcodec') and f.get('vcodec') != 'none']
-                    
-                    # Find formats that match the height constraint
-                    suitable_formats = [f for f in video_formats if f.get('height') <= height]
-                    
-                    if suitable_formats:
-                        # Sort by quality (highest first) and pick the best one
-                        suitable_formats.sort(key=lambda x: (x.get('height', 0), x.get('tbr', 0)), reverse=True)
-                        best_format = suitable_formats[0]
-                        
-                        logging.info(f"Found suitable format: {best_format['format_id']} ({best_format['height']}p)")
-                        
-                        # For better quality, try to combine with audio
-                        if height >= 480:
-                            return f"{best_format['format_id']}+bestaudio/{best_format['format_id']}"
-                        else:
-                            return best_format['format_id']
-                    else:
-                        # No suitable format found, get the lowest quality available
-                        if video_formats:
-                            video_formats.sort(key=lambda x: x.get('height', 0))
-                            fallback_format = video_formats[0]
-                            logging.info(f"No format <= {height}p available, using: {fallback_format['format_id']} ({fallback_format['height']}p)")
-                            return fallback_format['format_id']
-                
-                # Fallback to generic selector if no specific formats found
-                logging.info(f"Using generic format selector for {height}p")
-                return f'best[height<={height}]'
-                
-            except (ValueError, IndexError) as e:
-                logging.error(f"Error parsing format selector: {e}")
-                return 'best'
+                info = rate_limiter.call(url, extract)
+                outcome = 'ok'
+                return info
+            except RateLimited:
+                outcome = 'rate_limited'
+                raise
+            finally:
+                EXTRACTION_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
         
-        # For specific format IDs, check if available
-        if requested_format_id and available_formats:
-            for fmt in available_formats:
-                if fmt and fmt.get('format_id') == requested_format_id:
-                    logging.info(f"Found exact format match: {requested_format_id}")
-                    return requested_format_id
+        return info_cache.get_or_load(cache_key(url), load)
+    
+    def _select_best_format(self, info, requested_format_id, audio_only, file_format=None):
+        """Select the best available format based on user preference"""
+        logging.debug("_select_best_format called with format_id: %s, audio_only: %s", requested_format_id, audio_only)
+        # With a target container, equal-quality formats are ranked by download plus conversion cost
+        cost = selection_cost(file_format, audio_only, info.get('duration')) if file_format else None
+        return index_for(info).select(requested_format_id, audio_only, cost)
+    
+    def _resolve_format(self, info, selected_format):
+        """Run yt-dlp's format selection without downloading and return the chosen info dict"""
+        with ydl_pool.lease('select', {'quiet': True, 'no_warnings': True, 'format': selected_format}) as ydl:
+            return ydl.process_ie_result(ydl.sanitize_info(info), download=False)
         
-        # Default fallback
-        logging.info(f"Using fallback format: best")
-        return 'best'
+    def _describe_plan(self, chosen, selected_format, plan):
+        """What will be downloaded and how it becomes the target file, for progress reporting"""
+        formats = chosen.get('requested_formats') or [chosen]
+        sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+        return {
+            'format': selected_format,
+            'format_ids': [f.get('format_id') for f in formats],
+            'exts': [f.get('ext') for f in formats],
+            'download_bytes': sum(sizes) if all(sizes) else None,
+            'streams': [
+                {
+                    'format_id': f.get('format_id'),
+                    'kind': 'audio' if f.get('vcodec') == 'none' else 'video',
+                    'bytes': size,
+                }
+                for f, size in zip(formats, sizes)
+            ],
+            'convert': plan.postprocessor is not None,
+            'conversion': plan.to_dict(),
+        }
+    
+    def estimate_bytes(self, url, format_id=None, audio_only=False, file_format=None, clip=None):
+        """Expected download size from an already cached extraction, or None"""
+        try:
+            info = info_cache.peek(cache_key(url))
+            if not info or info.get('_type') in ('playlist', 'multi_video'):
+                return None
+            selected_format = self._select_best_format(info, format_id, audio_only, file_format)
+            formats = {f.get('format_id'): f for f in info.get('formats') or []}
+            # First alternative of "video+audio/fallback"
+            wanted = [formats.get(fid) for fid in selected_format.split('/')[0].split('+')]
+            sizes = [f and (f.get('filesize') or f.get('filesize_approx')) for f in wanted]
+            return sum(sizes) * clip_fraction(clip, info.get('duration')) if sizes and all(sizes) else None
+        except Exception as e:
+            logging.debug("Size estimate failed: %s", e)
+            return None
+    
+    def list_entries(self, url):
+        """Return [{'url', 'title'}] for every video behind url (one entry for a single video)"""
+        info = self._extract_info(url)
+        if not info:
+            return []
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            return [{'url': url, 'title': info.get('title', 'download')}]
         
+        entries = []
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            entry_url = entry.get('webpage_url') or entry.get('url')
+            if entry_url:
+                entries.append({'url': entry_url, 'title': entry.get('title') or entry.get('id') or entry_url})
+        return entries
+    
     def get_video_info(self, url):
         """Extract video information without downloading"""
         try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'socket_timeout': 30,
+            with span('get_video_info', 'extract'):
+                info = self._extract_info(url)
+            
+            if not info:
+                return {'error': 'Could not extract video information'}
+            
+            # Extract relevant information
+            video_info = {
+                'title': info.get('title', 'Unknown Title') if info else 'Unknown Title',
+                'duration': info.get('duration', 0) if info else 0,
+                # Served resized from our own cache instead of hotlinking the origin CDN
+                'thumbnail': thumbnail_cache.register(info),
+                'uploader': info.get('uploader', 'Unknown') if info else 'Unknown',
+                'view_count': info.get('view_count', 0) if info else 0,
+                'formats': []
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    return {'error': 'Could not extract video information'}
-                
-                # Extract relevant information
-                video_info = {
-                    'title': info.get('title', 'Unknown Title') if info else 'Unknown Title',
-                    'duration': info.get('duration', 0) if info else 0,
-                    'thumbnail': info.get('thumbnail', '') if info else '',
-                    'uploader': info.get('uploader', 'Unknown') if info else 'Unknown',
-                    'view_count': info.get('view_count', 0) if info else 0,
-                    'formats': []
-                }
-                
-                # Process available formats
-                formats = info.get('formats', [])
-                seen_formats = set()
-                
-                for fmt in formats:
-                    if fmt.get('vcodec') and fmt.get('vcodec') != 'none':
-                        # Video format
-                        format_info = {
-                            'format_id': fmt['format_id'],
-                            'ext': fmt.get('ext', 'mp4'),
-                            'resolution': f"{fmt.get('width', 0)}x{fmt.get('height', 0)}",
-                            'filesize': fmt.get('filesize', 0),
-                            'type': 'video',
-                            'quality': fmt.get('height', 0)
-                        }
-                        
-                        format_key = (format_info['ext'], format_info['resolution'])
-                        if format_key not in seen_formats:
-                            video_info['formats'].append(format_info)
-                            seen_formats.add(format_key)
-                    
-                    elif fmt.get('acodec') and fmt.get('acodec') != 'none':
-                        # Audio format
-                        format_info = {
-                            'format_id': fmt['format_id'],
-                            'ext': fmt.get('ext', 'mp3'),
-                            'resolution': 'Audio Only',
-                            'filesize': fmt.get('filesize', 0),
-                            'type': 'audio',
-                            'quality': fmt.get('abr', 0)
-                        }
-                        
-                        format_key = (format_info['ext'], 'audio')
-                        if format_key not in seen_formats:
-                            video_info['formats'].append(format_info)
-                            seen_formats.add(format_key)
-                
-                # Sort formats by quality
-                video_info['formats'].sort(key=lambda x: x['quality'], reverse=True)
-                
-                # Add common format options if not available
-                common_formats = [
-                    {'format_id': 'best[height<=2160]', 'ext': 'mp4', 'resolution': '2160p (4K)', 'type': 'video', 'quality': 2160},
-                    {'format_id': 'best[height<=1440]', 'ext': 'mp4', 'resolution': '1440p (2K)', 'type': 'video', 'quality': 1440},
-                    {'format_id': 'best[height<=1080]', 'ext': 'mp4', 'resolution': '1080p (HD)', 'type': 'video', 'quality': 1080},
-                    {'format_id': 'best[height<=720]', 'ext': 'mp4', 'resolution': '720p', 'type': 'video', 'quality': 720},
-                    {'format_id': 'best[height<=480]', 'ext': 'mp4', 'resolution': '480p', 'type': 'video', 'quality': 480},
-                    {'format_id': 'best[height<=360]', 'ext': 'mp4', 'resolution': '360p', 'type': 'video', 'quality': 360},
-                    {'format_id': 'best[height<=240]', 'ext': 'mp4', 'resolution': '240p', 'type': 'video', 'quality': 240},
-                    {'format_id': 'best[height<=144]', 'ext': 'mp4', 'resolution': '144p', 'type': 'video', 'quality': 144},
-                    {'format_id': 'bestaudio', 'ext': 'mp3', 'resolution': 'Audio Only', 'type': 'audio', 'quality': 320},
-                ]
-                
-                # Add common formats that aren't already present
-                existing_keys = {(f['ext'], f['resolution']) for f in video_info['formats']}
-                for fmt in common_formats:
-                    format_key = (fmt['ext'], fmt['resolution'])
-                    if format_key not in existing_keys:
-                        video_info['formats'].append(fmt)
-                
-                return video_info
-                
+            # Playlists only carry a flat listing; point the client at the batch API
+            if info.get('_type') in ('playlist', 'multi_video'):
+                video_info['is_playlist'] = True
+                video_info['entries'] = self.list_entries(url)
+                video_info['playlist_count'] = len(video_info['entries'])
+            
+            # Formats offered to the client, deduplicated and sorted by the shared index
+            with span('get_video_info', 'listing'):
+                video_info['formats'] = index_for(info).listing()
+            
+            # Add common format options if not available
+            common_formats = [
+                {'format_id': 'best[height<=2160]', 'ext': 'mp4', 'resolution': '2160p (4K)', 'type': 'video', 'quality': 2160},
+                {'format_id': 'best[height<=1440]', 'ext': 'mp4', 'resolution': '1440p (2K)', 'type': 'video', 'quality': 1440},
+                {'format_id': 'best[height<=1080]', 'ext': 'mp4', 'resolution': '1080p (HD)', 'type': 'video', 'quality': 1080},
+                {'format_id': 'best[height<=720]', 'ext': 'mp4', 'resolution': '720p', 'type': 'video', 'quality': 720},
+                {'format_id': 'best[height<=480]', 'ext': 'mp4', 'resolution': '480p', 'type': 'video', 'quality': 480},
+                {'format_id': 'best[height<=360]', 'ext': 'mp4', 'resolution': '360p', 'type': 'video', 'quality': 360},
+                {'format_id': 'best[height<=240]', 'ext': 'mp4', 'resolution': '240p', 'type': 'video', 'quality': 240},
+                {'format_id': 'best[height<=144]', 'ext': 'mp4', 'resolution': '144p', 'type': 'video', 'quality': 144},
+                {'format_id': 'bestaudio', 'ext': 'mp3', 'resolution': 'Audio Only', 'type': 'audio', 'quality': 320},
+            ]
+            
+            # Add common formats that aren't already present
+            existing_keys = {(f['ext'], f['resolution']) for f in video_info['formats']}
+            for fmt in common_formats:
+                format_key = (fmt['ext'], fmt['resolution'])
+                if format_key not in existing_keys:
+                    video_info['formats'].append(fmt)
+            
+            return video_info
+            
+        except RateLimited as e:
+            logging.warning(f"Rate limited extracting video info: {str(e)}")
+            return {'error': f'The site is limiting requests right now: {str(e)}', 'retry_after': int(e.retry_after) + 1}
         except Exception as e:
             logging.error(f"Error extracting video info: {str(e)}")
             return {'error': f'Failed to extract video information: {str(e)}'}
     
 
     
-    def download_video(self, url, format_id=None, audio_only=False, file_format=None, progress_hook=None):
-        """Download video with specified format"""  
+    def plan_stream(self, url, format_id=None, audio_only=False, file_format=None):
+        """Resolve a single direct HTTP format that can be relayed to the client as-is.
+        
+        Returns the media URL, headers and metadata, or {'error': reason} when the
+        request needs merging, conversion or a non-HTTP protocol.
+        """
         try:
-            # Get detailed format information directly from yt-dlp
-            ydl_opts_info = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
+            info = self._extract_info(url)
+            if not info:
+                return {'error': 'Could not extract video information'}
+            
+            selected_format = self._select_best_format(info, format_id, audio_only, file_format)
+            
+            chosen = self._resolve_format(info, selected_format)
+            
+            if chosen.get('requested_formats'):
+                return {'error': 'Selected format needs audio and video merged'}
+            if chosen.get('protocol') not in ('http', 'https'):
+                return {'error': f"Protocol {chosen.get('protocol')} cannot be relayed directly"}
+            
+            ext = chosen.get('ext')
+            if audio_only and chosen.get('vcodec') not in (None, 'none'):
+                return {'error': 'No audio-only stream available'}
+            if file_format and ext != file_format:
+                return {'error': f'Stream is {ext}, conversion to {file_format} required'}
+            
+            return {
+                'url': chosen['url'],
+                'http_headers': chosen.get('http_headers', {}),
+                'ext': ext,
+                'filesize': chosen.get('filesize') or chosen.get('filesize_approx'),
+                'chunk_size': (chosen.get('downloader_options') or {}).get('http_chunk_size'),
+                'title': info.get('title', 'download'),
+                'format_id': chosen.get('format_id'),
             }
+        
+        except Exception as e:
+            logging.error(f"Error planning stream: {str(e)}")
+            return {'error': f'Failed to plan stream: {str(e)}'}
+    
+    def _download_segmented(self, ydl, chosen, connections, progress_hooks):
+        """Fetch a large progressive file over several connections to the path yt-dlp will use.
+        
+        yt-dlp then finds the finished file and only runs the postprocessors. Any
+        failure leaves nothing behind, so yt-dlp downloads it over one connection.
+        """
+        path = ydl.prepare_filename(chosen)
+        download = SegmentedDownload(
+            chosen['url'], path, connections, chosen.get('http_headers'), progress_hooks, chosen,
+            max_segment_size=(chosen.get('downloader_options') or {}).get('http_chunk_size'),
+        )
+        try:
+            download.run()
+        except RangeNotSupported as e:
+            logging.info(f"Segmented download not possible, using one connection: {str(e)}")
+        except (SegmentedDownloadError, OSError) as e:
+            logging.warning(f"Segmented download failed, retrying over one connection: {str(e)}")
+    
+    def download_video(self, url, format_id=None, audio_only=False, file_format=None, progress_hook=None, postprocessor_hook=None, concurrent_fragments=None, plan_hook=None, progress_model=None, transfer=None, connections=None, clip=None):
+        """Download video with specified format"""  
+        try:
+            # Reuse the cached extraction from get_video_info when available
+            with span('download_video', 'extract'):
+                info = self._extract_info(url)
+            if not info:
+                DOWNLOADS.inc(outcome='error')
+                return {'error': 'Could not extract video information'}
             
-            with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    return {'error': 'Could not extract video information'}
-                
-                # Get the raw formats from yt-dlp for better format selection
-                raw_formats = info.get('formats', [])
-                
-                # Configure format selection based on quality and file format preferences
-                if audio_only:
-                    selected_format = self._select_best_format(raw_formats, format_id, True)
-                else:
-                    # For video downloads, select the best matching format using raw format data
-                    selected_format = self._select_best_format(raw_formats, format_id, False)
-                    
-                logging.info(f"Selected format: {selected_format} for requested: {format_id}")
+            # Select from the format index built once per extraction
+            with span('download_video', 'select'):
+                selected_format = self._select_best_format(info, format_id, audio_only, file_format)
                 
-                # Store video info for later use
-                video_title = info.get('title', 'download')
+            logging.info(f"Selected format: {selected_format} for requested: {format_id}")
+            
+            duration = info.get('duration')
+            if clip:
+                if not find_ffmpeg():
+                    DOWNLOADS.inc(outcome='error')
+                    return {'error': 'Clip downloads need ffmpeg, which is not installed on this server'}
+                if duration and clip[0] >= duration:
+                    DOWNLOADS.inc(outcome='error')
+                    return {'error': f'Clip starts after the end of the video ({int(duration)}s)'}
+            
+            if self.temp_dir is None:
+                self.temp_dir = tempfile.mkdtemp()
             
             # Set download options
             ydl_opts = {
                 'outtmpl': os.path.join(self.temp_dir, '%(title)s.%(ext)s'),
                 'format': selected_format,
+                # Keep real write times so storage cleanup can tell fresh files from stale ones
+                'updatetime': False,
+                'concurrent_fragment_downloads': concurrent_fragments or CONCURRENT_FRAGMENTS,
+                # yt-dlp's console progress line is redrawn on every hook call; only worth it when debugging
+                'noprogress': not logging.getLogger().isEnabledFor(logging.DEBUG),
             }
             
+            # Track the exact output path through download and postprocessing
+            tracker = OutputTracker()
+            ydl_opts['progress_hooks'] = [tracker.progress_hook, ThroughputRecorder().progress_hook]
+            ydl_opts['postprocessor_hooks'] = [tracker.postprocessor_hook]
             if progress_hook:
-                ydl_opts['progress_hooks'] = [progress_hook]
+                ydl_opts['progress_hooks'].append(progress_hook)
+            if postprocessor_hook:
+                ydl_opts['postprocessor_hooks'].append(postprocessor_hook)
             
-            # Handle audio-only downloads
-            if audio_only:
-                if file_format and file_format not in ['mp3', 'm4a']:
-                    ydl_opts['postprocessors'] = [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': file_format,
-                        'preferredquality': '192' if file_format == 'mp3' else 'best',
-                    }]
-            else:
-                # Handle video downloads with format conversion
-                if file_format and file_format != 'mp4':
-                    # Configure FFmpeg path explicitly
-                    ydl_opts['ffmpeg_location'] = '/nix/store/3zc5jbvqzrn8zmva4fx5p0nh4yy03wk4-ffmpeg-6.1.1-bin/bin/ffmpeg'
-                    
-                    # Add video converter with proper format conversion
-                    if file_format == '3gp':
-                        # For 3GP, use most basic conversion that works
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegVideoConvertor',
-                            'preferedformat': '3gp',
-                        }]
-                        # Minimal conversion args for maximum compatibility
-                        ydl_opts['postprocessor_args'] = {
-                            'ffmpeg': ['-c:v', 'libx264', '-c:a', 'aac', '-f', '3gp']
-                        }
-                    else:
-                        # For other formats, use standard conversion
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegVideoConvertor',
-                            'preferedformat': file_format,
-                        }]
+            # Only the clip's window is fetched: ffmpeg seeks the media URL (range requests) or
+            # the playlist (only the segments that cover it), cutting at keyframes
+            if clip:
+                ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(
+                    None, [(clip[0], clip[1] if clip[1] is not None else float('inf'))])
+                ydl_opts['force_keyframes_at_cuts'] = CLIP_EXACT_CUTS
+                ydl_opts['outtmpl'] = os.path.join(self.temp_dir, f'%(title)s ({clip_label(clip)}).%(ext)s')
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                
-                # Find the downloaded file - get all files in temp directory
-                title = info.get('title', 'download')
-                temp_files = []
-                
+            # Paced at the job's share of the bandwidth; yt-dlp's ratelimit caps each connection
+            if transfer:
+                ydl_opts['ratelimit'] = transfer.ceiling(ydl_opts['concurrent_fragment_downloads'])
+                ydl_opts['progress_hooks'].append(transfer.progress_hook)
+            
+            # Copy streams into the target container when their codecs fit; encode only the rest
+            with span('download_video', 'plan'):
+                chosen = self._resolve_format(info, selected_format)
+                plan = plan_conversion(chosen, file_format, audio_only)
+                plan.apply(ydl_opts)
+            logging.info(f"Conversion plan for {file_format}: {plan.action} ({plan.reason})")
+            described = self._describe_plan(chosen, selected_format, plan)
+            if clip:
+                # Stage weights and ETA follow the bytes of the clip, not of the whole video
+                fraction = clip_fraction(clip, duration)
+                if described['download_bytes']:
+                    described['download_bytes'] = int(described['download_bytes'] * fraction)
+                for stream in described['streams']:
+                    if stream['bytes']:
+                        stream['bytes'] = int(stream['bytes'] * fraction)
+                described['clip'] = clip
+                if duration:
+                    duration = duration * fraction
+            if plan_hook:
+                plan_hook(described)
+            
+            # Stage-weighted progress, including ffmpeg's own progress while merging or converting
+            if progress_model:
+                progress_model.configure(described, duration)
+                ydl_opts['progress_hooks'].append(progress_model.progress_hook)
+                ydl_opts['postprocessor_hooks'].append(progress_model.postprocessor_hook)
+                progress_args = progress_model.ffmpeg_args(os.path.join(self.temp_dir, 'ffmpeg-progress.txt'))
+                pp_args = ydl_opts.setdefault('postprocessor_args', {})
+                for key in FFMPEG_ARG_KEYS:
+                    pp_args[key] = pp_args.get(key, []) + progress_args
+            timer = ConversionTimer()
+            ydl_opts['postprocessor_hooks'].append(timer.postprocessor_hook)
+            
+            # Pooled per profile: postprocessors are part of the profile, format/paths/hooks are per lease
+            with ydl_pool.lease('audio' if audio_only else 'video', ydl_opts) as ydl, span('download_video', 'download'):
+                # Large progressive files come over several connections when enabled; CDNs often throttle each one
+                connections = connections or SEGMENTED_CONNECTIONS
+                if not clip and SegmentedDownload.applicable(chosen, connections):
+                    self._download_segmented(ydl, chosen, connections, ydl_opts['progress_hooks'])
                 try:
-                    temp_files = os.listdir(self.temp_dir)
-                    logging.info(f"Files in temp directory: {temp_files}")
-                except Exception as e:
-                    logging.error(f"Error listing temp directory: {e}")
-                
-                found_file = None
+                    # Download straight from the extracted info instead of extracting again
+                    info = ydl.process_ie_result(ydl.sanitize_info(info), download=True)
+                except yt_dlp.utils.DownloadError as e:
+                    # Cached media URLs may have expired; extract fresh and retry once
+                    logging.warning(f"Download from cached info failed, re-extracting: {e}")
+                    info_cache.invalidate(cache_key(url))
+                    with rate_limiter.request(url):
+                        info = ydl.extract_info(url, download=True)
                 
-                # Look for downloaded files (newest files first)
-                if temp_files:
-                    # Sort by modification time (newest first)
-                    temp_files_with_path = [(f, os.path.join(self.temp_dir, f)) for f in temp_files]
-                    temp_files_with_path.sort(key=lambda x: os.path.getmtime(x[1]), reverse=True)
-                    
-                    # Take the most recently modified file
-                    for file_name, file_path in temp_files_with_path:
-                        if os.path.isfile(file_path) and file_name.lower().endswith(('.mp4', '.webm', '.mkv', '.avi', '.3gp', '.mp3', '.m4a')):
-                            found_file = file_path
-                            logging.info(f"Found downloaded file: {found_file}")
-                            break
+                title = info.get('title', 'download')
+                found_file = tracker.final_path(info)
                 
-                if found_file and os.path.exists(found_file):
+                if found_file:
+                    logging.info(f"Downloaded file: {found_file}")
+                    DOWNLOADS.inc(outcome='ok')
                     return {
                         'status': 'success',
                         'filename': found_file,
                         'title': title,
-                        'filesize': os.path.getsize(found_file)
+                        'filesize': os.path.getsize(found_file),
+                        'conversion': dict(plan.to_dict(), steps=timer.steps, seconds=timer.total()),
                     }
                 else:
-                    logging.error(f"No suitable file found in temp directory. Available files: {temp_files}")
-                    return {'error': f'Downloaded file not found. Available files: {", ".join(temp_files) if temp_files else "none"}'}
+                    logging.error("yt-dlp finished without reporting an output file")
+                    DOWNLOADS.inc(outcome='error')
+                    return {'error': 'Downloaded file not found'}
                     
+        except RateLimited as e:
+            # Nothing was downloaded yet; the caller decides whether to come back later
+            logging.warning(f"Rate limited downloading video: {str(e)}")
+            return {'error': f'The site is limiting requests right now: {str(e)}', 'retry_after': int(e.retry_after) + 1}
         except Exception as e:
+            DOWNLOADS.inc(outcome='error')
             logging.error(f"Error downloading video: {str(e)}")
             return {'error': f'Failed to download video: {str(e)}'}
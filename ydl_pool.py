@@ -0,0 +1,173 @@
+import os
+import json
+import threading
+import logging
+from contextlib import contextmanager
+
+# Idle YoutubeDL instances kept per option profile
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 32))
+
+# Uses after which an instance is closed and replaced (bounds cookie/cache growth)
+YDL_MAX_USES = int(os.environ.get('YDL_MAX_USES', 100))
+
+# Options that change on every request; they are applied to a leased instance
+# instead of becoming part of its profile
+PER_REQUEST_OPTS = ('outtmpl', 'format', 'progress_hooks', 'postprocessor_hooks')
+
+# Plain params yt-dlp reads at download time, so they can be set per lease
+DYNAMIC_PARAMS = ('concurrent_fragment_downloads', 'postprocessor_args', 'ratelimit', 'download_ranges',
+                  'force_keyframes_at_cuts')
+
+
+class _PooledYDL:
+    """One YoutubeDL instance plus the per-lease hooks it forwards to"""
+
+    def __init__(self, opts):
+        import yt_dlp
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        self.uses = 0
+        self.ydl = yt_dlp.YoutubeDL(dict(
+            opts,
+            progress_hooks=[self._on_progress],
+            postprocessor_hooks=[self._on_postprocess],
+        ))
+        self.baseline_params = dict(self.ydl.params)
+        self.baseline_outtmpl = dict(self.ydl.params['outtmpl'])
+        self.baseline_selector = self.ydl.format_selector
+
+    def _on_progress(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _on_postprocess(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def apply(self, per_request):
+        ydl = self.ydl
+        for key in DYNAMIC_PARAMS:
+            if key in per_request:
+                ydl.params[key] = per_request[key]
+        outtmpl = per_request.get('outtmpl')
+        if outtmpl:
+            # Same forms YoutubeDL accepts: a template string or {type: template}
+            overrides = outtmpl if isinstance(outtmpl, dict) else {'default': outtmpl}
+            ydl.params['outtmpl'] = dict(self.baseline_outtmpl, **overrides)
+        if per_request.get('format'):
+            ydl.params['format'] = per_request['format']
+            ydl.format_selector = ydl.build_format_selector(per_request['format'])
+        self.progress_hooks = list(per_request.get('progress_hooks') or [])
+        self.postprocessor_hooks = list(per_request.get('postprocessor_hooks') or [])
+
+    def reset(self):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        self.ydl.params.clear()
+        self.ydl.params.update(self.baseline_params)
+        self.ydl.params['outtmpl'] = dict(self.baseline_outtmpl)
+        self.ydl.format_selector = self.baseline_selector
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logging.debug(f"Closing pooled YoutubeDL failed: {e}")
+
+
+class YDLPool:
+    """Reuses YoutubeDL instances per option profile instead of building one per request.
+
+    Building a YoutubeDL registers every extractor, creates a cookie jar and
+    later an HTTP opener with its TLS context; a pooled instance keeps all of
+    that (and its cookies) between requests. Each instance is leased to one
+    thread at a time. Per-request options (output template, format, hooks and
+    a few download-time params) are applied for the lease and reset after it.
+    Instances are closed after max_uses leases or when a lease raises.
+    """
+
+    def __init__(self, max_idle=32, max_uses=100):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _static_opts(opts):
+        return {k: v for k, v in opts.items() if k not in PER_REQUEST_OPTS and k not in DYNAMIC_PARAMS}
+
+    def profile_key(self, profile, opts):
+        return profile, json.dumps(self._static_opts(opts), sort_keys=True, default=repr)
+
+    def _checkout(self, key, static_opts):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return _PooledYDL(static_opts)
+
+    def _checkin(self, key, pooled, broken):
+        pooled.uses += 1
+        if not broken and pooled.uses < self.max_uses:
+            pooled.reset()
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(pooled)
+                    return
+        with self._lock:
+            self.recycled += 1
+        pooled.close()
+
+    @contextmanager
+    def lease(self, profile, opts):
+        """Yield a YoutubeDL configured with opts, borrowed from the pool for the profile"""
+        key = self.profile_key(profile, opts)
+        pooled = self._checkout(key, self._static_opts(opts))
+        broken = True
+        try:
+            pooled.apply(opts)
+            yield pooled.ydl
+            broken = False
+        finally:
+            self._checkin(key, pooled, broken)
+
+    def prewarm(self, profile, opts, count=1):
+        """Build idle instances ahead of the first request"""
+        key = self.profile_key(profile, opts)
+        for _ in range(count):
+            with self._lock:
+                if len(self._idle.get(key, [])) >= self.max_idle:
+                    return
+                self.created += 1
+            pooled = _PooledYDL(self._static_opts(opts))
+            with self._lock:
+                self._idle.setdefault(key, []).append(pooled)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for pooled in instances:
+                pooled.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._idle),
+                'idle': sum(len(v) for v in self._idle.values()),
+                'created': self.created,
+                'reused': self.reused,
+                'recycled': self.recycled,
+                'max_idle': self.max_idle,
+                'max_uses': self.max_uses,
+            }
+
+
+# Shared pool for this process
+ydl_pool = YDLPool(max_idle=YDL_POOL_SIZE, max_uses=YDL_MAX_USES)